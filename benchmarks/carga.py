@@ -0,0 +1,491 @@
+"""
+Benchmark de carga de extremo a extremo contra el mock local de OpenAI.
+
+Simula N sesiones de chat concurrentes que reproducen las conversaciones de
+`benchmarks/consultas.json` (orden fijo por semilla) a través del código real
+del backend: `EstadoChat.enviar_mensaje` (modo "estado", el handler de Reflex
+sobre una instancia de estado sin servidor) o directamente `LLMClient`
+(modos "stream", "async" y "sync"). Las llamadas a OpenAI van al servidor de
+`mock_openai.py`, así que funciona sin conexión y sin costo.
+
+Reporta:
+    - latencia p50/p95/p99 por etapa: rag, embedding, primer_token, generacion, turno
+    - throughput (turnos por segundo)
+    - tokens enviados al modelo por turno (aprox. 4 caracteres/token, medido en el mock)
+    - memoria (RSS actual y pico) de cada worker
+
+Uso:
+    python benchmarks/carga.py --sesiones 50 --turnos 3 --guardar benchmarks/resultados/base.json
+    python benchmarks/carga.py --sesiones 50 --turnos 3 --comparar benchmarks/resultados/base.json
+
+Por defecto se genera un vector store sintético (`--chunks`) con embeddings del
+mock, para que la búsqueda tenga el tamaño deseado y sea reproducible; con
+`--chunks 0` se usa el vector store real (VECTOR_STORE_DIR).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextvars
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_openai import vector_mock, iniciar_en_hilo, agregar_argumentos, config_desde_argumentos
+
+CONSULTAS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "consultas.json")
+MODOS = ("estado", "stream", "async", "sync")
+# Métricas donde un valor más alto es mejor (el resto: más bajo es mejor)
+MAYOR_ES_MEJOR = {"throughput_turnos_seg"}
+
+# Registro del turno en curso: los envoltorios de instrumentar() acumulan ahí sus tiempos
+_turno_actual = contextvars.ContextVar("turno_actual", default=None)
+
+
+def percentiles(valores: list[float], escala: float = 1.0) -> dict:
+    if not valores:
+        return {"n": 0}
+    x = np.asarray(valores, dtype=np.float64) * escala
+    return {
+        "n": int(len(x)),
+        "media": round(float(x.mean()), 2),
+        "p50": round(float(np.percentile(x, 50)), 2),
+        "p95": round(float(np.percentile(x, 95)), 2),
+        "p99": round(float(np.percentile(x, 99)), 2),
+        "max": round(float(x.max()), 2),
+    }
+
+
+def memoria_mb() -> dict:
+    """RSS actual y pico del proceso en MB (None si la plataforma no lo expone)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            campos = dict(linea.split(":", 1) for linea in f if ":" in linea)
+        return {
+            "rss": round(int(campos["VmRSS"].split()[0]) / 1024, 1),
+            "pico": round(int(campos["VmHWM"].split()[0]) / 1024, 1),
+        }
+    except (OSError, KeyError):
+        pass
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        pico = pico / 1024 if sys.platform != "darwin" else pico / 1024 / 1024
+        return {"rss": None, "pico": round(pico, 1)}
+    except ImportError:
+        return {"rss": None, "pico": None}
+
+
+# --- Vector store sintético ---
+
+def construir_store_sintetico(directorio: str, n_chunks: int, dimension: int, tipo_indice: str,
+                              vocabulario: list, semilla: int) -> str:
+    """
+    Genera un vector store de `n_chunks` entradas de diccionario con embeddings del
+    mock. Se reutiliza si ya existe uno con los mismos parámetros.
+    """
+    import faiss
+    from chatbot.chunk_store import escribir_chunk_store
+    from chatbot.indice import nuevos_parametros, construir_indice, guardar_parametros
+    from chatbot.lexico import IndiceLexico
+
+    firma = {"chunks": n_chunks, "dimension": dimension, "tipo": tipo_indice, "semilla": semilla}
+    ruta_firma = os.path.join(directorio, "sintetico.json")
+    if os.path.exists(ruta_firma):
+        with open(ruta_firma, "r", encoding="utf-8") as f:
+            if json.load(f) == firma:
+                return directorio
+
+    print(f"🏗️ Generando vector store sintético ({n_chunks} chunks, índice {tipo_indice}) en {directorio}...")
+    os.makedirs(directorio, exist_ok=True)
+    rng = random.Random(semilla)
+    metadatas = {}
+    for i in range(n_chunks):
+        entradas = rng.sample(vocabulario, k=min(4, len(vocabulario)))
+        texto = " ".join(f"{gn}: {es}." for gn, es in entradas)
+        metadatas[i] = {
+            "source": f"sintetico_{i // 500:03d}.pdf",
+            "chunk_index": i % 500,
+            "pagina_inicio": i % 500 // 3 + 1,
+            "pagina_fin": i % 500 // 3 + 1,
+            "text": texto,
+        }
+    vectores = np.stack([vector_mock(m["text"], dimension) for m in metadatas.values()])
+    params = nuevos_parametros(tipo_indice)
+    index = construir_indice(vectores, np.arange(n_chunks, dtype=np.int64), params)
+
+    faiss.write_index(index, os.path.join(directorio, "index.faiss"))
+    guardar_parametros(os.path.join(directorio, "index_params.json"), params)
+    escribir_chunk_store(os.path.join(directorio, "chunks.bin"), metadatas)
+    IndiceLexico.construir((i, m["text"]) for i, m in metadatas.items()).guardar(os.path.join(directorio, "lexico"))
+    with open(ruta_firma, "w", encoding="utf-8") as f:
+        json.dump(firma, f)
+    return directorio
+
+
+# --- Instrumentación ---
+
+def _cronometrar(objeto, nombre: str, etapa: str):
+    """Reemplaza `objeto.nombre` por una versión que suma su duración al turno en curso."""
+    original = getattr(objeto, nombre, None)
+    if original is None:
+        return
+
+    def registrar(inicio: float):
+        registro = _turno_actual.get()
+        if registro is not None:
+            registro[etapa] = registro.get(etapa, 0.0) + time.perf_counter() - inicio
+
+    if asyncio.iscoroutinefunction(original):
+        async def envoltorio(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                registrar(inicio)
+    else:
+        def envoltorio(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                registrar(inicio)
+    setattr(objeto, nombre, envoltorio)
+
+
+def instrumentar(rag_client):
+    for nombre in ("recuperar", "arecuperar"):
+        _cronometrar(rag_client, nombre, "rag")
+    for nombre in ("_embedding", "_aembedding"):
+        _cronometrar(rag_client, nombre, "embedding")
+
+
+# --- Sesiones simuladas ---
+
+async def _turno(modo: str, sesion: dict, texto: str, registro: dict, inicio: float):
+    """Ejecuta un turno por el camino indicado. Devuelve el texto de la respuesta."""
+    from chatbot.prompts import SYSTEM_PROMPT
+
+    if modo == "estado":
+        from chatbot.state import EstadoChat
+        estado = sesion["estado"]
+        estado.entrada_usuario = texto
+        async for _ in EstadoChat.enviar_mensaje.fn(estado):
+            if estado.transmitiendo and "primer_token" not in registro:
+                registro["primer_token"] = time.perf_counter() - inicio
+        if estado.aviso:
+            # Rechazado por el control de admisión (cola llena o espera vencida)
+            raise RuntimeError("ocupado")
+        return estado.mensajes[-1]["content"] if estado.mensajes else ""
+
+    historial, llm_client = sesion["historial"], sesion["llm_client"]
+    historial.append({"role": "user", "content": texto})
+    if modo == "stream":
+        partes = []
+        async for delta in llm_client.obtener_respuesta_stream(historial, SYSTEM_PROMPT):
+            if not partes:
+                registro["primer_token"] = time.perf_counter() - inicio
+            partes.append(delta)
+        respuesta = "".join(partes)
+    elif modo == "async":
+        respuesta = await llm_client.aobtener_respuesta(historial, SYSTEM_PROMPT)
+    else:
+        respuesta = await asyncio.to_thread(llm_client.obtener_respuesta, historial, SYSTEM_PROMPT)
+    historial.append({"role": "assistant", "content": respuesta})
+    return respuesta
+
+
+def _llm_client():
+    """El singleton del backend si ya se importó el estado; si no, uno propio (sin Reflex)."""
+    if "chatbot.state" in sys.modules:
+        return sys.modules["chatbot.state"].llm_client
+    global _cliente_llm
+    if _cliente_llm is None:
+        from chatbot.llm import LLMClient
+        _cliente_llm = LLMClient()
+    return _cliente_llm
+
+
+_cliente_llm = None
+
+
+async def _sesion(i: int, conversacion: list[str], args: dict, registros: list, errores: list):
+    from chatbot.llm import MENSAJE_ERROR
+
+    sesion = {"historial": []}
+    if args["modo"] == "estado":
+        from chatbot.state import EstadoChat
+        sesion["estado"] = EstadoChat(_reflex_internal_init=True)
+    else:
+        sesion["llm_client"] = _llm_client()
+
+    await asyncio.sleep(args["rampa_seg"] * i / max(1, args["sesiones"]))
+    for texto in conversacion[:args["turnos"]]:
+        registro = {}
+        token = _turno_actual.set(registro)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await _turno(args["modo"], sesion, texto, registro, inicio)
+            if respuesta in (MENSAJE_ERROR, "Ocurrió un error inesperado."):
+                errores.append(texto)
+        except Exception as e:
+            errores.append(f"{texto}: {e}")
+        finally:
+            _turno_actual.reset(token)
+        registro["turno"] = time.perf_counter() - inicio
+        registro["generacion"] = registro["turno"] - registro.get("rag", 0.0)
+        registros.append(registro)
+        if args["pausa_ms"]:
+            await asyncio.sleep(args["pausa_ms"] / 1000)
+
+
+def ejecutar_worker(args: dict, sesiones: list[int], base_url: str, store_dir: str) -> dict:
+    """Corre un grupo de sesiones en este proceso (un "worker" del backend)."""
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    # Sin caché en disco compartida entre corridas: los resultados deben ser comparables
+    os.environ.setdefault("EMB_CACHE_DISCO", "")
+    # Conversaciones en un archivo temporal por worker (ejercita la escritura diferida)
+    os.environ.setdefault("CONVERSACIONES_DB", os.path.join(tempfile.mkdtemp(prefix="guarani_bench_"), "conversaciones.sqlite"))
+    if store_dir:
+        os.environ["VECTOR_STORE_DIR"] = store_dir
+
+    import logging
+    memoria_inicial = memoria_mb()
+    from chatbot.rag_client import rag_client
+    from chatbot.clientes import cerrar_clientes
+    if not args["verbose"]:
+        for nombre in ("ChatbotReflex", "openai", "httpx", "httpx2"):
+            logging.getLogger(nombre).setLevel(logging.WARNING)
+    if args["modo"] == "estado":
+        # Se importa fuera del event loop: Reflex registra los estados en un contextvar
+        import chatbot.state  # noqa: F401
+    instrumentar(rag_client)
+    memoria_cargado = memoria_mb()
+
+    with open(CONSULTAS_PATH, "r", encoding="utf-8") as f:
+        conversaciones = json.load(f)["conversaciones"]
+    orden = list(range(len(conversaciones)))
+    random.Random(args["semilla"]).shuffle(orden)
+
+    registros, errores = [], []
+
+    async def principal():
+        # to_thread (modo "sync") usa el executor por defecto: uno por sesión
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(1, len(sesiones))))
+        try:
+            await asyncio.gather(*(
+                _sesion(i, conversaciones[orden[i % len(orden)]], args, registros, errores)
+                for i in sesiones
+            ))
+        finally:
+            await cerrar_clientes()
+
+    inicio = time.perf_counter()
+    asyncio.run(principal())
+    duracion = time.perf_counter() - inicio
+
+    cache = rag_client.cache_embeddings.estadisticas() if hasattr(rag_client, "cache_embeddings") else None
+    llm = _llm_client()
+    agrupacion = {
+        nombre: objeto.estadisticas()
+        for nombre, objeto in (
+            ("embeddings", getattr(rag_client, "vuelos_embedding", None)),
+            ("completions", getattr(llm, "vuelos_completion", None)),
+            ("completions_stream", getattr(llm, "difusion_stream", None)),
+        )
+        if objeto is not None
+    }
+    return {
+        "registros": registros,
+        "errores": errores,
+        "duracion": duracion,
+        "memoria": {"inicial": memoria_inicial, "cargado": memoria_cargado, "final": memoria_mb()},
+        "cache_embeddings": cache,
+        "agrupacion": agrupacion,
+        "microlotes": {
+            nombre: lote.estadisticas()
+            for nombre, lote in (("embeddings", getattr(rag_client, "lotes_embedding", None)),
+                                 ("busquedas", getattr(rag_client, "lotes_busqueda", None)))
+            if lote is not None
+        },
+    }
+
+
+def _estadisticas_mock(base_url: str) -> dict:
+    url = base_url.rsplit("/v1", 1)[0] + "/estadisticas"
+    with urllib.request.urlopen(url, timeout=10) as r:
+        return json.load(r)
+
+
+# --- Resultados ---
+
+def resumir(args: dict, workers: list[dict], duracion: float, tokens_prompt: list[int],
+            mock_inicio: dict, mock_fin: dict) -> dict:
+    registros = [r for w in workers for r in w["registros"]]
+    etapas = {}
+    for etapa in ("rag", "embedding", "primer_token", "generacion", "turno"):
+        valores = [r[etapa] for r in registros if etapa in r]
+        if valores:
+            etapas[etapa] = percentiles(valores, escala=1000)
+
+    peticiones = {k: mock_fin["peticiones"][k] - mock_inicio["peticiones"].get(k, 0) for k in mock_fin["peticiones"]}
+    return {
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": args,
+        "turnos": len(registros),
+        "errores": sum(len(w["errores"]) for w in workers),
+        "duracion_seg": round(duracion, 2),
+        "throughput_turnos_seg": round(len(registros) / duracion, 2) if duracion else 0.0,
+        "latencia_ms": etapas,
+        "tokens_prompt_por_turno": percentiles(tokens_prompt),
+        "mock": {
+            "peticiones": peticiones,
+            "errores_inyectados": mock_fin["errores_inyectados"] - mock_inicio["errores_inyectados"],
+        },
+        "memoria_mb_por_worker": [w["memoria"] for w in workers],
+        "cache_embeddings": [w["cache_embeddings"] for w in workers],
+        "agrupacion": [w["agrupacion"] for w in workers],
+        "microlotes": [w["microlotes"] for w in workers],
+    }
+
+
+def metricas_planas(resultado: dict) -> dict:
+    """Métricas comparables entre corridas, con nombres tipo 'turno.p95'."""
+    planas = {"throughput_turnos_seg": resultado["throughput_turnos_seg"], "errores": resultado["errores"]}
+    for etapa, p in resultado["latencia_ms"].items():
+        for clave in ("p50", "p95", "p99"):
+            if clave in p:
+                planas[f"{etapa}.{clave}"] = p[clave]
+    if "media" in resultado["tokens_prompt_por_turno"]:
+        planas["tokens_prompt.media"] = resultado["tokens_prompt_por_turno"]["media"]
+    picos = [w["final"]["pico"] for w in resultado["memoria_mb_por_worker"] if w["final"]["pico"] is not None]
+    if picos:
+        planas["memoria_pico_mb.max"] = max(picos)
+    return planas
+
+
+def imprimir_resultado(resultado: dict):
+    print(f"\n📊 {resultado['turnos']} turnos en {resultado['duracion_seg']} s "
+          f"({resultado['throughput_turnos_seg']} turnos/s), errores: {resultado['errores']}")
+    print(f"\n{'etapa':<14}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for etapa, p in resultado["latencia_ms"].items():
+        print(f"{etapa:<14}{p['n']:>6}{p['p50']:>10}{p['p95']:>10}{p['p99']:>10}{p['max']:>10}")
+    t = resultado["tokens_prompt_por_turno"]
+    if t.get("n"):
+        print(f"\nTokens enviados por turno (aprox.): media {t['media']}, p95 {t['p95']}, max {t['max']}")
+    print(f"Peticiones al mock: {resultado['mock']['peticiones']} "
+          f"(errores inyectados: {resultado['mock']['errores_inyectados']})")
+    for i, agrupacion in enumerate(resultado["agrupacion"]):
+        agrupadas = {nombre: e["agrupadas"] for nombre, e in agrupacion.items()}
+        print(f"Llamadas agrupadas worker {i}: {agrupadas}")
+    for i, lotes in enumerate(resultado["microlotes"]):
+        if lotes:
+            medios = {nombre: round(e["tamano_medio"], 1) for nombre, e in lotes.items()}
+            print(f"Tamaño medio de micro-lote worker {i}: {medios}")
+    for i, m in enumerate(resultado["memoria_mb_por_worker"]):
+        print(f"Memoria worker {i}: inicial {m['inicial']['rss']} MB, con índice {m['cargado']['rss']} MB, "
+              f"final {m['final']['rss']} MB, pico {m['final']['pico']} MB")
+
+
+def comparar(resultado: dict, base: dict, tolerancia: float) -> list[str]:
+    """Imprime la comparación contra la línea base y devuelve las regresiones."""
+    actual, anterior = metricas_planas(resultado), metricas_planas(base)
+    regresiones = []
+    print(f"\n🔍 Comparación contra la línea base del {base.get('fecha', '?')} (tolerancia {tolerancia:.0%})")
+    print(f"{'métrica':<24}{'base':>12}{'actual':>12}{'Δ':>10}")
+    for clave in sorted(set(actual) & set(anterior)):
+        a, b = actual[clave], anterior[clave]
+        delta = (a - b) / b if b else (0.0 if a == b else float("inf"))
+        peor = -delta if clave in MAYOR_ES_MEJOR else delta
+        marca = ""
+        if peor > tolerancia and (clave != "errores" or a > b):
+            marca = " ⚠️"
+            regresiones.append(clave)
+        print(f"{clave:<24}{b:>12}{a:>12}{delta:>+10.1%}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga del chatbot contra un mock local de OpenAI.")
+    parser.add_argument("--sesiones", type=int, default=50, help="Sesiones de chat concurrentes")
+    parser.add_argument("--turnos", type=int, default=3, help="Máximo de turnos por sesión")
+    parser.add_argument("--modo", choices=MODOS, default="estado",
+                        help="estado: EstadoChat.enviar_mensaje; stream/async/sync: LLMClient directo")
+    parser.add_argument("--procesos", type=int, default=1, help="Workers (procesos) entre los que se reparten las sesiones")
+    parser.add_argument("--rampa-seg", type=float, default=1.0, help="Tiempo en el que arrancan todas las sesiones")
+    parser.add_argument("--pausa-ms", type=float, default=0.0, help="Pausa entre turnos de una sesión")
+    parser.add_argument("--chunks", type=int, default=5000, help="Tamaño del vector store sintético (0 = usar el real)")
+    parser.add_argument("--tipo-indice", default="flat-ip", help="Tipo de índice del vector store sintético")
+    parser.add_argument("--url-mock", default="", help="Usar un mock ya levantado (p. ej. http://127.0.0.1:8765/v1)")
+    parser.add_argument("--guardar", default="", help="Guardar el resultado en este JSON (línea base)")
+    parser.add_argument("--comparar", default="", help="Comparar contra un resultado guardado")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="Regresión tolerada al comparar (0.10 = 10%%)")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los logs del backend")
+    agregar_argumentos(parser)
+    cli = parser.parse_args()
+
+    config_mock = config_desde_argumentos(cli)
+    args = {
+        "modo": cli.modo, "sesiones": cli.sesiones, "turnos": cli.turnos, "procesos": cli.procesos,
+        "rampa_seg": cli.rampa_seg, "pausa_ms": cli.pausa_ms, "chunks": cli.chunks,
+        "tipo_indice": cli.tipo_indice, "semilla": cli.semilla, "verbose": cli.verbose,
+        "mock": vars(config_mock) if not cli.url_mock else cli.url_mock,
+    }
+
+    base_url = cli.url_mock
+    if not base_url:
+        _, _, base_url = iniciar_en_hilo(config_mock)
+        print(f"🧪 Mock de OpenAI en {base_url}")
+
+    store_dir = ""
+    if cli.chunks > 0:
+        with open(CONSULTAS_PATH, "r", encoding="utf-8") as f:
+            vocabulario = json.load(f)["vocabulario"]
+        store_dir = construir_store_sintetico(
+            os.path.join(tempfile.gettempdir(), f"guarani_bench_{cli.chunks}_{cli.dimension}_{cli.tipo_indice}"),
+            cli.chunks, cli.dimension, cli.tipo_indice, vocabulario, cli.semilla,
+        )
+
+    mock_inicio = _estadisticas_mock(base_url)
+    grupos = [list(range(cli.sesiones))[p::cli.procesos] for p in range(cli.procesos)]
+    print(f"🚀 {cli.sesiones} sesiones × {cli.turnos} turnos, modo '{cli.modo}', {cli.procesos} worker(s)...")
+    inicio = time.perf_counter()
+    if cli.procesos == 1:
+        workers = [ejecutar_worker(args, grupos[0], base_url, store_dir)]
+    else:
+        with get_context("spawn").Pool(cli.procesos) as pool:
+            workers = pool.starmap(ejecutar_worker, [(args, g, base_url, store_dir) for g in grupos])
+    duracion = time.perf_counter() - inicio
+    mock_fin = _estadisticas_mock(base_url)
+
+    tokens_prompt = mock_fin["tokens_prompt"][len(mock_inicio["tokens_prompt"]):]
+    resultado = resumir(args, workers, duracion, tokens_prompt, mock_inicio, mock_fin)
+    imprimir_resultado(resultado)
+
+    if cli.guardar:
+        os.makedirs(os.path.dirname(os.path.abspath(cli.guardar)), exist_ok=True)
+        with open(cli.guardar, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Resultado guardado en {cli.guardar}")
+
+    if cli.comparar:
+        with open(cli.comparar, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(resultado, base, cli.tolerancia)
+        if regresiones:
+            print(f"\n❌ Regresiones: {', '.join(regresiones)}")
+            sys.exit(1)
+        print("\n✅ Sin regresiones respecto de la línea base.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Servidor local que emula los endpoints de OpenAI que usa el chatbot, para medir
+el rendimiento sin conexión y sin gastar créditos.
+
+Endpoints:
+    POST /v1/embeddings          vectores deterministas (hash del texto), float o base64
+    POST /v1/chat/completions    respuesta de relleno, con o sin streaming (SSE)
+    GET  /estadisticas           contadores de peticiones, errores y tokens recibidos
+
+La latencia de cada llamada es `base ± jitter` (normal truncada en 0); en el chat
+con streaming la base es el tiempo hasta el primer token y luego se espera
+`ms_por_token` entre fragmentos. Con `tasa_error` > 0 una fracción de las
+peticiones responde 500/429, que el chatbot reintenta dentro del plazo de cada etapa
+(chatbot/resiliencia.py; los clientes de OpenAI se crean con max_retries=0).
+
+Uso independiente:
+    python benchmarks/mock_openai.py --puerto 8765 --latencia-chat-ms 600 --jitter-ms 150
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 reflex run
+"""
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Palabras de relleno para las respuestas simuladas
+_PALABRAS = (
+    "che ñe'ẽ avañe'ẽ jagua mba'e kuña karai mitã óga tembiapo ára yvy y ka'a "
+    "la palabra significa en castellano se usa para indicar el sustantivo verbo "
+    "ejemplo según el diccionario gramática guaraní nasal oral sufijo prefijo"
+).split()
+
+
+@dataclass
+class ConfigMock:
+    latencia_embedding_ms: float = 40.0
+    latencia_chat_ms: float = 500.0   # hasta el primer token (o la respuesta completa sin stream)
+    ms_por_token: float = 15.0
+    jitter_ms: float = 50.0
+    tokens_respuesta: int = 120
+    tasa_error: float = 0.0
+    dimension: int = 1536
+    semilla: int = 0
+
+
+def contar_tokens(texto: str) -> int:
+    """Aproximación de ~4 caracteres por token (sin depender de tiktoken)."""
+    return max(1, (len(texto) + 3) // 4)
+
+
+def vector_mock(texto: str, dimension: int = 1536) -> np.ndarray:
+    """Embedding determinista de norma 1: el mismo texto da siempre el mismo vector."""
+    semilla = int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(semilla).standard_normal(dimension).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class EstadisticasMock:
+    """Contadores del servidor (se consultan con GET /estadisticas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.peticiones = {"embeddings": 0, "chat": 0, "chat_stream": 0}
+        self.errores_inyectados = 0
+        self.textos_embebidos = 0
+        self.tokens_prompt: list[int] = []
+        self.tokens_respuesta = 0
+
+    def sumar(self, clave: str, textos: int = 0, tokens_prompt: int = None, tokens_respuesta: int = 0):
+        with self._lock:
+            self.peticiones[clave] += 1
+            self.textos_embebidos += textos
+            self.tokens_respuesta += tokens_respuesta
+            if tokens_prompt is not None:
+                self.tokens_prompt.append(tokens_prompt)
+
+    def error(self):
+        with self._lock:
+            self.errores_inyectados += 1
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            return {
+                "peticiones": dict(self.peticiones),
+                "errores_inyectados": self.errores_inyectados,
+                "textos_embebidos": self.textos_embebidos,
+                "tokens_prompt": list(self.tokens_prompt),
+                "tokens_respuesta": self.tokens_respuesta,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+    # Se asignan en crear_servidor()
+    config: ConfigMock
+    estadisticas: EstadisticasMock
+    rng: random.Random
+
+    def log_message(self, formato, *args):
+        pass  # sin una línea de log por petición
+
+    # --- utilidades ---
+    def _esperar(self, base_ms: float):
+        demora = max(0.0, self.rng.gauss(base_ms, self.config.jitter_ms)) if self.config.jitter_ms else base_ms
+        time.sleep(demora / 1000)
+
+    def _json(self, codigo: int, cuerpo: dict):
+        datos = json.dumps(cuerpo).encode("utf-8")
+        try:
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente cortó la petición (plazo vencido o pedido de respaldo perdedor)
+
+    def _error_inyectado(self) -> bool:
+        if self.config.tasa_error <= 0 or self.rng.random() >= self.config.tasa_error:
+            return False
+        self.estadisticas.error()
+        codigo = self.rng.choice((429, 500))
+        self._json(codigo, {"error": {"message": "Error simulado por el mock", "type": "server_error", "code": None}})
+        return True
+
+    def _leer_cuerpo(self) -> dict:
+        largo = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(largo) or b"{}")
+
+    # --- rutas ---
+    def do_GET(self):
+        if self.path.rstrip("/") == "/estadisticas":
+            self._json(200, self.estadisticas.como_dict())
+        else:
+            self._json(404, {"error": {"message": "no encontrado"}})
+
+    def do_POST(self):
+        cuerpo = self._leer_cuerpo()
+        ruta = self.path.split("?")[0].rstrip("/")
+        if ruta.endswith("/embeddings"):
+            self._embeddings(cuerpo)
+        elif ruta.endswith("/chat/completions"):
+            self._chat(cuerpo)
+        else:
+            self._json(404, {"error": {"message": f"ruta no emulada: {ruta}"}})
+
+    def _embeddings(self, cuerpo: dict):
+        textos = cuerpo.get("input", [])
+        if isinstance(textos, str):
+            textos = [textos]
+        self._esperar(self.config.latencia_embedding_ms)
+        if self._error_inyectado():
+            return
+
+        datos = []
+        for i, texto in enumerate(textos):
+            v = vector_mock(str(texto), self.config.dimension)
+            # El SDK pide base64 por defecto cuando numpy está disponible
+            if cuerpo.get("encoding_format") == "base64":
+                embedding = base64.b64encode(v.tobytes()).decode("ascii")
+            else:
+                embedding = v.tolist()
+            datos.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(contar_tokens(str(t)) for t in textos)
+        self.estadisticas.sumar("embeddings", textos=len(textos))
+        self._json(200, {
+            "object": "list",
+            "data": datos,
+            "model": cuerpo.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, cuerpo: dict):
+        tokens_prompt = sum(contar_tokens(str(m.get("content", ""))) for m in cuerpo.get("messages", []))
+        stream = bool(cuerpo.get("stream"))
+        self._esperar(self.config.latencia_chat_ms)
+        if self._error_inyectado():
+            return
+
+        n = self.config.tokens_respuesta
+        fragmentos = [(" " if i else "") + self.rng.choice(_PALABRAS) for i in range(n)]
+        modelo = cuerpo.get("model", "gpt-4o-mini")
+        id_respuesta = f"chatcmpl-mock-{self.rng.getrandbits(48):012x}"
+        creado = int(time.time())
+        self.estadisticas.sumar("chat_stream" if stream else "chat", tokens_prompt=tokens_prompt, tokens_respuesta=n)
+
+        if not stream:
+            time.sleep(self.config.ms_por_token * n / 1000)
+            self._json(200, {
+                "id": id_respuesta,
+                "object": "chat.completion",
+                "created": creado,
+                "model": modelo,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(fragmentos)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": tokens_prompt, "completion_tokens": n, "total_tokens": tokens_prompt + n},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def enviar(evento: str):
+            datos = f"data: {evento}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(datos):x}\r\n".encode("ascii") + datos + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta: dict, fin=None) -> str:
+            return json.dumps({
+                "id": id_respuesta,
+                "object": "chat.completion.chunk",
+                "created": creado,
+                "model": modelo,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": fin}],
+            })
+
+        try:
+            for i, fragmento in enumerate(fragmentos):
+                if i:
+                    time.sleep(self.config.ms_por_token / 1000)
+                enviar(chunk({"role": "assistant", "content": fragmento} if i == 0 else {"content": fragmento}))
+            enviar(chunk({}, fin="stop"))
+            if (cuerpo.get("stream_options") or {}).get("include_usage"):
+                enviar(json.dumps({
+                    "id": id_respuesta,
+                    "object": "chat.completion.chunk",
+                    "created": creado,
+                    "model": modelo,
+                    "choices": [],
+                    "usage": {"prompt_tokens": tokens_prompt, "completion_tokens": n,
+                              "total_tokens": tokens_prompt + n},
+                }))
+            enviar("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente cortó el stream
+
+
+def crear_servidor(config: ConfigMock, host: str = "127.0.0.1", puerto: int = 0):
+    """Crea el servidor (puerto 0 = uno libre). Devuelve (servidor, estadisticas)."""
+    estadisticas = EstadisticasMock()
+    handler = type("HandlerMock", (_Handler,), {
+        "config": config,
+        "estadisticas": estadisticas,
+        "rng": random.Random(config.semilla),
+    })
+    servidor = ThreadingHTTPServer((host, puerto), handler)
+    servidor.daemon_threads = True
+    return servidor, estadisticas
+
+
+def iniciar_en_hilo(config: ConfigMock, host: str = "127.0.0.1", puerto: int = 0):
+    """Levanta el servidor en un hilo daemon. Devuelve (servidor, estadisticas, base_url)."""
+    servidor, estadisticas = crear_servidor(config, host, puerto)
+    threading.Thread(target=servidor.serve_forever, name="mock-openai", daemon=True).start()
+    host_real, puerto_real = servidor.server_address[:2]
+    return servidor, estadisticas, f"http://{host_real}:{puerto_real}/v1"
+
+
+def agregar_argumentos(parser: argparse.ArgumentParser):
+    """Flags de configuración del mock (compartidos con benchmarks/carga.py)."""
+    d = ConfigMock()
+    parser.add_argument("--latencia-embedding-ms", type=float, default=d.latencia_embedding_ms)
+    parser.add_argument("--latencia-chat-ms", type=float, default=d.latencia_chat_ms,
+                        help="Tiempo hasta el primer token (o la respuesta completa sin stream)")
+    parser.add_argument("--ms-por-token", type=float, default=d.ms_por_token)
+    parser.add_argument("--jitter-ms", type=float, default=d.jitter_ms, help="Desvío estándar de la latencia")
+    parser.add_argument("--tokens-respuesta", type=int, default=d.tokens_respuesta)
+    parser.add_argument("--tasa-error", type=float, default=d.tasa_error,
+                        help="Fracción de peticiones que responden 429/500 (0-1)")
+    parser.add_argument("--dimension", type=int, default=d.dimension)
+    parser.add_argument("--semilla", type=int, default=d.semilla)
+
+
+def config_desde_argumentos(args) -> ConfigMock:
+    return ConfigMock(**{campo: getattr(args, campo) for campo in asdict(ConfigMock())})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que emula la API de OpenAI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    servidor, _ = crear_servidor(config_desde_argumentos(args), args.host, args.puerto)
+    print(f"🧪 Mock de OpenAI escuchando en http://{args.host}:{args.puerto}/v1 (Ctrl+C para salir)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,2 +1,7 @@
-from .chatbot import app
-
+def __getattr__(name):
+    # `app` se importa bajo demanda: así los módulos livianos del paquete
+    # (p. ej. chunk_store, usado por scripts/ingest.py) no arrastran Reflex.
+    if name == "app":
+        from .chatbot import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,206 @@
+"""
+Control de admisión: concurrencia acotada hacia OpenAI y cola de espera visible.
+
+Sin límites, un pico de tráfico (p. ej. una clase entera preguntando a la vez)
+manda todas las llamadas juntas: la API empieza a responder 429 o a tardar más,
+y la latencia de todos los usuarios crece a la par. En su lugar:
+
+- `turnos`: turnos de chat procesándose a la vez en este worker (cada uno con
+  su llamada al modelo), hasta ADMISION_LLM_MAX. Los que no entran esperan en
+  una cola FIFO de hasta ADMISION_COLA_MAX, a lo sumo ADMISION_ESPERA_SEG; la
+  UI muestra la posición en la cola. Con la cola llena se rechaza enseguida
+  ("ocupado") en lugar de sumar espera para todos.
+- `embeddings`: llamadas de embedding simultáneas, hasta ADMISION_EMBEDDING_MAX.
+  Sin cola visible: la espera queda acotada por el plazo del RAG (PLAZO_RAG_SEG).
+  El pedido de respaldo (ver resiliencia.Respaldo) corre dentro del mismo lugar:
+  en el peor caso hay el doble de peticiones en vuelo (en la práctica, ~5% más).
+- `resumenes`: resúmenes del historial simultáneos, hasta ADMISION_RESUMEN_MAX.
+  Corren en segundo plano después de liberar el turno; si no consiguen lugar en
+  ADMISION_ESPERA_SEG se conserva el resumen anterior.
+
+ControlAdmision está pensado para el event loop único del backend de Reflex (no
+es seguro entre hilos). Los caminos síncronos (obtener_respuesta, recuperar), que
+corren en hilos, usan ocupar_hilo(): un semáforo aparte con el mismo límite.
+Un límite 0 desactiva el control correspondiente.
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Optional
+from . import metricas
+from .config import (
+    ADMISION_LLM_MAX,
+    ADMISION_EMBEDDING_MAX,
+    ADMISION_COLA_MAX,
+    ADMISION_ESPERA_SEG,
+    ADMISION_RESUMEN_MAX,
+)
+
+
+class Ocupado(Exception):
+    """No hay lugar: la cola está llena o se superó la espera máxima."""
+
+    def __init__(self, motivo: str):
+        super().__init__(f"Servidor ocupado ({motivo})")
+        self.motivo = motivo
+
+
+class Turno:
+    """Lugar en un ControlAdmision: admitido o esperando en la cola."""
+
+    def __init__(self, control: "ControlAdmision"):
+        self.control = control
+        self.admitido = False
+        self.liberado = False
+        self.llegada = time.monotonic()
+        self._aviso = asyncio.Event()
+
+    @property
+    def posicion(self) -> int:
+        """1 = el próximo en entrar; 0 si ya fue admitido."""
+        if self.admitido:
+            return 0
+        try:
+            return self.control._cola.index(self) + 1
+        except ValueError:
+            return 0
+
+    async def esperar(self) -> AsyncIterator[int]:
+        """
+        Genera la posición en la cola cada vez que cambia, hasta ser admitido.
+        Lanza Ocupado si se supera la espera máxima del control.
+        """
+        while not self.admitido:
+            yield self.posicion
+            self._aviso.clear()
+            try:
+                if self.control.espera_max_seg:
+                    restante = self.llegada + self.control.espera_max_seg - time.monotonic()
+                    await asyncio.wait_for(self._aviso.wait(), max(0.0, restante))
+                else:
+                    await self._aviso.wait()
+            except asyncio.TimeoutError:
+                if self.admitido:
+                    break
+                self.control.vencidos += 1
+                self.liberar()
+                raise Ocupado("espera_vencida")
+
+    def liberar(self):
+        """Devuelve el lugar (o sale de la cola). Se puede llamar más de una vez."""
+        if not self.liberado:
+            self.liberado = True
+            self.control._liberar(self)
+
+
+class ControlAdmision:
+    """Hasta `max_concurrentes` turnos admitidos a la vez y una cola FIFO acotada."""
+
+    def __init__(self, nombre: str, max_concurrentes: int, max_cola: Optional[int] = None,
+                 espera_max_seg: Optional[float] = None):
+        self.nombre = nombre
+        self.max_concurrentes = max_concurrentes
+        self.max_cola = max_cola
+        self.espera_max_seg = espera_max_seg
+        self._activos = 0
+        self._cola: deque[Turno] = deque()
+        self._semaforo_hilos = threading.BoundedSemaphore(max_concurrentes) if max_concurrentes else None
+        self._lock_hilos = threading.Lock()
+        self._activos_hilos = 0
+
+        # Contadores (ver estadisticas())
+        self.admitidos = 0
+        self.encolados = 0
+        self.rechazados = 0
+        self.vencidos = 0
+
+    def solicitar(self) -> Turno:
+        """
+        Pide un lugar sin esperar: el turno queda admitido o en la cola (ver
+        Turno.esperar). Con la cola llena lanza Ocupado enseguida.
+        """
+        turno = Turno(self)
+        if not self.max_concurrentes or (self._activos < self.max_concurrentes and not self._cola):
+            self._admitir(turno)
+        elif self.max_cola is not None and len(self._cola) >= self.max_cola:
+            self.rechazados += 1
+            raise Ocupado("cola_llena")
+        else:
+            self._cola.append(turno)
+            self.encolados += 1
+        return turno
+
+    @asynccontextmanager
+    async def ocupar(self):
+        """Espera un lugar durante el bloque `with` (sin informar la posición)."""
+        turno = self.solicitar()
+        try:
+            async for _ in turno.esperar():
+                pass
+            yield turno
+        finally:
+            turno.liberar()
+
+    @contextmanager
+    def ocupar_hilo(self):
+        """
+        Equivalente de ocupar() para código síncrono en hilos: sin posición en la cola.
+        Lanza Ocupado si no hay lugar en `espera_max_seg` (sin límite de espera si es None).
+        """
+        if self._semaforo_hilos is None:
+            yield
+            return
+        if not self._semaforo_hilos.acquire(timeout=self.espera_max_seg):
+            raise Ocupado("espera_vencida")
+        with self._lock_hilos:
+            self._activos_hilos += 1
+        try:
+            yield
+        finally:
+            with self._lock_hilos:
+                self._activos_hilos -= 1
+            self._semaforo_hilos.release()
+
+    def _admitir(self, turno: Turno):
+        turno.admitido = True
+        self._activos += 1
+        self.admitidos += 1
+        metricas.observar(f"cola_{self.nombre}", time.monotonic() - turno.llegada)
+
+    def _liberar(self, turno: Turno):
+        if turno.admitido:
+            self._activos -= 1
+        else:
+            try:
+                self._cola.remove(turno)
+            except ValueError:
+                pass
+        # Entran los siguientes de la cola; el resto se entera de su nueva posición
+        while self._cola and (not self.max_concurrentes or self._activos < self.max_concurrentes):
+            siguiente = self._cola.popleft()
+            self._admitir(siguiente)
+            siguiente._aviso.set()
+        for esperando in self._cola:
+            esperando._aviso.set()
+
+    def estadisticas(self) -> dict:
+        return {
+            "activos": self._activos,
+            "en_cola": len(self._cola),
+            "admitidos": self.admitidos,
+            "encolados": self.encolados,
+            "rechazados": self.rechazados,
+            "vencidos": self.vencidos,
+            "activos_hilos": self._activos_hilos,
+        }
+
+
+turnos = ControlAdmision("turnos", ADMISION_LLM_MAX, ADMISION_COLA_MAX, ADMISION_ESPERA_SEG)
+embeddings = ControlAdmision("embeddings", ADMISION_EMBEDDING_MAX)
+resumenes = ControlAdmision("resumenes", ADMISION_RESUMEN_MAX, espera_max_seg=ADMISION_ESPERA_SEG)
+
+metricas.registrar_estadisticas("chatbot_admision_turnos", turnos.estadisticas)
+metricas.registrar_estadisticas("chatbot_admision_embeddings", embeddings.estadisticas)
+metricas.registrar_estadisticas("chatbot_admision_resumenes", resumenes.estadisticas)
@@ -0,0 +1,139 @@
+"""
+Fase de arranque del backend: precalienta lo que la primera consulta pagaría.
+
+Importar la app (p. ej. al compilar el frontend) no carga numpy, faiss ni el
+SDK de OpenAI: rag_client.py y los clientes HTTP se importan a pedido. Para que
+ese costo no lo pague el primer usuario después de cada despliegue o reinicio
+de un worker, `precalentar()` se registra como tarea de lifespan de Reflex y,
+en segundo plano mientras el servidor ya acepta conexiones:
+
+1. Importa rag_client.py: carga el índice FAISS, el almacén de chunks y el
+   índice léxico de la versión publicada.
+2. Carga el codificador de tiktoken que usa el empaquetado del contexto.
+3. Crea el cliente AsyncOpenAI compartido y abre ARRANQUE_CONEXIONES
+   conexiones del pool (TLS incluido) con una petición liviana.
+
+Al terminar se marca el worker como listo: `GET /listo` responde 200 (503
+mientras tanto), para que el balanceador no le envíe tráfico antes de tiempo.
+Una consulta que llega antes igual se atiende: espera la misma importación.
+
+El worker no queda listo sin índice: si la importación falla o no hay una
+versión del vector store que se pueda cargar (falta ingest.py, archivos
+corruptos), se cuenta en `errores` y se reintenta con backoff exponencial
+(hasta ARRANQUE_REINTENTO_MAX_SEG) mientras /listo sigue en 503.
+"""
+import time
+import asyncio
+import threading
+from . import metricas
+from .config import (
+    ARRANQUE_PRECALENTAR, ARRANQUE_CONEXIONES, ARRANQUE_REINTENTO_MAX_SEG, OPENAI_MAX_KEEPALIVE, logger,
+)
+
+_listo = threading.Event()
+_estado = {"fase": "pendiente", "segundos": 0.0, "errores": 0}
+
+
+def esta_listo() -> bool:
+    return _listo.is_set()
+
+
+def estado() -> dict:
+    return {**_estado, "listo": esta_listo()}
+
+
+def _cargar_recursos(reintento: bool):
+    """Devuelve el rag_client si quedó con un índice cargado, None si no."""
+    from .rag_client import rag_client
+    from .contexto import contar_tokens
+
+    contar_tokens("precalentar")
+    # La importación ya intentó cargarlo; load_resources() registra el error y devuelve False
+    if rag_client.index is None and (not reintento or not rag_client.load_resources()):
+        return None
+    return rag_client
+
+
+async def _abrir_conexiones(cantidad: int):
+    """Peticiones concurrentes a /models: cada una deja abierta una conexión keep-alive."""
+    import openai
+    from .clientes import obtener_cliente_async
+
+    cliente = obtener_cliente_async()
+    resultados = await asyncio.gather(
+        *(cliente.models.list() for _ in range(cantidad)), return_exceptions=True
+    )
+    # Un error HTTP (p. ej. 404 de un proxy sin /models) igual deja la conexión abierta
+    fallidas = [r for r in resultados if isinstance(r, Exception) and not isinstance(r, openai.APIStatusError)]
+    if fallidas:
+        raise fallidas[0]
+
+
+async def precalentar():
+    """Tarea de lifespan (ver chatbot.py)."""
+    if not ARRANQUE_PRECALENTAR:
+        _estado["fase"] = "listo"
+        _listo.set()
+        return
+
+    inicio = time.perf_counter()
+    _estado["fase"] = "calentando"
+    intento = 0
+    while True:
+        try:
+            rag_client = await asyncio.to_thread(_cargar_recursos, intento > 0)
+            if rag_client is not None:
+                break
+            _estado["fase"] = "sin_indice"
+            motivo = "no hay un índice FAISS que se pueda cargar"
+        except Exception as e:
+            # Una importación fallida no queda en sys.modules: el próximo intento la repite
+            _estado["fase"] = "error"
+            motivo = f"{type(e).__name__}: {e}"
+        _estado["errores"] += 1
+        espera = min(ARRANQUE_REINTENTO_MAX_SEG, 2 ** intento)
+        intento += 1
+        logger.error(f"Arranque sin vector store ({motivo}); reintento {intento} en {espera:.0f}s.")
+        await asyncio.sleep(espera)
+    _estado["fase"] = "calentando"
+    logger.info(
+        f"Vector store cargado en el arranque (versión {rag_client.version or 'sin versionar'}, "
+        f"{rag_client.index.ntotal} vectores)."
+    )
+
+    conexiones = min(ARRANQUE_CONEXIONES, OPENAI_MAX_KEEPALIVE)
+    if conexiones > 0:
+        try:
+            await _abrir_conexiones(conexiones)
+            logger.info(f"{conexiones} conexiones abiertas con la API de OpenAI.")
+        except Exception as e:
+            # Sin conexiones precalentadas el chat funciona igual (se abren en la primera consulta)
+            _estado["errores"] += 1
+            logger.warning(f"No se pudieron abrir las conexiones con la API de OpenAI en el arranque: {e}")
+
+    _estado["segundos"] = time.perf_counter() - inicio
+    _estado["fase"] = "listo"
+    _listo.set()
+    logger.info(f"Backend listo en {_estado['segundos']:.2f}s.")
+
+
+metricas.registrar_estadisticas("chatbot_arranque", lambda: {
+    "listo": int(esta_listo()),
+    "segundos": _estado["segundos"],
+    "errores": _estado["errores"],
+})
+
+
+def api_listo(ruta: str = "/listo"):
+    """
+    App Starlette con la ruta de disponibilidad (200 listo / 503 calentando), para
+    usar como `api_transformer` de rx.App junto a la de métricas.
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def listo(request):
+        return JSONResponse(estado(), status_code=200 if esta_listo() else 503)
+
+    return Starlette(routes=[Route(ruta, listo, methods=["GET"])])
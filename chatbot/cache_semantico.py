@@ -0,0 +1,118 @@
+"""
+Caché semántico de respuestas.
+
+Guarda (embedding de la pregunta, ids de fragmentos recuperados, respuesta) en un
+índice FAISS de producto interno. Una pregunta nueva reutiliza la respuesta de
+otra si la similitud coseno supera el umbral y el RAG recuperó los mismos
+fragmentos. Se vacía automáticamente cuando cambia la versión del vector store.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+import faiss
+from .config import (
+    logger,
+    CACHE_SEMANTICO_UMBRAL,
+    CACHE_SEMANTICO_MAX,
+    CACHE_SEMANTICO_TTL_SEG,
+)
+
+
+class CacheSemantico:
+    def __init__(self, umbral: float = CACHE_SEMANTICO_UMBRAL, max_items: int = CACHE_SEMANTICO_MAX,
+                 ttl_seg: float = CACHE_SEMANTICO_TTL_SEG, vecinos: int = 4):
+        self.umbral = umbral
+        self.max_items = max_items
+        self.ttl_seg = ttl_seg
+        self.vecinos = vecinos
+        self._lock = threading.Lock()
+        self._index = None
+        # id -> (ids de fragmentos, clave de prompt, respuesta, creado); orden LRU
+        self._entradas: OrderedDict[int, tuple[frozenset, str, str, float]] = OrderedDict()
+        self._siguiente_id = 0
+        self._version = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def clave_prompt(system_prompt: str, modelo: str) -> str:
+        """Las respuestas solo se comparten entre llamadas con el mismo prompt y modelo."""
+        return hashlib.sha256(f"{modelo}\x00{system_prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalizar(embedding) -> np.ndarray:
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _sincronizar_version(self, version: str):
+        """Vacía el caché si el vector store fue reconstruido."""
+        if version != self._version:
+            if self._entradas:
+                logger.info("Vector store actualizado: se invalida el caché semántico.")
+            self._index = None
+            self._entradas.clear()
+            self._version = version
+
+    def buscar(self, embedding, ids_chunks: list[int], clave_prompt: str, version: str) -> Optional[str]:
+        """Devuelve la respuesta cacheada o None."""
+        with self._lock:
+            self._sincronizar_version(version)
+            if self._index is None or not self._entradas:
+                self.misses += 1
+                return None
+
+            similitudes, ids = self._index.search(self._normalizar(embedding), self.vecinos)
+            objetivo = frozenset(ids_chunks)
+            ahora = time.time()
+            for similitud, id_entrada in zip(similitudes[0], ids[0]):
+                if id_entrada == -1 or similitud < self.umbral:
+                    break
+                entrada = self._entradas.get(int(id_entrada))
+                if entrada is None:
+                    continue
+                chunks, clave, respuesta, creado = entrada
+                if ahora - creado > self.ttl_seg:
+                    self._eliminar(int(id_entrada))
+                    continue
+                if chunks == objetivo and clave == clave_prompt:
+                    self._entradas.move_to_end(int(id_entrada))
+                    self.hits += 1
+                    return respuesta
+
+            self.misses += 1
+            return None
+
+    def guardar(self, embedding, ids_chunks: list[int], clave_prompt: str, respuesta: str, version: str):
+        with self._lock:
+            self._sincronizar_version(version)
+            vector = self._normalizar(embedding)
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            id_entrada = self._siguiente_id
+            self._siguiente_id += 1
+            self._index.add_with_ids(vector, np.array([id_entrada], dtype=np.int64))
+            self._entradas[id_entrada] = (frozenset(ids_chunks), clave_prompt, respuesta, time.time())
+
+            # Desalojo LRU
+            while len(self._entradas) > self.max_items:
+                self._eliminar(next(iter(self._entradas)))
+
+    def _eliminar(self, id_entrada: int):
+        self._entradas.pop(id_entrada, None)
+        self._index.remove_ids(np.array([id_entrada], dtype=np.int64))
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "tasa_aciertos": self.hits / total if total else 0.0,
+                "entradas": len(self._entradas),
+            }
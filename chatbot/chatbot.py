@@ -4,17 +4,27 @@ Punto de entrada principal de la aplicación Reflex.
 import reflex as rx
 from .ui import layout_principal
 from .state import EstadoChat
+from .metricas import api_metricas
+from .arranque import precalentar, api_listo
+from .config import METRICAS, METRICAS_RUTA, LISTO_RUTA
 
 # Crear la aplicación
 app = rx.App(
-    theme=rx.theme(appearance="light") # Forzar tema claro por simplicidad
+    theme=rx.theme(appearance="light"), # Forzar tema claro por simplicidad
+    # Rutas extra de disponibilidad y métricas (Prometheus); Reflex monta su API debajo
+    api_transformer=[api_listo(LISTO_RUTA)] + ([api_metricas(METRICAS_RUTA)] if METRICAS else []),
 )
 
+# Carga el vector store y abre conexiones al iniciar el backend, no en la primera consulta
+app.register_lifespan_task(precalentar)
+
 
 # Agregar la página principal
 app.add_page(
     layout_principal,
     route="/",
     title="Experto en Lengua Guaraní",
-    description="Asistente virtual potenciado por OpenAI"
+    description="Asistente virtual potenciado por OpenAI",
+    # Recupera la conversación guardada de la pestaña (p. ej. después de reiniciar el backend)
+    on_load=EstadoChat.cargar_conversacion,
 )
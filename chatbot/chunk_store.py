@@ -0,0 +1,145 @@
+"""
+Almacén columnar de chunks, de solo lectura y mapeado en memoria (mmap).
+
+Reemplaza a `index.pkl`: en lugar de deserializar la lista completa de
+metadatos en cada proceso, el archivo se mapea en memoria (el sistema operativo
+comparte las páginas entre los workers de Reflex) y cada chunk se lee en O(1)
+por su id de FAISS.
+
+Formato de `chunks.bin` (little-endian):
+    MAGIA (8 bytes) | largo del encabezado (uint32) | encabezado JSON | relleno
+    offsets        uint64[n + 1]   inicio de cada texto dentro del blob
+    fuente         int32[n]        índice en encabezado["fuentes"] (-1 = id libre)
+    chunk_index    int32[n]
+    pagina_inicio  int32[n]        -1 si se desconoce
+    pagina_fin     int32[n]
+    blob           textos UTF-8 concatenados
+
+Las filas están indexadas por id de FAISS (fila == id); los ids eliminados
+quedan como huecos con fuente -1.
+"""
+import os
+import json
+import mmap
+import struct
+from typing import Iterator, Mapping, Optional
+import numpy as np
+
+MAGIA = b"GNCHUNK1"
+_COLUMNAS = ("fuente", "chunk_index", "pagina_inicio", "pagina_fin")
+
+
+def _alinear(n: int, a: int = 8) -> int:
+    return (n + a - 1) // a * a
+
+
+class ChunkStore:
+    """Lector del almacén de chunks. Se usa como un dict {id: metadato} de solo lectura."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIA)] != MAGIA:
+            raise ValueError(f"{path} no es un almacén de chunks válido")
+        (largo,) = struct.unpack_from("<I", self._mm, len(MAGIA))
+        inicio = len(MAGIA) + 4
+        encabezado = json.loads(self._mm[inicio:inicio + largo].decode("utf-8"))
+        self.n = encabezado["n"]
+        self.fuentes = encabezado["fuentes"]
+
+        pos = _alinear(inicio + largo)
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n + 1, offset=pos)
+        pos += 8 * (self.n + 1)
+        self._columnas = {}
+        for nombre in _COLUMNAS:
+            self._columnas[nombre] = np.frombuffer(self._mm, dtype="<i4", count=self.n, offset=pos)
+            pos += 4 * self.n
+        self._inicio_blob = pos
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._columnas["fuente"] >= 0))
+
+    def __iter__(self) -> Iterator[int]:
+        """Ids vigentes (sin leer los textos)."""
+        for idx in np.flatnonzero(self._columnas["fuente"] >= 0):
+            yield int(idx)
+
+    def get(self, idx: int, default=None) -> Optional[dict]:
+        if idx < 0 or idx >= self.n:
+            return default
+        fuente = int(self._columnas["fuente"][idx])
+        if fuente < 0:
+            return default
+        a = self._inicio_blob + int(self._offsets[idx])
+        b = self._inicio_blob + int(self._offsets[idx + 1])
+        return {
+            "source": self.fuentes[fuente],
+            "chunk_index": int(self._columnas["chunk_index"][idx]),
+            "pagina_inicio": int(self._columnas["pagina_inicio"][idx]),
+            "pagina_fin": int(self._columnas["pagina_fin"][idx]),
+            "text": self._mm[a:b].decode("utf-8"),
+        }
+
+    def items(self) -> Iterator[tuple[int, dict]]:
+        for idx in self:
+            yield idx, self.get(idx)
+
+    def close(self):
+        # Los arrays de numpy referencian el mmap: se liberan antes de cerrarlo
+        self._offsets = None
+        self._columnas = {}
+        self._mm.close()
+
+
+def escribir_chunk_store(path: str, metadatas: Mapping[int, dict]):
+    """
+    Escribe `metadatas` ({id: {"source", "chunk_index", "text", ...}}) en formato
+    columnar. Se escribe a un temporal y se renombra (reemplazo atómico).
+
+    Los metadatos se recorren dos veces (largos y columnas, después los textos)
+    sin juntar los textos en memoria: `metadatas` puede ser cualquier Mapping que
+    los lea de disco (ver scripts/ingest.py).
+    """
+    n = max(metadatas) + 1 if metadatas else 0
+    fuentes, indice_fuente = [], {}
+
+    columnas = {nombre: np.full(n, -1, dtype="<i4") for nombre in _COLUMNAS}
+    longitudes = np.zeros(n, dtype="<u8")
+    for idx, meta in metadatas.items():
+        longitudes[idx] = len(meta["text"].encode("utf-8"))
+        if meta["source"] not in indice_fuente:
+            indice_fuente[meta["source"]] = len(fuentes)
+            fuentes.append(meta["source"])
+        columnas["fuente"][idx] = indice_fuente[meta["source"]]
+        columnas["chunk_index"][idx] = meta.get("chunk_index", -1)
+        columnas["pagina_inicio"][idx] = meta.get("pagina_inicio", -1)
+        columnas["pagina_fin"][idx] = meta.get("pagina_fin", -1)
+
+    # Fuentes en orden alfabético (archivo determinista sin importar el orden de los ids)
+    orden = sorted(range(len(fuentes)), key=fuentes.__getitem__)
+    nuevo_indice = np.empty(len(fuentes) + 1, dtype="<i4")
+    nuevo_indice[orden] = np.arange(len(fuentes), dtype="<i4")
+    nuevo_indice[-1] = -1  # los huecos (-1) siguen siendo -1
+    columnas["fuente"] = nuevo_indice[columnas["fuente"]]
+    fuentes = [fuentes[i] for i in orden]
+
+    offsets = np.zeros(n + 1, dtype="<u8")
+    np.cumsum(longitudes, out=offsets[1:])
+
+    encabezado = json.dumps({"n": n, "fuentes": fuentes}, ensure_ascii=False).encode("utf-8")
+    inicio = len(MAGIA) + 4 + len(encabezado)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIA)
+        f.write(struct.pack("<I", len(encabezado)))
+        f.write(encabezado)
+        f.write(b"\0" * (_alinear(inicio) - inicio))
+        f.write(offsets.tobytes())
+        for nombre in _COLUMNAS:
+            f.write(columnas[nombre].tobytes())
+        for idx in sorted(metadatas):
+            f.write(metadatas[idx]["text"].encode("utf-8"))
+    os.replace(tmp, path)
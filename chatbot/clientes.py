@@ -0,0 +1,92 @@
+"""
+Clientes OpenAI compartidos (uno síncrono y uno asíncrono por proceso).
+
+Tanto LLMClient como RAGClient obtienen aquí su cliente, de modo que todas las
+sesiones reutilizan el mismo pool de conexiones HTTP (keep-alive) en lugar de
+abrir una conexión nueva y negociar TLS en cada consulta.
+
+El SDK de OpenAI se importa recién al crear el primer cliente: importar la app
+(p. ej. al compilar el frontend) no carga openai ni httpx. En el backend, la
+fase de arranque (arranque.py) crea los clientes y abre las conexiones antes
+de la primera consulta.
+
+Los clientes no reintentan por su cuenta (max_retries=0): los reintentos y los
+plazos de cada etapa están en resiliencia.py.
+"""
+import threading
+from typing import TYPE_CHECKING, Optional
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONEXIONES,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_KEEPALIVE_SEG,
+    OPENAI_TIMEOUT_SEG,
+    logger,
+)
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import OpenAI, AsyncOpenAI
+
+_cliente: Optional["OpenAI"] = None
+_cliente_async: Optional["AsyncOpenAI"] = None
+_lock = threading.Lock()
+
+
+def _limites() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONEXIONES,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_SEG,
+    )
+
+
+def obtener_cliente() -> "OpenAI":
+    """Devuelve el cliente síncrono compartido (se crea en el primer uso)."""
+    global _cliente
+    if _cliente is None:
+        with _lock:
+            if _cliente is None:
+                from openai import OpenAI, DefaultHttpxClient
+                _cliente = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    timeout=OPENAI_TIMEOUT_SEG,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=_limites()),
+                )
+    return _cliente
+
+
+def obtener_cliente_async() -> "AsyncOpenAI":
+    """
+    Devuelve el cliente asíncrono compartido (se crea en el primer uso).
+    Debe usarse siempre desde el mismo event loop (el del backend de Reflex).
+    """
+    global _cliente_async
+    if _cliente_async is None:
+        with _lock:
+            if _cliente_async is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                _cliente_async = AsyncOpenAI(
+                    api_key=OPENAI_API_KEY,
+                    timeout=OPENAI_TIMEOUT_SEG,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=_limites()),
+                )
+                logger.info(
+                    f"Cliente AsyncOpenAI creado (max_conexiones={OPENAI_MAX_CONEXIONES}, "
+                    f"keepalive={OPENAI_MAX_KEEPALIVE})."
+                )
+    return _cliente_async
+
+
+async def cerrar_clientes():
+    """Cierra los pools de conexiones (útil al apagar el servidor o en scripts)."""
+    global _cliente, _cliente_async
+    if _cliente_async is not None:
+        await _cliente_async.close()
+        _cliente_async = None
+    if _cliente is not None:
+        _cliente.close()
+        _cliente = None
@@ -16,6 +16,141 @@ logger = logging.getLogger("ChatbotReflex")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
+# Carpeta del vector store (índice FAISS, chunks, índice léxico). Se puede apuntar a
+# otra carpeta, p. ej. el corpus sintético de benchmarks/carga.py.
+VECTOR_STORE_DIR = os.getenv(
+    "VECTOR_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_store")
+)
+
+# Pool HTTP compartido por los clientes OpenAI (ver clientes.py).
+# Las conexiones keep-alive evitan repetir el handshake TLS en cada consulta.
+OPENAI_MAX_CONEXIONES = int(os.getenv("OPENAI_MAX_CONEXIONES", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_SEG = float(os.getenv("OPENAI_KEEPALIVE_SEG", "60"))
+OPENAI_TIMEOUT_SEG = float(os.getenv("OPENAI_TIMEOUT_SEG", "60"))
+
+# Control de la latencia de cola (resiliencia.py). Cada etapa tiene un plazo: si el RAG no
+# termina en PLAZO_RAG_SEG la respuesta se genera sin contexto. Los errores transitorios
+# (429, 5xx, timeouts) se reintentan hasta REINTENTOS_MAX veces con backoff exponencial y
+# jitter, dentro del plazo. Con EMBEDDING_RESPALDO, si el embedding de la consulta tarda
+# más que el percentil RESPALDO_PERCENTIL de los recientes se envía un pedido duplicado y
+# se usa la primera respuesta.
+PLAZO_RAG_SEG = float(os.getenv("PLAZO_RAG_SEG", "4"))
+PLAZO_EMBEDDING_SEG = float(os.getenv("PLAZO_EMBEDDING_SEG", "2"))
+PLAZO_PRIMER_TOKEN_SEG = float(os.getenv("PLAZO_PRIMER_TOKEN_SEG", "20"))
+PLAZO_LLM_SEG = float(os.getenv("PLAZO_LLM_SEG", "60"))
+REINTENTOS_MAX = int(os.getenv("REINTENTOS_MAX", "2"))
+REINTENTO_BASE_SEG = float(os.getenv("REINTENTO_BASE_SEG", "0.25"))
+REINTENTO_MAX_SEG = float(os.getenv("REINTENTO_MAX_SEG", "4"))
+EMBEDDING_RESPALDO = os.getenv("EMBEDDING_RESPALDO", "true").lower() in ("1", "true", "si", "yes")
+RESPALDO_PERCENTIL = float(os.getenv("RESPALDO_PERCENTIL", "95"))
+RESPALDO_MIN_MS = float(os.getenv("RESPALDO_MIN_MS", "50"))
+
+# Control de admisión por worker (admision.py): turnos de chat procesándose a la vez (cada
+# uno con su llamada al modelo) y llamadas de embedding simultáneas. Los turnos que no
+# entran esperan en una cola de hasta ADMISION_COLA_MAX, como máximo ADMISION_ESPERA_SEG,
+# y la UI muestra su posición; con la cola llena se responde "ocupado" enseguida.
+# ADMISION_LLM_MAX / ADMISION_EMBEDDING_MAX = 0: sin límite. ADMISION_COLA_MAX = 0: sin cola.
+ADMISION_LLM_MAX = int(os.getenv("ADMISION_LLM_MAX", "32"))
+ADMISION_EMBEDDING_MAX = int(os.getenv("ADMISION_EMBEDDING_MAX", "16"))
+ADMISION_COLA_MAX = int(os.getenv("ADMISION_COLA_MAX", "100"))
+ADMISION_ESPERA_SEG = float(os.getenv("ADMISION_ESPERA_SEG", "30"))
+# Resúmenes del historial simultáneos: corren en segundo plano, después de liberar el turno,
+# así que las llamadas al modelo llegan a ADMISION_LLM_MAX + ADMISION_RESUMEN_MAX.
+ADMISION_RESUMEN_MAX = int(os.getenv("ADMISION_RESUMEN_MAX", "4"))
+
+# Caché de embeddings de consultas (rag_client.CacheEmbeddings).
+# EMB_CACHE_DISCO: ruta a un archivo SQLite compartido entre workers (vacío = solo memoria).
+EMB_CACHE_MAX = int(os.getenv("EMB_CACHE_MAX", "10000"))
+EMB_CACHE_TTL_SEG = float(os.getenv("EMB_CACHE_TTL_SEG", "86400"))
+EMB_CACHE_DISCO = os.getenv("EMB_CACHE_DISCO", "")
+EMB_CACHE_TTL_DISCO_SEG = float(os.getenv("EMB_CACHE_TTL_DISCO_SEG", str(30 * 86400)))
+
+# Parámetros de búsqueda del índice FAISS. Por defecto se usan los guardados por
+# ingest.py en vector_store/index_params.json; estas variables los sobreescriben.
+RAG_NPROBE = int(os.getenv("RAG_NPROBE", "0"))
+RAG_EF_BUSQUEDA = int(os.getenv("RAG_EF_BUSQUEDA", "0"))
+
+# Recarga en caliente del vector store: cada RAG_RECARGA_SEG segundos se revisa el puntero
+# vector_store/ACTUAL y, si ingest.py publicó una versión nueva, se carga en segundo plano
+# y reemplaza a la anterior sin reiniciar el backend (0 = desactivada).
+RAG_RECARGA_SEG = float(os.getenv("RAG_RECARGA_SEG", "10"))
+
+# Micro-lotes (microlotes.py): las consultas de sesiones concurrentes que llegan dentro de
+# RAG_LOTE_VENTANA_MS (o hasta juntar RAG_LOTE_MAX) se embeben en una sola petición y se
+# buscan en FAISS con un único search. Desactivado por defecto.
+RAG_MICROLOTES = os.getenv("RAG_MICROLOTES", "false").lower() in ("1", "true", "si", "yes")
+RAG_LOTE_VENTANA_MS = float(os.getenv("RAG_LOTE_VENTANA_MS", "5"))
+RAG_LOTE_MAX = int(os.getenv("RAG_LOTE_MAX", "32"))
+
+# Modo de recuperación: "denso" (solo FAISS), "hibrido" (BM25 + FAISS fusionados con
+# Reciprocal Rank Fusion) o "lexico" (solo BM25, sin llamar a la API de embeddings).
+RAG_MODO = os.getenv("RAG_MODO", "hibrido").lower()
+# Atajo léxico: las consultas cortas de un término (≤ RAG_LEXICO_MAX_TERMINOS) cuyo mejor
+# resultado BM25 contiene todos los términos con score ≥ RAG_LEXICO_SCORE_MIN se
+# responden sin pedir el embedding.
+RAG_LEXICO_RAPIDO = os.getenv("RAG_LEXICO_RAPIDO", "true").lower() in ("1", "true", "si", "yes")
+RAG_LEXICO_MAX_TERMINOS = int(os.getenv("RAG_LEXICO_MAX_TERMINOS", "2"))
+RAG_LEXICO_SCORE_MIN = float(os.getenv("RAG_LEXICO_SCORE_MIN", "3.0"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+# Contexto RAG inyectado en el prompt (contexto.py): presupuesto en tokens y similitud
+# coseno mínima de un fragmento para incluirlo.
+RAG_TOKENS_CONTEXTO = int(os.getenv("RAG_TOKENS_CONTEXTO", "2500"))
+RAG_SIMILITUD_MIN = float(os.getenv("RAG_SIMILITUD_MIN", "0.2"))
+
+# Historial enviado al modelo (historial.py): ventana de turnos recientes de hasta
+# HISTORIAL_TOKENS tokens más un resumen de los anteriores, que se actualiza en segundo
+# plano después de cada respuesta (HISTORIAL_RESUMEN=false solo recorta la ventana).
+HISTORIAL_TOKENS = int(os.getenv("HISTORIAL_TOKENS", "2000"))
+HISTORIAL_RESUMEN = os.getenv("HISTORIAL_RESUMEN", "true").lower() in ("1", "true", "si", "yes")
+HISTORIAL_RESUMEN_TOKENS = int(os.getenv("HISTORIAL_RESUMEN_TOKENS", "300"))
+
+# Caché semántico de respuestas (cache_semantico.py). Solo aplica a preguntas de un
+# único turno cuya similitud coseno con una pregunta previa supera el umbral y que
+# recuperan exactamente los mismos fragmentos.
+CACHE_SEMANTICO = os.getenv("CACHE_SEMANTICO", "false").lower() in ("1", "true", "si", "yes")
+CACHE_SEMANTICO_UMBRAL = float(os.getenv("CACHE_SEMANTICO_UMBRAL", "0.95"))
+CACHE_SEMANTICO_MAX = int(os.getenv("CACHE_SEMANTICO_MAX", "2000"))
+CACHE_SEMANTICO_TTL_SEG = float(os.getenv("CACHE_SEMANTICO_TTL_SEG", str(7 * 86400)))
+
+# Agrupa las llamadas idénticas simultáneas a OpenAI (embeddings de la misma consulta y
+# completions de la misma pregunta sin historial) en una sola petición (vuelo_unico.py).
+AGRUPAR_LLAMADAS = os.getenv("AGRUPAR_LLAMADAS", "true").lower() in ("1", "true", "si", "yes")
+
+# Streaming de respuestas: envía los tokens a la UI a medida que llegan.
+# STREAM_INTERVALO_MS agrupa los deltas para no saturar el WebSocket.
+STREAM_RESPUESTAS = os.getenv("STREAM_RESPUESTAS", "true").lower() in ("1", "true", "si", "yes")
+STREAM_INTERVALO_MS = int(os.getenv("STREAM_INTERVALO_MS", "100"))
+
+# Mensajes que se muestran (y sincronizan con el navegador) a la vez; el botón
+# "Ver mensajes anteriores" agrega otros tantos. El historial completo queda en el backend.
+CHAT_MENSAJES_VISIBLES = int(os.getenv("CHAT_MENSAJES_VISIBLES", "40"))
+
+# Conversaciones persistentes (persistencia.py): SQLite en modo WAL, escrito en segundo
+# plano. En memoria de cada sesión quedan solo los últimos CHAT_MENSAJES_MEMORIA mensajes
+# (más los que aún no entraron en el resumen); los anteriores se leen de disco a pedido.
+# CONVERSACIONES_DB vacío = sin persistencia (todo el historial en memoria). La base se
+# abre en el primer uso, no al importar la app.
+CONVERSACIONES_DB = os.getenv(
+    "CONVERSACIONES_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), "datos", "conversaciones.sqlite")
+)
+CHAT_MENSAJES_MEMORIA = int(os.getenv("CHAT_MENSAJES_MEMORIA", "100"))
+
+# Endpoint de métricas en formato Prometheus (metricas.py), servido por el backend de Reflex.
+METRICAS = os.getenv("METRICAS", "true").lower() in ("1", "true", "si", "yes")
+METRICAS_RUTA = os.getenv("METRICAS_RUTA", "/metrics")
+
+# Arranque del backend (arranque.py): carga el vector store y abre conexiones con OpenAI
+# en segundo plano al iniciar, en vez de en la primera consulta. LISTO_RUTA responde
+# 200 cuando terminó (503 mientras tanto). ARRANQUE_CONEXIONES = 0 no abre conexiones.
+# Sin un índice cargado el worker no queda listo: se reintenta con backoff exponencial
+# de hasta ARRANQUE_REINTENTO_MAX_SEG segundos.
+ARRANQUE_PRECALENTAR = os.getenv("ARRANQUE_PRECALENTAR", "true").lower() in ("1", "true", "si", "yes")
+ARRANQUE_CONEXIONES = int(os.getenv("ARRANQUE_CONEXIONES", "2"))
+ARRANQUE_REINTENTO_MAX_SEG = float(os.getenv("ARRANQUE_REINTENTO_MAX_SEG", "60"))
+LISTO_RUTA = os.getenv("LISTO_RUTA", "/listo")
+
 # Validación simple
 if not OPENAI_API_KEY:
     logger.warning("⚠️ No se encontró OPENAI_API_KEY en las variables de entorno. El chat no responderá correctamente.")
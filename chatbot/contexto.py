@@ -0,0 +1,212 @@
+"""
+Armado del contexto RAG que se inyecta en el system prompt.
+
+En lugar de concatenar todos los fragmentos recuperados, el empaquetador:
+1. descarta los de similitud menor a RAG_SIMILITUD_MIN (los resultados solo
+   léxicos, sin similitud, se conservan);
+2. agrega fragmentos en orden de relevancia mientras entren en el presupuesto
+   de RAG_TOKENS_CONTEXTO tokens (contados con tiktoken);
+3. une los fragmentos consecutivos del mismo documento quitando el texto
+   repetido por el solapamiento de `get_chunks` (50 tokens), que además no se
+   cuenta dos veces contra el presupuesto;
+4. encabeza cada bloque con el documento y las páginas de donde sale, para que
+   el modelo pueda citar la ubicación que pide SYSTEM_PROMPT.
+"""
+import threading
+from typing import Optional
+from .config import logger, OPENAI_MODEL, RAG_TOKENS_CONTEXTO, RAG_SIMILITUD_MIN
+
+SEPARADOR = "\n---\n"
+
+# Un solapamiento se reconoce si el inicio del fragmento siguiente (al menos
+# _MIN_SOLAPAMIENTO caracteres) aparece en los últimos _MAX_SOLAPAMIENTO del anterior.
+_MIN_SOLAPAMIENTO = 20
+_MAX_SOLAPAMIENTO = 4000
+
+_codificador = None
+_lock_codificador = threading.Lock()
+
+
+def _obtener_codificador():
+    """Codificador de tiktoken del modelo; None si no se puede cargar (sin conexión)."""
+    global _codificador
+    if _codificador is None:
+        with _lock_codificador:
+            if _codificador is None:
+                try:
+                    import tiktoken
+                    try:
+                        _codificador = tiktoken.encoding_for_model(OPENAI_MODEL)
+                    except KeyError:
+                        _codificador = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"No se pudo cargar tiktoken ({e}); los tokens del contexto se estiman por caracteres.")
+                    _codificador = False
+    return _codificador or None
+
+
+def contar_tokens(texto: str) -> int:
+    if not texto:
+        return 0
+    codificador = _obtener_codificador()
+    if codificador is None:
+        return (len(texto) + 3) // 4
+    return len(codificador.encode(texto))
+
+
+def recortar_tokens(texto: str, max_tokens: int) -> str:
+    """Primeros `max_tokens` tokens de `texto`."""
+    codificador = _obtener_codificador()
+    if codificador is None:
+        return texto[:max_tokens * 4]
+    return codificador.decode(codificador.encode(texto)[:max_tokens])
+
+
+def solapamiento(anterior: str, siguiente: str) -> int:
+    """Cantidad de caracteres iniciales de `siguiente` que repiten el final de `anterior`."""
+    sonda = siguiente[:_MIN_SOLAPAMIENTO]
+    if len(sonda) < _MIN_SOLAPAMIENTO:
+        return 0
+    pos = anterior.find(sonda, max(0, len(anterior) - _MAX_SOLAPAMIENTO))
+    while pos != -1:
+        # La primera coincidencia es la más larga
+        if siguiente.startswith(anterior[pos:]):
+            return len(anterior) - pos
+        pos = anterior.find(sonda, pos + 1)
+    return 0
+
+
+def referencia(hits: list[dict]) -> str:
+    """Encabezado de un bloque de fragmentos consecutivos: documento y páginas (o fragmentos)."""
+    primero, ultimo = hits[0], hits[-1]
+    if primero.get("source") is None:
+        return ""
+    inicio, fin = primero.get("pagina_inicio", -1), ultimo.get("pagina_fin", -1)
+    if inicio is not None and inicio >= 0:
+        ubicacion = f"Página: {inicio}" if fin == inicio else f"Páginas: {inicio}-{fin}"
+    else:
+        # Vector stores sin páginas: el número de fragmento dentro del documento
+        a, b = primero.get("chunk_index"), ultimo.get("chunk_index")
+        ubicacion = f"Fragmento: {a}" if a == b else f"Fragmentos: {a}-{b}"
+    return f"[Documento: {primero['source']} | {ubicacion}]"
+
+
+class EmpaquetadorContexto:
+    """
+    Arma el contexto dentro del presupuesto de tokens y lleva la cuenta de los
+    tokens ahorrados respecto de concatenar todos los fragmentos.
+    """
+    def __init__(self, presupuesto_tokens: int = RAG_TOKENS_CONTEXTO, similitud_min: float = RAG_SIMILITUD_MIN):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.similitud_min = similitud_min
+        self._lock = threading.Lock()
+
+        # Contadores (ver estadisticas())
+        self.llamadas = 0
+        self.tokens_originales = 0
+        self.tokens_enviados = 0
+        self.descartados_similitud = 0
+        self.descartados_presupuesto = 0
+        self.fusionados = 0
+
+    @staticmethod
+    def _clave(hit: dict) -> Optional[tuple]:
+        # Solo se pueden unir fragmentos con posición conocida dentro del documento
+        if hit.get("source") is None or hit.get("chunk_index") is None or hit["chunk_index"] < 0:
+            return None
+        return hit["source"], hit["chunk_index"]
+
+    def empaquetar(self, hits: list[dict]) -> str:
+        """Devuelve el texto del contexto para los fragmentos `hits` (en orden de relevancia)."""
+        if not hits:
+            return ""
+        tokens_originales = contar_tokens(SEPARADOR.join(h["text"] for h in hits))
+
+        candidatos = [
+            h for h in hits
+            if h.get("similitud") is None or h["similitud"] >= self.similitud_min
+        ]
+        descartados_similitud = len(hits) - len(candidatos)
+
+        # 1. Selección en orden de relevancia. El costo de un fragmento descuenta el
+        #    texto que comparte con sus vecinos ya seleccionados.
+        seleccion: dict = {}   # clave (o id) -> (rango, hit)
+        usados = 0
+        descartados_presupuesto = 0
+        for rango, hit in enumerate(candidatos):
+            clave = self._clave(hit) or ("id", hit["id"])
+            if clave in seleccion:
+                continue
+            costo = contar_tokens(hit["text"]) + (contar_tokens(SEPARADOR) if seleccion else 0)
+            if clave[0] != "id":
+                fuente, indice = clave
+                previo = seleccion.get((fuente, indice - 1))
+                siguiente = seleccion.get((fuente, indice + 1))
+                if previo:
+                    costo -= contar_tokens(hit["text"][:solapamiento(previo[1]["text"], hit["text"])])
+                if siguiente:
+                    texto_siguiente = siguiente[1]["text"]
+                    costo -= contar_tokens(texto_siguiente[:solapamiento(hit["text"], texto_siguiente)])
+                if not previo and not siguiente:
+                    # Empieza un bloque propio: se suma su encabezado
+                    costo += contar_tokens(referencia([hit])) + 1
+            if usados + costo > self.presupuesto_tokens:
+                descartados_presupuesto += 1
+                continue
+            seleccion[clave] = (rango, hit)
+            usados += costo
+
+        # Si ni el fragmento más relevante entra, se envía recortado al presupuesto
+        if not seleccion and candidatos:
+            hit = dict(candidatos[0], text=recortar_tokens(candidatos[0]["text"], self.presupuesto_tokens))
+            seleccion[("id", hit["id"])] = (0, hit)
+            descartados_presupuesto -= 1
+
+        # 2. Unión de fragmentos consecutivos del mismo documento
+        bloques = []   # [rango, texto, clave del último fragmento, fragmentos]
+        fusionados = 0
+        for clave in sorted(seleccion, key=lambda c: (str(c[0]), c[1])):
+            rango, hit = seleccion[clave]
+            ultimo = bloques[-1] if bloques else None
+            if (ultimo and clave[0] != "id" and ultimo[2][0] == clave[0]
+                    and ultimo[2][1] == clave[1] - 1):
+                ultimo[0] = min(ultimo[0], rango)
+                ultimo[1] += hit["text"][solapamiento(ultimo[1], hit["text"]):]
+                ultimo[2] = clave
+                ultimo[3].append(hit)
+                fusionados += 1
+            else:
+                bloques.append([rango, hit["text"], clave, [hit]])
+        bloques.sort(key=lambda b: b[0])
+
+        partes = []
+        for _, texto, _, fragmentos in bloques:
+            encabezado = referencia(fragmentos)
+            partes.append(f"{encabezado}\n{texto}" if encabezado else texto)
+        contexto = SEPARADOR.join(partes)
+        tokens_enviados = contar_tokens(contexto)
+        with self._lock:
+            self.llamadas += 1
+            self.tokens_originales += tokens_originales
+            self.tokens_enviados += tokens_enviados
+            self.descartados_similitud += descartados_similitud
+            self.descartados_presupuesto += descartados_presupuesto
+            self.fusionados += fusionados
+
+        logger.info(
+            f"Contexto RAG: {len(seleccion)}/{len(hits)} fragmentos en {len(bloques)} bloques, "
+            f"{tokens_enviados} tokens ({tokens_originales - tokens_enviados} ahorrados)."
+        )
+        return contexto
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "llamadas": self.llamadas,
+                "tokens_originales": self.tokens_originales,
+                "tokens_enviados": self.tokens_enviados,
+                "tokens_ahorrados": self.tokens_originales - self.tokens_enviados,
+                "descartados_similitud": self.descartados_similitud,
+                "descartados_presupuesto": self.descartados_presupuesto,
+                "fusionados": self.fusionados,
+            }
@@ -0,0 +1,63 @@
+"""
+Gestión del historial que se envía al modelo en cada turno.
+
+El historial completo queda en el estado de la UI, pero al LLM solo se envía:
+- una ventana deslizante de los turnos más recientes que entran en
+  HISTORIAL_TOKENS tokens, y
+- un resumen incremental de los turnos anteriores.
+
+El resumen lo actualiza EstadoChat en un evento en segundo plano, después de
+entregar la respuesta: cuando los mensajes pendientes de resumir superan el
+presupuesto, los turnos más viejos se incorporan al resumen hasta dejar la
+ventana a la mitad del presupuesto. Así el resumen se recalcula cada varios
+turnos y no en todos.
+"""
+from .contexto import contar_tokens
+
+
+def _tokens_mensaje(mensaje: dict) -> int:
+    # ~4 tokens de formato por mensaje en la API de chat
+    return contar_tokens(mensaje.get("content") or "") + 4
+
+
+def inicio_ventana(mensajes: list[dict], presupuesto_tokens: int) -> int:
+    """
+    Índice del primer mensaje de la ventana más larga (desde el final) que entra en
+    el presupuesto. El último mensaje siempre se incluye y la ventana empieza en un
+    mensaje del usuario para no enviar una respuesta sin su pregunta.
+    """
+    if not mensajes:
+        return 0
+    inicio = len(mensajes) - 1
+    usados = _tokens_mensaje(mensajes[inicio])
+    while inicio > 0:
+        costo = _tokens_mensaje(mensajes[inicio - 1])
+        if usados + costo > presupuesto_tokens:
+            break
+        usados += costo
+        inicio -= 1
+    while inicio < len(mensajes) - 1 and mensajes[inicio]["role"] != "user":
+        inicio += 1
+    return inicio
+
+
+def ventana(mensajes: list[dict], presupuesto_tokens: int) -> list[dict]:
+    """Turnos más recientes de `mensajes` que entran en el presupuesto."""
+    return mensajes[inicio_ventana(mensajes, presupuesto_tokens):]
+
+
+def punto_de_corte(mensajes: list[dict], resumido_hasta: int, presupuesto_tokens: int) -> int:
+    """
+    Hasta qué índice conviene resumir. Devuelve `resumido_hasta` (nada que hacer)
+    mientras los mensajes sin resumir entren en el presupuesto; si no, el inicio de
+    una ventana de la mitad del presupuesto.
+    """
+    pendientes = mensajes[resumido_hasta:]
+    if sum(_tokens_mensaje(m) for m in pendientes) <= presupuesto_tokens:
+        return resumido_hasta
+    return resumido_hasta + inicio_ventana(pendientes, presupuesto_tokens // 2)
+
+
+def formatear_para_resumen(mensajes: list[dict]) -> str:
+    etiquetas = {"user": "Estudiante", "assistant": "Asistente"}
+    return "\n\n".join(f"{etiquetas.get(m['role'], m['role'])}: {m['content']}" for m in mensajes)
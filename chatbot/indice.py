@@ -0,0 +1,143 @@
+"""
+Tipos de índice FAISS soportados, con sus parámetros de construcción y búsqueda.
+
+Lo comparten scripts/ingest.py (construye el índice y guarda `index_params.json`
+junto a `index.faiss`) y RAGClient (aplica los parámetros de búsqueda al cargar).
+Todos los índices se envuelven en IndexIDMap2 para conservar los ids de chunk.
+
+numpy y faiss se importan al usarse: `ingest.py --help` solo necesita TIPOS_INDICE.
+"""
+import os
+import json
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    import faiss
+
+TIPOS_INDICE = {
+    "flat-l2": "exacto, distancia L2 (formato original)",
+    "flat-ip": "exacto, producto interno sobre vectores normalizados (coseno)",
+    "hnsw": "grafo HNSW aproximado (rápido; se reconstruye al eliminar vectores)",
+    "ivf-pq": "IVF con cuantización de producto (comprimido, aproximado)",
+    "sq-fp16": "cuantización escalar float16 (mitad de memoria, casi exacto)",
+    "sq8": "cuantización escalar de 8 bits (un cuarto de memoria)",
+}
+
+PARAMETROS_DEFAULT = {
+    # HNSW
+    "hnsw_m": 32,
+    "ef_construccion": 200,
+    "ef_busqueda": 64,
+    # IVF-PQ (nlist None = automático según el tamaño del corpus)
+    "nlist": None,
+    "pq_m": 64,
+    "nprobe": 16,
+}
+
+
+def metrica(tipo: str) -> str:
+    return "l2" if tipo == "flat-l2" else "ip"
+
+
+def nuevos_parametros(tipo: str, **valores) -> dict:
+    """Parámetros completos para `tipo`; los valores None se toman por defecto."""
+    if tipo not in TIPOS_INDICE:
+        raise ValueError(f"Tipo de índice desconocido: {tipo}. Opciones: {', '.join(TIPOS_INDICE)}")
+    params = {"tipo": tipo, "metrica": metrica(tipo), **PARAMETROS_DEFAULT}
+    params.update({k: v for k, v in valores.items() if v is not None})
+    return params
+
+
+def cargar_parametros(path: str) -> dict:
+    """Lee `index_params.json`; sin archivo se asume el índice original (flat L2)."""
+    if not os.path.exists(path):
+        return nuevos_parametros("flat-l2")
+    with open(path, "r", encoding="utf-8") as f:
+        return {**nuevos_parametros("flat-l2"), **json.load(f)}
+
+
+def guardar_parametros(path: str, params: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(params, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def preparar_vectores(vectores, params: dict) -> "np.ndarray":
+    """Copia contigua en float32; normalizada (norma 1) si la métrica es producto interno."""
+    import numpy as np
+    import faiss
+    x = np.array(vectores, dtype=np.float32, copy=True, order="C")
+    if x.ndim == 1:
+        x = x.reshape(1, -1)
+    if params["metrica"] == "ip":
+        faiss.normalize_L2(x)
+    return x
+
+
+def admite_eliminacion(params: dict) -> bool:
+    """HNSW no soporta remove_ids: hay que reconstruirlo al borrar vectores."""
+    return params["tipo"] != "hnsw"
+
+
+def construir_indice(vectores: "np.ndarray", ids: "np.ndarray", params: dict) -> "faiss.Index":
+    """Construye (y entrena si hace falta) el índice del tipo indicado en `params`."""
+    import numpy as np
+    import faiss
+    x = preparar_vectores(vectores, params)
+    n, d = x.shape
+    tipo = params["tipo"]
+    metrica_faiss = faiss.METRIC_L2 if params["metrica"] == "l2" else faiss.METRIC_INNER_PRODUCT
+
+    if tipo in ("flat-l2", "flat-ip"):
+        descripcion = "Flat"
+    elif tipo == "hnsw":
+        descripcion = f"HNSW{params['hnsw_m']},Flat"
+    elif tipo == "ivf-pq":
+        # Al menos ~39 puntos de entrenamiento por centroide; PQ de 8 bits necesita 256
+        if n < 256:
+            raise ValueError(f"IVF-PQ necesita al menos 256 vectores para entrenar (hay {n}).")
+        nlist = params["nlist"] or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n // 39))
+        if d % params["pq_m"] != 0:
+            raise ValueError(f"pq_m={params['pq_m']} debe dividir la dimensión {d}.")
+        params["nlist"] = nlist
+        descripcion = f"IVF{nlist},PQ{params['pq_m']}"
+    elif tipo == "sq-fp16":
+        descripcion = "SQfp16"
+    elif tipo == "sq8":
+        descripcion = "SQ8"
+    else:
+        raise ValueError(f"Tipo de índice desconocido: {tipo}")
+
+    base = faiss.index_factory(d, descripcion, metrica_faiss)
+    if tipo == "hnsw":
+        faiss.downcast_index(base).hnsw.efConstruction = params["ef_construccion"]
+    if not base.is_trained:
+        base.train(x)
+
+    index = faiss.IndexIDMap2(base)
+    index.add_with_ids(x, np.asarray(ids, dtype=np.int64))
+    aplicar_parametros_busqueda(index, params)
+    return index
+
+
+def aplicar_parametros_busqueda(index: "faiss.Index", params: dict):
+    """Aplica los parámetros de búsqueda (efSearch / nprobe) guardados."""
+    import faiss
+    espacio = faiss.ParameterSpace()
+    if params["tipo"] == "hnsw":
+        espacio.set_index_parameter(index, "efSearch", int(params["ef_busqueda"]))
+    elif params["tipo"] == "ivf-pq":
+        espacio.set_index_parameter(index, "nprobe", int(params["nprobe"]))
+
+
+def a_similitud(distancias: "np.ndarray", params: dict) -> "np.ndarray":
+    """
+    Convierte los scores de FAISS a similitud coseno (más alto = más parecido).
+    Con L2 se asume que los embeddings tienen norma 1 (caso de OpenAI): d² = 2 - 2·cos.
+    """
+    if params["metrica"] == "l2":
+        return 1.0 - distancias / 2.0
+    return distancias
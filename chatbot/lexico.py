@@ -0,0 +1,163 @@
+"""
+Índice léxico BM25 sobre los chunks, con normalización adaptada a la ortografía guaraní.
+
+Lo construye scripts/ingest.py (directorio `vector_store/lexico/`) y lo usa
+RAGClient para la búsqueda híbrida (léxica + densa) y para responder búsquedas
+de un término sin pedir el embedding a la API.
+
+Normalización:
+- minúsculas y tildes de acento eliminadas (á → a, ý → y, ü → u);
+- vocales nasales con tilde plegadas a la vocal oral (ã ẽ ĩ õ ũ ỹ → a e i o u y, g̃ → g),
+  porque en las consultas se escriben con o sin tilde indistintamente; la ñ se conserva;
+- el puso (’ ‘ ´ ` ʼ ꞌ ') se elimina dentro de la palabra: "mba'e", "mba’e" y "mbae"
+  dan el mismo término.
+"""
+import os
+import re
+import json
+import math
+import unicodedata
+from collections import Counter
+from typing import Iterable, Optional
+import numpy as np
+
+_PUSO = "'’‘´`ʼꞌ"
+_TABLA_PUSO = str.maketrans({c: None for c in _PUSO})
+_ACENTOS = {"\u0301", "\u0300", "\u0302", "\u0308"}  # agudo, grave, circunflejo, diéresis
+_TILDE = "\u0303"
+_TOKEN = re.compile(r"[0-9a-zñ]+")
+
+# Palabras de las preguntas en castellano que no identifican el término buscado
+STOPWORDS = frozenset("""
+a al como cual cuales de del dice decir dicen el en es esta este esto guarani la las
+lo los me o palabra para por que quiere se significa significado son su traduce traducir
+traduccion un una y castellano espanol
+""".split())
+
+
+def normalizar_guarani(texto: str) -> str:
+    """Normaliza un texto según las reglas descritas en el encabezado del módulo."""
+    salida = []
+    for c in unicodedata.normalize("NFD", texto.lower()):
+        if c in _ACENTOS:
+            continue
+        if c == _TILDE:
+            # Solo la ñ conserva la tilde; en vocales (y g) es nasalidad y se pliega
+            if salida and salida[-1] == "n":
+                salida[-1] = "ñ"
+            continue
+        salida.append(c)
+    return "".join(salida).translate(_TABLA_PUSO)
+
+
+def tokenizar(texto: str) -> list[str]:
+    return _TOKEN.findall(normalizar_guarani(texto))
+
+
+def terminos_consulta(texto: str) -> list[str]:
+    """Tokens de la consulta sin las palabras funcionales de la pregunta."""
+    return [t for t in tokenizar(texto) if t not in STOPWORDS]
+
+
+class IndiceLexico:
+    """
+    Índice invertido BM25 en arrays de numpy (formato CSR), cargado con mmap.
+
+    Archivos en el directorio del índice:
+        vocabulario.json   términos en orden + parámetros (n_docs, avgdl, k1, b)
+        inicio.npy         int64[V + 1], inicio de las postings de cada término
+        docs.npy           int32, ids de chunk de cada posting
+        tf.npy             uint16, frecuencia del término en el chunk
+        largo.npy          float32[n], largo en tokens de cada chunk (fila == id)
+    """
+
+    def __init__(self, vocabulario: dict, inicio, docs, tf, largo, n_docs: int, avgdl: float,
+                 k1: float = 1.2, b: float = 0.75):
+        self.vocabulario = vocabulario
+        self.inicio = inicio
+        self.docs = docs
+        self.tf = tf
+        self.largo = largo
+        self.n_docs = n_docs
+        self.avgdl = avgdl or 1.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def construir(cls, chunks: Iterable[tuple[int, str]], k1: float = 1.2, b: float = 0.75) -> "IndiceLexico":
+        """Construye el índice a partir de pares (id de chunk, texto)."""
+        postings: dict[str, list[tuple[int, int]]] = {}
+        largos = {}
+        for chunk_id, texto in chunks:
+            tokens = tokenizar(texto)
+            largos[chunk_id] = len(tokens)
+            for termino, frecuencia in Counter(tokens).items():
+                postings.setdefault(termino, []).append((chunk_id, frecuencia))
+
+        terminos = sorted(postings)
+        inicio = np.zeros(len(terminos) + 1, dtype=np.int64)
+        for i, termino in enumerate(terminos):
+            inicio[i + 1] = inicio[i] + len(postings[termino])
+        docs = np.empty(inicio[-1], dtype=np.int32)
+        tf = np.empty(inicio[-1], dtype=np.uint16)
+        for i, termino in enumerate(terminos):
+            lista = postings[termino]
+            docs[inicio[i]:inicio[i + 1]] = [d for d, _ in lista]
+            tf[inicio[i]:inicio[i + 1]] = [min(f, 65535) for _, f in lista]
+
+        n = max(largos) + 1 if largos else 0
+        largo = np.zeros(n, dtype=np.float32)
+        for chunk_id, l in largos.items():
+            largo[chunk_id] = l
+        avgdl = float(sum(largos.values()) / len(largos)) if largos else 1.0
+        vocabulario = {t: i for i, t in enumerate(terminos)}
+        return cls(vocabulario, inicio, docs, tf, largo, len(largos), avgdl, k1, b)
+
+    def guardar(self, directorio: str):
+        os.makedirs(directorio, exist_ok=True)
+        for nombre in ("inicio", "docs", "tf", "largo"):
+            np.save(os.path.join(directorio, f"{nombre}.npy"), getattr(self, nombre))
+        terminos = sorted(self.vocabulario, key=self.vocabulario.get)
+        with open(os.path.join(directorio, "vocabulario.json"), "w", encoding="utf-8") as f:
+            json.dump({"terminos": terminos, "n_docs": self.n_docs, "avgdl": self.avgdl,
+                       "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+
+    @classmethod
+    def cargar(cls, directorio: str) -> Optional["IndiceLexico"]:
+        ruta_vocabulario = os.path.join(directorio, "vocabulario.json")
+        if not os.path.exists(ruta_vocabulario):
+            return None
+        with open(ruta_vocabulario, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            nombre: np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode="r")
+            for nombre in ("inicio", "docs", "tf", "largo")
+        }
+        vocabulario = {t: i for i, t in enumerate(meta["terminos"])}
+        return cls(vocabulario, n_docs=meta["n_docs"], avgdl=meta["avgdl"], k1=meta["k1"], b=meta["b"], **arrays)
+
+    def buscar(self, terminos: list[str], k: int = 10) -> list[tuple[int, float, int]]:
+        """
+        Devuelve hasta k tuplas (id de chunk, score BM25, términos de la consulta
+        presentes en el chunk), ordenadas por score descendente.
+        """
+        scores = np.zeros(len(self.largo), dtype=np.float32)
+        cobertura = np.zeros(len(self.largo), dtype=np.int16)
+        for termino in set(terminos):
+            t = self.vocabulario.get(termino)
+            if t is None:
+                continue
+            a, z = int(self.inicio[t]), int(self.inicio[t + 1])
+            docs = np.asarray(self.docs[a:z])
+            tf = np.asarray(self.tf[a:z], dtype=np.float32)
+            df = z - a
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norma = self.k1 * (1 - self.b + self.b * self.largo[docs] / self.avgdl)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norma)
+            cobertura[docs] += 1
+
+        candidatos = np.flatnonzero(scores)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-scores[candidatos], k)[:k]]
+        candidatos = candidatos[np.argsort(-scores[candidatos])]
+        return [(int(i), float(scores[i]), int(cobertura[i])) for i in candidatos]
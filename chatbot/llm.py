@@ -1,80 +1,415 @@
-from openai import OpenAI
-from .config import OPENAI_API_KEY, OPENAI_MODEL, logger
+import time
+import asyncio
+import hashlib
+import unicodedata
+from typing import AsyncIterator, Optional
+from .clientes import obtener_cliente, obtener_cliente_async
+from .contexto import EmpaquetadorContexto
+from .historial import ventana, formatear_para_resumen
+from .prompts import PROMPT_RESUMEN
+from .vuelo_unico import VueloUnico, DifusionStream
+from .resiliencia import llamar, llamar_sync, contar
+from . import admision
+from . import metricas
+from .config import (
+    OPENAI_MODEL, CACHE_SEMANTICO, AGRUPAR_LLAMADAS, HISTORIAL_TOKENS, HISTORIAL_RESUMEN_TOKENS,
+    PLAZO_RAG_SEG, PLAZO_PRIMER_TOKEN_SEG, PLAZO_LLM_SEG, logger,
+)
+
+MENSAJE_ERROR = "Lo siento, hubo un error al procesar tu solicitud. Por favor intentá nuevamente más tarde."
+# Se agregan a una respuesta en streaming que se cortó por superar PLAZO_LLM_SEG o por un error
+MENSAJE_CORTADO = "\n\n_(La respuesta se interrumpió porque el servicio tardó demasiado. Podés volver a preguntar.)_"
+MENSAJE_INTERRUMPIDO = "\n\n_(La respuesta se interrumpió por un error del servicio. Podés volver a preguntar.)_"
 
 class LLMClient:
     """
     Clase para manejar la interacción con OpenAI.
     Centraliza la lógica para facilitar cambios futuros (modelos locales, otros proveedores).
+
+    Los clientes HTTP se comparten con RAGClient (ver clientes.py).
     """
     def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
         self.model = OPENAI_MODEL
 
-    def obtener_respuesta(self, historial_mensajes: list[dict], system_prompt: str) -> str:
+        # Empaqueta los fragmentos recuperados dentro del presupuesto de tokens (ver contexto.py)
+        self.empaquetador = EmpaquetadorContexto()
+
+        # Preguntas idénticas simultáneas comparten una sola completion (ver vuelo_unico.py)
+        self.vuelos_completion = VueloUnico("completions")
+        self.difusion_stream = DifusionStream("completions_stream")
+
+        # Caché semántico opcional delante de la completion (ver cache_semantico.py)
+        self.cache_semantico = None
+        if CACHE_SEMANTICO:
+            from .cache_semantico import CacheSemantico
+            self.cache_semantico = CacheSemantico()
+
+        metricas.registrar_estadisticas("chatbot_contexto", self.empaquetador.estadisticas)
+        metricas.registrar_estadisticas("chatbot_agrupadas_completions", self.vuelos_completion.estadisticas)
+        metricas.registrar_estadisticas("chatbot_agrupadas_stream", self.difusion_stream.estadisticas)
+        if self.cache_semantico is not None:
+            metricas.registrar_estadisticas("chatbot_cache_semantico", self.cache_semantico.estadisticas)
+
+    @staticmethod
+    def _ultimo_mensaje_usuario(historial_mensajes: list[dict]) -> Optional[str]:
+        # Asumimos que el último mensaje es el del usuario actual
+        return next((m["content"] for m in reversed(historial_mensajes) if m["role"] == "user"), None)
+
+    @staticmethod
+    def _armar_mensajes(historial_mensajes: list[dict], system_prompt: str, contexto: str, resumen: str = "") -> list[dict]:
+        """
+        Inyecta el resumen de la conversación y el contexto RAG en el system prompt y
+        antepone el sistema a los turnos recientes del historial (ver historial.py).
+        """
+        system_prompt_final = system_prompt
+        if resumen:
+            system_prompt_final += f"\n\n### RESUMEN DE LA CONVERSACIÓN ANTERIOR\n{resumen}\n### FIN RESUMEN\n"
+        if contexto:
+            block_context = f"\n\n### INFORMACIÓN DE CONTEXTO (RAG)\nUse esta información SOLO si es relevante:\n{contexto}\n### FIN CONTEXTO\n"
+            system_prompt_final += block_context
+            logger.info("Contexto RAG inyectado en el prompt.")
+
+        # Preparamos los mensajes incluyendo el sistema al principio
+        return [{"role": "system", "content": system_prompt_final}] + ventana(historial_mensajes, HISTORIAL_TOKENS)
+
+    def _construir_mensajes(self, historial_mensajes: list[dict], system_prompt: str, resumen: str = ""):
+        """
+        Recupera el contexto RAG y arma la lista de mensajes para la API
+        (system prompt con contexto inyectado + historial).
+
+        Returns:
+            tuple: (mensajes para la API, Recuperacion o None si no hubo consulta RAG)
+        """
+        # --- RAG INTEGRATION ---
+        # Recuperar contexto relevante siempre
+        contexto = ""
+        recuperacion = None
+        last_user_msg = self._ultimo_mensaje_usuario(historial_mensajes)
+
+        if last_user_msg:
+            try:
+                # Import dinámico para evitar errores circulares o de ini
+                from .rag_client import rag_client
+                # Consulta protegida
+                logger.info("Consultando RAG...")
+                # Aumentamos top_k a 8 para tener mas contexto
+                with metricas.medir("rag"):
+                    recuperacion = rag_client.recuperar(last_user_msg, n_results=8)
+                with metricas.medir("contexto"):
+                    contexto = self.empaquetador.empaquetar(recuperacion.hits)
+                logger.info(f"RAG recuperó {len(contexto)} caracteres.")
+            except Exception as e:
+                logger.error(f"⚠️ Error crítico recuperando contexto RAG (se omite): {e}", exc_info=True)
+                contexto = ""
+
+        return self._armar_mensajes(historial_mensajes, system_prompt, contexto, resumen), recuperacion
+
+    async def _aconstruir_mensajes(self, historial_mensajes: list[dict], system_prompt: str, resumen: str = ""):
+        """Versión asíncrona de `_construir_mensajes` (no ocupa hilos del pool)."""
+        contexto = ""
+        recuperacion = None
+        last_user_msg = self._ultimo_mensaje_usuario(historial_mensajes)
+
+        if last_user_msg:
+            try:
+                from .rag_client import rag_client
+                logger.info("Consultando RAG...")
+                with metricas.medir("rag"):
+                    # Si la recuperación no termina a tiempo se responde sin contexto
+                    recuperacion = await asyncio.wait_for(
+                        rag_client.arecuperar(last_user_msg, n_results=8), PLAZO_RAG_SEG
+                    )
+                with metricas.medir("contexto"):
+                    contexto = self.empaquetador.empaquetar(recuperacion.hits)
+                logger.info(f"RAG recuperó {len(contexto)} caracteres.")
+            except asyncio.TimeoutError:
+                contar("plazo_vencido", "rag")
+                logger.warning(f"El RAG superó el plazo de {PLAZO_RAG_SEG}s: se responde sin contexto.")
+                recuperacion, contexto = None, ""
+            except Exception as e:
+                logger.error(f"⚠️ Error crítico recuperando contexto RAG (se omite): {e}", exc_info=True)
+                contexto = ""
+
+        return self._armar_mensajes(historial_mensajes, system_prompt, contexto, resumen), recuperacion
+
+    def _es_cacheable(self, historial_mensajes: list[dict], recuperacion, resumen: str = "") -> bool:
+        """
+        El caché semántico solo aplica a conversaciones de un único turno (una sola
+        pregunta, sin respuestas previas ni resumen) para las que el RAG encontró
+        fragmentos. En conversaciones multi-turno la respuesta depende del historial.
+        """
+        return (
+            self.cache_semantico is not None
+            and recuperacion is not None
+            and recuperacion.embedding is not None
+            and bool(recuperacion.hits)
+            and len(historial_mensajes) == 1
+            and not resumen
+        )
+
+    def _buscar_en_cache(self, recuperacion, system_prompt: str) -> Optional[str]:
+        clave = self.cache_semantico.clave_prompt(system_prompt, self.model)
+        respuesta = self.cache_semantico.buscar(recuperacion.embedding, recuperacion.ids, clave, recuperacion.version)
+        if respuesta is not None:
+            logger.info("Respuesta servida desde el caché semántico.")
+        return respuesta
+
+    def _guardar_en_cache(self, recuperacion, system_prompt: str, respuesta: str):
+        clave = self.cache_semantico.clave_prompt(system_prompt, self.model)
+        self.cache_semantico.guardar(recuperacion.embedding, recuperacion.ids, clave, respuesta, recuperacion.version)
+
+    def _clave_completion(self, mensajes_api: list[dict], historial_mensajes: list[dict], resumen: str) -> Optional[str]:
+        """
+        Clave para agrupar completions idénticas en curso (ver vuelo_unico.py). Solo
+        aplica a preguntas sin historial ni resumen, cuya respuesta depende únicamente
+        del prompt del sistema (con el contexto RAG ya inyectado) y de la pregunta.
+        """
+        if not AGRUPAR_LLAMADAS or len(historial_mensajes) != 1 or resumen:
+            return None
+        pregunta = " ".join(unicodedata.normalize("NFC", historial_mensajes[0]["content"]).lower().split())
+        contenido = f"{self.model}\x00{mensajes_api[0]['content']}\x00{pregunta}"
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def _completar(self, mensajes_api: list[dict]) -> str:
+        logger.info(f"Enviando request a OpenAI. Modelo: {self.model}")
+
+        # --- ZONA DE EXTENSIÓN FUTURA: TOOLS ---
+        # Aquí se podrían definir 'tools' para function calling si fuera necesario.
+        # tools = [...]
+        # response = self.client.chat.completions.create(..., tools=tools)
+
+        # Camino síncrono (en hilos): mismo límite de llamadas al modelo que los turnos
+        with admision.turnos.ocupar_hilo(), metricas.medir("llm_total"):
+            response = llamar_sync(
+                lambda plazo: obtener_cliente().chat.completions.create(
+                    model=self.model,
+                    messages=mensajes_api,
+                    temperature=0, # Creatividad balanceada
+                    timeout=plazo,
+                ),
+                "llm", PLAZO_LLM_SEG, PLAZO_LLM_SEG,
+            )
+        metricas.sumar_tokens(response.usage)
+        return response.choices[0].message.content
+
+    async def _acompletar(self, mensajes_api: list[dict]) -> str:
+        logger.info(f"Enviando request a OpenAI. Modelo: {self.model}")
+        with metricas.medir("llm_total"):
+            response = await llamar(
+                lambda plazo: obtener_cliente_async().chat.completions.create(
+                    model=self.model,
+                    messages=mensajes_api,
+                    temperature=0,
+                    timeout=plazo,
+                ),
+                "llm", PLAZO_LLM_SEG, PLAZO_LLM_SEG,
+            )
+        metricas.sumar_tokens(response.usage)
+        return response.choices[0].message.content
+
+    async def _astream(self, mensajes_api: list[dict], al_terminar=None) -> AsyncIterator[str]:
+        """Deltas de la completion; al terminar sin errores llama a `al_terminar(texto completo)`."""
+        logger.info(f"Enviando request (stream) a OpenAI. Modelo: {self.model}")
+        inicio = time.perf_counter()
+
+        async def abrir(plazo):
+            # El intento incluye el primer chunk: hasta ahí no se emitió nada y se puede
+            # reintentar. `timeout` también acota cada lectura siguiente del stream.
+            stream = await obtener_cliente_async().chat.completions.create(
+                model=self.model,
+                messages=mensajes_api,
+                temperature=0,
+                stream=True,
+                # El último chunk trae el uso de tokens (sin choices)
+                stream_options={"include_usage": True},
+                timeout=plazo,
+            )
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.close()
+                raise
+
+        limite = time.monotonic() + PLAZO_LLM_SEG
+        stream, primero = await llamar(abrir, "llm", PLAZO_PRIMER_TOKEN_SEG, PLAZO_LLM_SEG)
+
+        async def chunks():
+            # Pasado el primer chunk ya no se reintenta, pero el plazo total sigue valiendo
+            if primero is not None:
+                yield primero
+            while True:
+                try:
+                    yield await asyncio.wait_for(stream.__anext__(), limite - time.monotonic())
+                except StopAsyncIteration:
+                    return
+
+        partes = []
+        completa = True
+        try:
+            async for chunk in chunks():
+                if getattr(chunk, "usage", None):
+                    metricas.sumar_tokens(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not partes:
+                        metricas.observar("llm_primer_token", time.perf_counter() - inicio)
+                    partes.append(delta)
+                    yield delta
+        except asyncio.TimeoutError:
+            # Se corta lo recibido hasta ahora (no se cachea) en lugar de retener el turno
+            completa = False
+            contar("plazo_vencido", "llm")
+            logger.warning(f"Respuesta en streaming cortada: se superó PLAZO_LLM_SEG ({PLAZO_LLM_SEG}s).")
+            yield MENSAJE_CORTADO
+        finally:
+            await stream.close()
+        metricas.observar("llm_total", time.perf_counter() - inicio)
+        if al_terminar is not None and partes and completa:
+            al_terminar("".join(partes))
+
+    def obtener_respuesta(self, historial_mensajes: list[dict], system_prompt: str, resumen: str = "") -> str:
         """
         Envía el historial de chat a OpenAI y obtiene la respuesta.
-        
+
         Args:
             historial_mensajes: Lista de diccionarios {'role': '...', 'content': '...'}
             system_prompt: El prompt del sistema actual.
-            
+            resumen: Resumen de los turnos anteriores que ya no se envían completos.
+
         Returns:
             str: El contenido de la respuesta del asistente.
         """
         try:
-            # --- RAG INTEGRATION ---
-            # Recuperar contexto relevante siempre
-            contexto = ""
-            # Asumimos que el último mensaje es el del usuario actual
-            last_user_msg = next((m["content"] for m in reversed(historial_mensajes) if m["role"] == "user"), None)
-            
-            if last_user_msg:
-                try:
-                    # Import dinámico para evitar errores circulares o de ini
-                    from .rag_client import rag_client
-                    # Consulta protegida
-                    logger.info("Consultando RAG...")
-                    # Aumentamos top_k a 8 para tener mas contexto
-                    contexto = rag_client.query_knowledge_base(last_user_msg, n_results=8)
-                    logger.info(f"RAG recuperó {len(contexto)} caracteres.")
-                except Exception as e:
-                    logger.error(f"⚠️ Error crítico recuperando contexto RAG (se omite): {e}", exc_info=True)
-                    contexto = ""
-
-            # Si hay contexto, lo inyectamos en el system prompt para esta llamada
-            system_prompt_final = system_prompt
-            if contexto:
-                block_context = f"\n\n### INFORMACIÓN DE CONTEXTO (RAG)\nUse esta información SOLO si es relevante:\n{contexto}\n### FIN CONTEXTO\n"
-                system_prompt_final += block_context
-                logger.info("Contexto RAG inyectado en el prompt.")
-
-            # Preparamos los mensajes incluyendo el sistema al principio
-            mensajes_api = [{"role": "system", "content": system_prompt_final}] + historial_mensajes
-            
-            logger.info(f"Enviando request a OpenAI. Modelo: {self.model}")
-            
-            # --- ZONA DE EXTENSIÓN FUTURA: TOOLS ---
-            # Aquí se podrían definir 'tools' para function calling si fuera necesario.
-            # tools = [...]
-            # response = self.client.chat.completions.create(..., tools=tools)
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=mensajes_api,
-                temperature=0, # Creatividad balanceada
-            )
-            
-            contenido = response.choices[0].message.content
-            
-            # --- ZONA DE EXTENSIÓN FUTURA: RAG ---
-            # Antes de llamar a OpenAI, aquí se podría consultar una Vector DB (pgvector/Pinecone)
-            # para inyectar contexto relevante en el system_prompt o en los mensajes.
-            
-            return contenido
+            mensajes_api, recuperacion = self._construir_mensajes(historial_mensajes, system_prompt, resumen)
+
+            cacheable = self._es_cacheable(historial_mensajes, recuperacion, resumen)
+            if cacheable:
+                cacheada = self._buscar_en_cache(recuperacion, system_prompt)
+                if cacheada is not None:
+                    return cacheada
+
+            def completar():
+                contenido = self._completar(mensajes_api)
+                if cacheable and contenido:
+                    self._guardar_en_cache(recuperacion, system_prompt, contenido)
+                return contenido
+
+            clave = self._clave_completion(mensajes_api, historial_mensajes, resumen)
+            if clave is None:
+                return completar()
+            return self.vuelos_completion.ejecutar_sync(clave, completar)
 
         except Exception as e:
             logger.error(f"Error al llamar a OpenAI: {e}")
-            return "Lo siento, hubo un error al procesar tu solicitud. Por favor intentá nuevamente más tarde."
+            return MENSAJE_ERROR
+
+    async def aobtener_respuesta(self, historial_mensajes: list[dict], system_prompt: str, resumen: str = "") -> str:
+        """
+        Versión asíncrona nativa de `obtener_respuesta`: RAG y completion se
+        ejecutan sobre el cliente AsyncOpenAI compartido.
+        """
+        try:
+            mensajes_api, recuperacion = await self._aconstruir_mensajes(historial_mensajes, system_prompt, resumen)
+
+            cacheable = self._es_cacheable(historial_mensajes, recuperacion, resumen)
+            if cacheable:
+                cacheada = self._buscar_en_cache(recuperacion, system_prompt)
+                if cacheada is not None:
+                    return cacheada
+
+            async def completar():
+                contenido = await self._acompletar(mensajes_api)
+                if cacheable and contenido:
+                    self._guardar_en_cache(recuperacion, system_prompt, contenido)
+                return contenido
+
+            clave = self._clave_completion(mensajes_api, historial_mensajes, resumen)
+            if clave is None:
+                return await completar()
+            return await self.vuelos_completion.ejecutar(clave, completar)
+
+        except Exception as e:
+            logger.error(f"Error al llamar a OpenAI: {e}")
+            return MENSAJE_ERROR
+
+    async def obtener_respuesta_stream(self, historial_mensajes: list[dict], system_prompt: str,
+                                       resumen: str = "") -> AsyncIterator[str]:
+        """
+        Versión streaming de `obtener_respuesta`: genera los fragmentos (deltas)
+        de la respuesta a medida que OpenAI los produce.
+
+        Si ocurre un error antes del primer fragmento se emite el mensaje de error
+        genérico; si ocurre a mitad de la respuesta se corta el stream con el aviso
+        MENSAJE_INTERRUMPIDO (como MENSAJE_CORTADO al vencer el plazo), así la UI y el
+        historial guardado distinguen una respuesta parcial de una completa.
+        """
+        emitido = False
+        try:
+            mensajes_api, recuperacion = await self._aconstruir_mensajes(historial_mensajes, system_prompt, resumen)
+
+            cacheable = self._es_cacheable(historial_mensajes, recuperacion, resumen)
+            if cacheable:
+                cacheada = self._buscar_en_cache(recuperacion, system_prompt)
+                if cacheada is not None:
+                    emitido = True
+                    yield cacheada
+                    return
+
+            # Solo se cachean respuestas completas (el stream terminó sin errores)
+            def al_terminar(texto: str):
+                if cacheable:
+                    self._guardar_en_cache(recuperacion, system_prompt, texto)
+
+            clave = self._clave_completion(mensajes_api, historial_mensajes, resumen)
+            if clave is None:
+                deltas = self._astream(mensajes_api, al_terminar)
+            else:
+                # Preguntas idénticas simultáneas comparten un único stream de OpenAI
+                deltas = self.difusion_stream.suscribir(clave, lambda: self._astream(mensajes_api, al_terminar))
+            async for delta in deltas:
+                emitido = True
+                yield delta
+
+        except Exception as e:
+            logger.error(f"Error en el stream de OpenAI: {e}")
+            yield MENSAJE_INTERRUMPIDO if emitido else MENSAJE_ERROR
+
+    async def aresumir(self, resumen_previo: str, mensajes: list[dict]) -> Optional[str]:
+        """
+        Incorpora `mensajes` al resumen de la conversación. Se llama fuera del camino
+        crítico (después de entregar la respuesta); devuelve None si falla, en cuyo
+        caso se conserva el resumen anterior.
+        """
+        contenido = formatear_para_resumen(mensajes)
+        if resumen_previo:
+            contenido = f"RESUMEN ACTUAL:\n{resumen_previo}\n\nMENSAJES NUEVOS:\n{contenido}"
+        try:
+            # Fuera del turno: los resúmenes tienen su propio límite de llamadas (ver admision.py)
+            async with admision.resumenes.ocupar():
+                inicio = time.perf_counter()
+                response = await llamar(
+                    lambda plazo: obtener_cliente_async().chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": PROMPT_RESUMEN.format(max_palabras=HISTORIAL_RESUMEN_TOKENS * 3 // 4)},
+                            {"role": "user", "content": contenido},
+                        ],
+                        temperature=0,
+                        max_tokens=HISTORIAL_RESUMEN_TOKENS,
+                        timeout=plazo,
+                    ),
+                    "resumen", PLAZO_LLM_SEG, PLAZO_LLM_SEG,
+                )
+            metricas.observar("resumen", time.perf_counter() - inicio)
+            metricas.sumar_tokens(response.usage, prefijo="resumen_")
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"Error al resumir el historial (se conserva el resumen anterior): {e}")
+            return None
 
     # --- ZONA DE EXTENSIÓN FUTURA: MULTIAGENTE ---
     # Se podrían agregar métodos para delegar tareas a otros agentes especializados.
@@ -0,0 +1,164 @@
+"""
+Métricas de latencia por etapa, tokens y cachés, en formato de texto de Prometheus.
+
+Cada etapa de un turno de chat se mide con `medir("etapa")` (o `observar()`
+cuando el inicio y el fin están en lugares distintos) y se acumula en un
+histograma con buckets fijos: registrar una observación es una búsqueda
+binaria y tres sumas bajo un lock, sin asignar memoria. Las estadísticas de
+los cachés y demás componentes se leen recién al exportar, así que sin nadie
+consultando `/metrics` el costo es prácticamente nulo.
+
+Etapas: estado, ui, cola_turnos, rag, cola_embeddings, embedding,
+busqueda_lexica, busqueda_faiss, contexto, llm_primer_token, llm_total,
+cola_resumenes, resumen, turno.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+# Buckets en segundos: de 5 ms (búsquedas en memoria) a 30 s (respuestas largas)
+BUCKETS_SEG = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _formatear(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Histograma:
+    """Histograma con una etiqueta (p. ej. la etapa)."""
+
+    def __init__(self, nombre: str, ayuda: str, etiqueta: str, buckets=BUCKETS_SEG):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # valor de la etiqueta -> [conteos por bucket (+Inf al final), suma, cantidad]
+        self._series: dict[str, list] = {}
+
+    def observar(self, valor_etiqueta: str, valor: float):
+        i = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valor_etiqueta)
+            if serie is None:
+                serie = self._series[valor_etiqueta] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for valor_etiqueta, (conteos, suma, cantidad) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                lineas.append(
+                    f'{self.nombre}_bucket{{{self.etiqueta}="{valor_etiqueta}",le="{_formatear(limite)}"}} {acumulado}'
+                )
+            lineas.append(f'{self.nombre}_sum{{{self.etiqueta}="{valor_etiqueta}"}} {suma:.6f}')
+            lineas.append(f'{self.nombre}_count{{{self.etiqueta}="{valor_etiqueta}"}} {cantidad}')
+        return lineas
+
+
+class Contador:
+    """Contador monótono con una etiqueta."""
+
+    def __init__(self, nombre: str, ayuda: str, etiqueta: str):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self._lock = threading.Lock()
+        self._valores: dict[str, float] = {}
+
+    def sumar(self, valor_etiqueta: str, valor: float = 1):
+        with self._lock:
+            self._valores[valor_etiqueta] = self._valores.get(valor_etiqueta, 0) + valor
+
+    def exportar(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            valores = dict(self._valores)
+        for valor_etiqueta, valor in sorted(valores.items()):
+            lineas.append(f'{self.nombre}{{{self.etiqueta}="{valor_etiqueta}"}} {_formatear(valor)}')
+        return lineas
+
+
+DURACION_ETAPAS = Histograma(
+    "chatbot_etapa_duracion_segundos", "Duración de cada etapa de un turno de chat.", "etapa"
+)
+TOKENS = Contador(
+    "chatbot_tokens_total", "Tokens informados por la API de OpenAI, por tipo.", "tipo"
+)
+
+# Componentes con un método estadisticas() que se leen al exportar
+_estadisticas: list[tuple[str, Callable[[], dict]]] = []
+
+
+def observar(etapa: str, segundos: float):
+    DURACION_ETAPAS.observar(etapa, segundos)
+
+
+@contextmanager
+def medir(etapa: str):
+    """Mide la duración del bloque `with` como una observación de `etapa`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        DURACION_ETAPAS.observar(etapa, time.perf_counter() - inicio)
+
+
+def sumar_tokens(uso, prefijo: str = ""):
+    """Suma el `usage` de una respuesta de OpenAI (prompt/completion) al contador de tokens."""
+    if uso is None:
+        return
+    for campo in ("prompt_tokens", "completion_tokens"):
+        valor = getattr(uso, campo, None)
+        if valor:
+            TOKENS.sumar(f"{prefijo}{campo.split('_')[0]}", valor)
+
+
+def registrar_estadisticas(prefijo: str, funcion: Callable[[], dict]):
+    """
+    Publica los valores numéricos de `funcion()` (p. ej. CacheEmbeddings.estadisticas)
+    como gauges `<prefijo>_<clave>`. Se evalúa solo al exportar.
+    """
+    _estadisticas.append((prefijo, funcion))
+
+
+def exportar() -> str:
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+    lineas = DURACION_ETAPAS.exportar() + TOKENS.exportar()
+    for prefijo, funcion in _estadisticas:
+        try:
+            valores = funcion()
+        except Exception:
+            continue
+        for clave, valor in valores.items():
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                continue
+            nombre = f"{prefijo}_{clave}"
+            lineas.append(f"# TYPE {nombre} gauge")
+            lineas.append(f"{nombre} {_formatear(valor)}")
+    return "\n".join(lineas) + "\n"
+
+
+def api_metricas(ruta: str = "/metrics"):
+    """
+    App Starlette con la ruta de métricas, para usar como `api_transformer` de
+    rx.App (Reflex monta su propia API debajo).
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+
+    async def metricas(request):
+        return PlainTextResponse(exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return Starlette(routes=[Route(ruta, metricas, methods=["GET"])])
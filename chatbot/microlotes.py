@@ -0,0 +1,83 @@
+"""
+Micro-lotes para agrupar operaciones de sesiones concurrentes.
+
+Las consultas que llegan dentro de una ventana corta (RAG_LOTE_VENTANA_MS) o
+hasta juntar RAG_LOTE_MAX se procesan juntas: un solo `embeddings.create` con
+varias entradas y un solo `index.search` sobre la matriz apilada. Cada
+solicitante espera su propio resultado; la latencia agregada está acotada por
+la ventana.
+
+Pensado para el event loop único del backend: los pendientes y el temporizador
+pertenecen al loop en el que se encolaron.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+
+
+class MicroLoteador:
+    """Junta los ítems enviados con `enviar()` y los procesa en lote con `procesar`."""
+
+    def __init__(self, nombre: str, procesar: Callable[[list], Awaitable[list]], ventana_ms: float, max_lote: int):
+        self.nombre = nombre
+        self.procesar = procesar
+        self.ventana_seg = ventana_ms / 1000
+        self.max_lote = max(1, max_lote)
+        self._pendientes: list[tuple[Any, asyncio.Future]] = []
+        self._temporizador = None
+        self._tareas: set[asyncio.Task] = set()
+
+        # Contadores (ver estadisticas())
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.items = 0
+        self.lote_maximo = 0
+
+    async def enviar(self, item):
+        """Encola `item` y espera el resultado que le corresponde en el lote."""
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._pendientes.append((item, futuro))
+        if len(self._pendientes) >= self.max_lote:
+            self._despachar()
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self.ventana_seg, self._despachar)
+        return await futuro
+
+    def _despachar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return
+        with self._lock:
+            self.lotes += 1
+            self.items += len(lote)
+            self.lote_maximo = max(self.lote_maximo, len(lote))
+        tarea = asyncio.get_running_loop().create_task(self._procesar(lote))
+        # Referencia fuerte hasta que termine (el event loop solo guarda referencias débiles)
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def _procesar(self, lote: list):
+        try:
+            resultados = await self.procesar([item for item, _ in lote])
+        except Exception as e:
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        for (_, futuro), resultado in zip(lote, resultados):
+            # Un solicitante cancelado no recibe nada; el resto del lote sigue
+            if not futuro.done():
+                futuro.set_result(resultado)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "lotes": self.lotes,
+                "items": self.items,
+                "tamano_medio": self.items / self.lotes if self.lotes else 0.0,
+                "lote_maximo": self.lote_maximo,
+            }
@@ -0,0 +1,202 @@
+"""
+Almacén persistente de conversaciones (SQLite en modo WAL) con escritura diferida.
+
+EstadoChat guarda en memoria solo los mensajes recientes de cada sesión; el
+historial completo y el resumen quedan acá, así que un reinicio del backend no
+pierde conversaciones y la memoria por sesión está acotada.
+
+Las escrituras nunca bloquean la respuesta: se encolan y un hilo dedicado las
+aplica en lotes, una transacción por lote con todo lo que se acumuló mientras
+escribía el anterior. Las lecturas (cargar una sesión, ver mensajes anteriores)
+usan otra conexión; gracias a WAL no esperan a las escrituras. Si al leer hay
+escrituras pendientes, primero se espera a que se apliquen para no devolver un
+historial incompleto.
+
+El almacén del worker (`obtener_almacen()`) se abre en el primer uso, no al
+importar: compilar la app o importarla desde una herramienta no crea la base
+ni arranca el hilo escritor.
+"""
+import os
+import queue
+import atexit
+import sqlite3
+import threading
+from typing import Optional
+from . import metricas
+from .config import CONVERSACIONES_DB, logger
+
+_ESQUEMA = (
+    "CREATE TABLE IF NOT EXISTS mensajes ("
+    "conversacion TEXT NOT NULL, indice INTEGER NOT NULL, role TEXT NOT NULL, "
+    "content TEXT NOT NULL, PRIMARY KEY (conversacion, indice))",
+    "CREATE TABLE IF NOT EXISTS resumenes ("
+    "conversacion TEXT PRIMARY KEY, resumen TEXT NOT NULL, resumen_hasta INTEGER NOT NULL)",
+)
+
+
+class AlmacenConversaciones:
+    """Historial de mensajes y resumen de cada conversación, con escritura en segundo plano."""
+
+    def __init__(self, ruta: str, lote_max: int = 500):
+        self.ruta = ruta
+        self.lote_max = lote_max
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = self._conectar()
+        for sentencia in _ESQUEMA:
+            self._db.execute(sentencia)
+
+        self._cola: queue.Queue = queue.Queue()
+        self._hilo = threading.Thread(target=self._escritor, name="persistencia", daemon=True)
+        self._hilo.start()
+        # Lo encolado se escribe antes de que termine el proceso
+        atexit.register(self.cerrar)
+
+        # Contadores (ver estadisticas())
+        self.escrituras = 0
+        self.lotes = 0
+        self.errores = 0
+        logger.info(f"Conversaciones persistentes en: {ruta}")
+
+    def _conectar(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- Escrituras (no bloquean) ---
+
+    def guardar_mensaje(self, conversacion: str, indice: int, role: str, content: str):
+        self._cola.put((
+            "INSERT OR REPLACE INTO mensajes (conversacion, indice, role, content) VALUES (?, ?, ?, ?)",
+            (conversacion, indice, role, content),
+        ))
+
+    def guardar_resumen(self, conversacion: str, resumen: str, resumen_hasta: int):
+        self._cola.put((
+            "INSERT OR REPLACE INTO resumenes (conversacion, resumen, resumen_hasta) VALUES (?, ?, ?)",
+            (conversacion, resumen, resumen_hasta),
+        ))
+
+    def borrar(self, conversacion: str):
+        self._cola.put(("DELETE FROM mensajes WHERE conversacion = ?", (conversacion,)))
+        self._cola.put(("DELETE FROM resumenes WHERE conversacion = ?", (conversacion,)))
+
+    def _escritor(self):
+        db = self._conectar()
+        while True:
+            lote = [self._cola.get()]
+            while len(lote) < self.lote_max:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+
+            sentencias = [op for op in lote if isinstance(op, tuple)]
+            if sentencias:
+                try:
+                    db.execute("BEGIN")
+                    for sql, parametros in sentencias:
+                        db.execute(sql, parametros)
+                    db.execute("COMMIT")
+                    self.escrituras += len(sentencias)
+                    self.lotes += 1
+                except sqlite3.Error as e:
+                    logger.error(f"Error escribiendo conversaciones ({len(sentencias)} operaciones): {e}")
+                    self.errores += len(sentencias)
+                    if db.in_transaction:
+                        db.execute("ROLLBACK")
+
+            # Marcas de sincronización (vaciar()) y de cierre
+            terminar = False
+            for op in lote:
+                if isinstance(op, threading.Event):
+                    op.set()
+                elif op is None:
+                    terminar = True
+            if terminar:
+                db.close()
+                return
+
+    def vaciar(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se apliquen las escrituras encoladas hasta ahora."""
+        if not self._hilo.is_alive():
+            return False
+        marca = threading.Event()
+        self._cola.put(marca)
+        return marca.wait(timeout)
+
+    def cerrar(self):
+        if self._hilo.is_alive():
+            self._cola.put(None)
+            self._hilo.join(timeout=10)
+
+    # --- Lecturas ---
+
+    def _esperar_pendientes(self):
+        if not self._cola.empty():
+            self.vaciar(timeout=5)
+
+    def total(self, conversacion: str) -> int:
+        """Cantidad de mensajes guardados (los índices van de 0 a total - 1)."""
+        self._esperar_pendientes()
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT COALESCE(MAX(indice) + 1, 0) FROM mensajes WHERE conversacion = ?", (conversacion,)
+            ).fetchone()
+        return fila[0]
+
+    def resumen(self, conversacion: str) -> tuple[str, int]:
+        """(resumen, resumen_hasta) guardados, o ("", 0)."""
+        self._esperar_pendientes()
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT resumen, resumen_hasta FROM resumenes WHERE conversacion = ?", (conversacion,)
+            ).fetchone()
+        return (fila[0], fila[1]) if fila else ("", 0)
+
+    def cargar(self, conversacion: str, desde: int, hasta: int) -> list[dict]:
+        """Mensajes con índice en [desde, hasta), en orden."""
+        self._esperar_pendientes()
+        with self._lock:
+            filas = self._db.execute(
+                "SELECT role, content FROM mensajes WHERE conversacion = ? AND indice >= ? AND indice < ? "
+                "ORDER BY indice",
+                (conversacion, desde, hasta),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in filas]
+
+    def estadisticas(self) -> dict:
+        return {
+            "escrituras": self.escrituras,
+            "lotes": self.lotes,
+            "errores": self.errores,
+            "pendientes": self._cola.qsize(),
+        }
+
+
+_almacen: Optional[AlmacenConversaciones] = None
+_abierto = False
+_lock = threading.Lock()
+
+
+def obtener_almacen() -> Optional[AlmacenConversaciones]:
+    """
+    Almacén compartido por todas las sesiones del worker (se abre en el primer uso).
+    None sin persistencia (CONVERSACIONES_DB vacío) o si no se pudo abrir.
+    """
+    global _almacen, _abierto
+    if not _abierto:
+        with _lock:
+            if not _abierto:
+                if CONVERSACIONES_DB:
+                    try:
+                        _almacen = AlmacenConversaciones(CONVERSACIONES_DB)
+                        metricas.registrar_estadisticas("conversaciones", _almacen.estadisticas)
+                    except (sqlite3.Error, OSError) as e:
+                        logger.error(f"No se pudo abrir el almacén de conversaciones ({CONVERSACIONES_DB}): {e}")
+                _abierto = True
+    return _almacen
@@ -34,3 +34,15 @@ Explica de forma pedagógica el significado de palabras, modismos o reglas grama
    - Ubicación: [Página / Fragmento]
 
 """
+
+# Prompt para el resumen incremental de los turnos que salen de la ventana del historial
+# (ver historial.py). Recibe el resumen previo y los mensajes nuevos a incorporar.
+PROMPT_RESUMEN = """
+Eres el asistente de una clase de Lengua Guaraní. Actualiza el resumen de la conversación
+entre el estudiante y el asistente incorporando los mensajes nuevos.
+
+- Conserva los términos en guaraní consultados, sus traducciones y las reglas explicadas.
+- Conserva las dudas pendientes y las preferencias del estudiante (nivel, formato, idioma).
+- Omite saludos y repeticiones. Escribe en español, en prosa breve o viñetas.
+- No superes las {max_palabras} palabras.
+"""
@@ -1,14 +1,218 @@
 import os
+import time
+import asyncio
 import pickle
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
 import numpy as np
 import faiss
-from openai import OpenAI
-from .config import logger, OPENAI_API_KEY
+from .config import (
+    logger,
+    OPENAI_API_KEY,
+    VECTOR_STORE_DIR,
+    EMB_CACHE_MAX,
+    EMB_CACHE_TTL_SEG,
+    EMB_CACHE_DISCO,
+    EMB_CACHE_TTL_DISCO_SEG,
+    RAG_NPROBE,
+    RAG_EF_BUSQUEDA,
+    RAG_MODO,
+    RAG_LEXICO_RAPIDO,
+    RAG_LEXICO_MAX_TERMINOS,
+    RAG_LEXICO_SCORE_MIN,
+    RAG_RRF_K,
+    AGRUPAR_LLAMADAS,
+    RAG_MICROLOTES,
+    RAG_LOTE_VENTANA_MS,
+    RAG_LOTE_MAX,
+    RAG_RECARGA_SEG,
+    PLAZO_RAG_SEG,
+    PLAZO_EMBEDDING_SEG,
+    EMBEDDING_RESPALDO,
+)
+from .clientes import obtener_cliente, obtener_cliente_async
+from .chunk_store import ChunkStore
+from .indice import (
+    nuevos_parametros, cargar_parametros, aplicar_parametros_busqueda, preparar_vectores, a_similitud,
+)
+from .versiones import directorio_actual, version_actual
+from .lexico import IndiceLexico, terminos_consulta
+from .vuelo_unico import VueloUnico
+from .microlotes import MicroLoteador
+from .resiliencia import Respaldo, llamar, llamar_sync
+from . import admision
+from . import metricas
 
 # Configuración
-VECTOR_STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_store")
-INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "index.faiss")
-METADATA_PATH = os.path.join(VECTOR_STORE_DIR, "index.pkl")
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Archivos de cada versión del vector store (ver versiones.py)
+INDEX_ARCHIVO = "index.faiss"
+METADATA_ARCHIVO = "index.pkl"
+CHUNKS_ARCHIVO = "chunks.bin"
+PARAMS_ARCHIVO = "index_params.json"
+LEXICO_ARCHIVO = "lexico"
+
+class CacheEmbeddings:
+    """
+    Caché de embeddings de consultas en dos niveles:
+    1. LRU en memoria del proceso, con límite de tamaño y TTL.
+    2. SQLite opcional en disco (modo WAL), que sobrevive reinicios y se
+       comparte entre los workers del backend.
+
+    La clave es el hash del texto normalizado más el nombre del modelo.
+    """
+    def __init__(self, max_items: int = EMB_CACHE_MAX, ttl_seg: float = EMB_CACHE_TTL_SEG,
+                 ruta_disco: str = EMB_CACHE_DISCO, ttl_disco_seg: float = EMB_CACHE_TTL_DISCO_SEG):
+        self.max_items = max_items
+        self.ttl_seg = ttl_seg
+        self.ttl_disco_seg = ttl_disco_seg
+        self._memoria: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        # Contadores (ver estadisticas())
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+        self.segundos_misses = 0.0
+        self.tokens_misses = 0
+
+        if ruta_disco:
+            try:
+                self._db = sqlite3.connect(ruta_disco, timeout=5, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "clave TEXT PRIMARY KEY, vector BLOB NOT NULL, creado REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM embeddings WHERE creado < ?", (time.time() - ttl_disco_seg,))
+                logger.info(f"Caché de embeddings en disco: {ruta_disco}")
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo abrir la caché de embeddings en disco ({ruta_disco}): {e}")
+                self._db = None
+
+    @staticmethod
+    def normalizar(texto: str) -> str:
+        """Normaliza la consulta: Unicode NFC, minúsculas y espacios colapsados."""
+        return " ".join(unicodedata.normalize("NFC", texto).lower().split())
+
+    @classmethod
+    def clave(cls, texto: str, modelo: str) -> str:
+        return hashlib.sha256(f"{modelo}\x00{cls.normalizar(texto)}".encode("utf-8")).hexdigest()
+
+    def obtener(self, texto: str, modelo: str) -> Optional[np.ndarray]:
+        clave = self.clave(texto, modelo)
+        ahora = time.time()
+
+        with self._lock:
+            item = self._memoria.get(clave)
+            if item is not None:
+                creado, vector = item
+                if ahora - creado <= self.ttl_seg:
+                    self._memoria.move_to_end(clave)
+                    self.hits_memoria += 1
+                    return vector
+                del self._memoria[clave]
+
+            if self._db is not None:
+                try:
+                    fila = self._db.execute(
+                        "SELECT vector, creado FROM embeddings WHERE clave = ?", (clave,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Error leyendo caché de embeddings en disco: {e}")
+                    fila = None
+                if fila is not None and ahora - fila[1] <= self.ttl_disco_seg:
+                    vector = np.frombuffer(fila[0], dtype=np.float32)
+                    self._guardar_memoria(clave, vector, ahora)
+                    self.hits_disco += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def guardar(self, texto: str, modelo: str, vector, segundos: float = 0.0, tokens: int = 0):
+        """Guarda el embedding calculado; `segundos` y `tokens` alimentan las estadísticas de ahorro."""
+        clave = self.clave(texto, modelo)
+        vector = np.asarray(vector, dtype=np.float32)
+        ahora = time.time()
+        with self._lock:
+            self.segundos_misses += segundos
+            self.tokens_misses += tokens
+            self._guardar_memoria(clave, vector, ahora)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO embeddings (clave, vector, creado) VALUES (?, ?, ?)",
+                        (clave, vector.tobytes(), ahora),
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Error escribiendo caché de embeddings en disco: {e}")
+
+    def _guardar_memoria(self, clave: str, vector: np.ndarray, creado: float):
+        self._memoria[clave] = (creado, vector)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_items:
+            self._memoria.popitem(last=False)
+
+    def estadisticas(self) -> dict:
+        """Contadores de aciertos/fallos y estimación de latencia y tokens ahorrados."""
+        with self._lock:
+            hits = self.hits_memoria + self.hits_disco
+            total = hits + self.misses
+            calculados = max(self.misses, 1)
+            return {
+                "hits_memoria": self.hits_memoria,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+                "tasa_aciertos": hits / total if total else 0.0,
+                "items_memoria": len(self._memoria),
+                "segundos_ahorrados": hits * self.segundos_misses / calculados,
+                "tokens_ahorrados": int(hits * self.tokens_misses / calculados),
+            }
+
+
+@dataclass
+class Recuperacion:
+    """Resultado de una consulta al vector store."""
+    embedding: Optional[np.ndarray] = None
+    hits: list[dict] = field(default_factory=list)
+    version: str = ""
+    # "denso", "hibrido" o "lexico" (atajo sin embedding)
+    modo: str = "denso"
+
+    @property
+    def ids(self) -> list[int]:
+        return [h["id"] for h in self.hits]
+
+    @property
+    def contexto(self) -> str:
+        # Formatear el contexto
+        return "\n---\n".join(h["text"] for h in self.hits)
+
+
+@dataclass
+class RecursosRAG:
+    """
+    Índice, chunks y parámetros de una versión del vector store. No se modifica
+    una vez cargado: cada consulta toma la referencia vigente al empezar y la usa
+    hasta el final, así que un cambio de versión nunca mezcla ids de un índice con
+    los textos de otro. La versión anterior se libera cuando termina la última
+    consulta que la usaba.
+    """
+    index: Optional[faiss.Index] = None
+    metadatas: object = field(default_factory=list)
+    params_indice: dict = field(default_factory=lambda: nuevos_parametros("flat-l2"))
+    lexico: Optional[IndiceLexico] = None
+    # Identifica la versión cargada del vector store (invalida el caché semántico)
+    version: str = ""
+
 
 class RAGClient:
     """
@@ -20,61 +224,397 @@ class RAGClient:
             logger.warning("OPENAI_API_KEY no encontrada. RAG no funcionará correctamente.")
         
         # Cargar índice y metadatos al inicio (lectura rápida)
-        # FAISS y Pickle en modo lectura son seguros con hilos normalmente,
+        # FAISS y el ChunkStore (mmap) en modo lectura son seguros con hilos,
         # pero para máxima seguridad con reflex, cargamos solo si existen.
-        self.index = None
-        self.metadatas = []
+        self.recursos = RecursosRAG()
+        # Contenido del puntero ACTUAL correspondiente a self.recursos ("" = sin versionar)
+        self._version_disco = ""
+        self._lock_carga = threading.Lock()
+        self.recargas = 0
+        self.cache_embeddings = CacheEmbeddings()
+        # Consultas idénticas simultáneas comparten la llamada de embedding (ver vuelo_unico.py)
+        self.vuelos_embedding = VueloUnico("embeddings")
+        metricas.registrar_estadisticas("chatbot_cache_embeddings", self.cache_embeddings.estadisticas)
+        metricas.registrar_estadisticas("chatbot_agrupadas_embeddings", self.vuelos_embedding.estadisticas)
+        # Pedido duplicado si el embedding tarda más que el percentil de los recientes (ver resiliencia.py).
+        # Los micro-lotes tienen su propio historial: tardan más y subirían el umbral de las consultas sueltas.
+        self.respaldo_embedding = Respaldo("embedding") if EMBEDDING_RESPALDO else None
+        self.respaldo_embedding_lote = Respaldo("embedding_lote") if EMBEDDING_RESPALDO else None
+        if EMBEDDING_RESPALDO:
+            metricas.registrar_estadisticas("chatbot_respaldo_embedding", self.respaldo_embedding.estadisticas)
+            metricas.registrar_estadisticas("chatbot_respaldo_embedding_lote", self.respaldo_embedding_lote.estadisticas)
+
+        # Micro-lotes opcionales de embeddings y búsquedas entre sesiones (ver microlotes.py)
+        self.lotes_embedding = None
+        self.lotes_busqueda = None
+        if RAG_MICROLOTES:
+            self.lotes_embedding = MicroLoteador("embeddings", self._apedir_embeddings_lote,
+                                                 RAG_LOTE_VENTANA_MS, RAG_LOTE_MAX)
+            self.lotes_busqueda = MicroLoteador("busquedas", self._abuscar_lote,
+                                                RAG_LOTE_VENTANA_MS, RAG_LOTE_MAX)
+            metricas.registrar_estadisticas("chatbot_microlotes_embeddings", self.lotes_embedding.estadisticas)
+            metricas.registrar_estadisticas("chatbot_microlotes_busquedas", self.lotes_busqueda.estadisticas)
         
+        metricas.registrar_estadisticas("chatbot_vector_store", lambda: {
+            "vectores": self.recursos.index.ntotal if self.recursos.index is not None else 0,
+            "recargas": self.recargas,
+        })
+
         self.load_resources()
 
-    def load_resources(self):
-        try:
-            if os.path.exists(INDEX_PATH) and os.path.exists(METADATA_PATH):
-                self.index = faiss.read_index(INDEX_PATH)
-                with open(METADATA_PATH, "rb") as f:
-                    self.metadatas = pickle.load(f)
-                logger.info(f"FAISS RAGClient cargado. {self.index.ntotal} vectores.")
-            else:
+        # Recarga en caliente: ingest.py publica versiones nuevas cambiando el puntero ACTUAL
+        if RAG_RECARGA_SEG > 0:
+            self._detener = threading.Event()
+            threading.Thread(target=self._vigilar_versiones, name="rag-recarga", daemon=True).start()
+
+    # Acceso directo a los recursos vigentes (compatibilidad)
+    @property
+    def index(self):
+        return self.recursos.index
+
+    @property
+    def metadatas(self):
+        return self.recursos.metadatas
+
+    @property
+    def params_indice(self) -> dict:
+        return self.recursos.params_indice
+
+    @property
+    def lexico(self):
+        return self.recursos.lexico
+
+    @property
+    def version(self) -> str:
+        return self.recursos.version
+
+    def load_resources(self) -> bool:
+        """
+        Carga la versión publicada del vector store y la pone en uso con un solo
+        cambio de referencia; las consultas en curso terminan con la anterior.
+        Devuelve True si se cargó una versión.
+        """
+        with self._lock_carga:
+            version, directorio = directorio_actual(VECTOR_STORE_DIR)
+            try:
+                recursos = self._cargar_recursos(directorio, version)
+            except Exception as e:
+                logger.error(f"Error cargando recursos FAISS ({directorio}): {e}")
+                # No se reintenta la misma versión en cada sondeo
+                self._version_disco = version
+                return False
+            self._version_disco = version
+            if recursos is None:
                 logger.warning("No se encontraron archivos de índice FAISS. Ejecute 'ingest.py'.")
-        except Exception as e:
-            logger.error(f"Error cargando recursos FAISS: {e}")
+                return False
+            recargada = self.recursos.index is not None
+            self.recursos = recursos
+            if recargada:
+                self.recargas += 1
+            logger.info(
+                f"FAISS RAGClient {'recargado' if recargada else 'cargado'}. {recursos.index.ntotal} vectores "
+                f"(índice {recursos.params_indice['tipo']}, versión {recursos.version})."
+            )
+            return True
+
+    def _cargar_recursos(self, directorio: str, version: str) -> Optional[RecursosRAG]:
+        index_path = os.path.join(directorio, INDEX_ARCHIVO)
+        chunks_path = os.path.join(directorio, CHUNKS_ARCHIVO)
+        metadata_path = os.path.join(directorio, METADATA_ARCHIVO)
+        if not (os.path.exists(index_path) and (os.path.exists(chunks_path) or os.path.exists(metadata_path))):
+            return None
+
+        index = faiss.read_index(index_path)
+        # Tipo de índice, métrica y parámetros de búsqueda (nprobe/efSearch) guardados por ingest.py
+        params_indice = cargar_parametros(os.path.join(directorio, PARAMS_ARCHIVO))
+        if RAG_NPROBE:
+            params_indice["nprobe"] = RAG_NPROBE
+        if RAG_EF_BUSQUEDA:
+            params_indice["ef_busqueda"] = RAG_EF_BUSQUEDA
+        aplicar_parametros_busqueda(index, params_indice)
+        if os.path.exists(chunks_path):
+            # Almacén mapeado en memoria: apertura instantánea y páginas compartidas entre workers
+            metadatas = ChunkStore(chunks_path)
+        else:
+            # Formato anterior (migración): se deserializa completo
+            logger.warning("Usando index.pkl (formato anterior). Ejecute 'ingest.py' para generar chunks.bin.")
+            with open(metadata_path, "rb") as f:
+                metadatas = pickle.load(f)
+        # Índice léxico BM25 (opcional: sin él se usa solo la búsqueda densa)
+        lexico = IndiceLexico.cargar(os.path.join(directorio, LEXICO_ARCHIVO))
+        if lexico is None and RAG_MODO != "denso":
+            logger.warning("No se encontró el índice léxico. Ejecute 'ingest.py' para la búsqueda híbrida.")
+        return RecursosRAG(
+            index=index,
+            metadatas=metadatas,
+            params_indice=params_indice,
+            lexico=lexico,
+            version=version or f"{os.path.getmtime(index_path):.0f}-{index.ntotal}",
+        )
+
+    def recargar_si_cambio(self) -> bool:
+        """Carga la versión publicada si es distinta de la que está en uso."""
+        if version_actual(VECTOR_STORE_DIR) == self._version_disco:
+            return False
+        return self.load_resources()
+
+    def _vigilar_versiones(self):
+        # Hilo propio: leer un índice grande no bloquea el event loop ni las consultas
+        while not self._detener.wait(RAG_RECARGA_SEG):
+            try:
+                self.recargar_si_cambio()
+            except Exception as e:
+                logger.error(f"Error verificando la versión del vector store: {e}")
 
     def query_knowledge_base(self, query: str, n_results: int = 3) -> str:
         """
         Busca contexto relevante para la query.
         """
-        if not self.api_key or not self.index:
-            return ""
-            
+        return self.recuperar(query, n_results).contexto
+
+    def recuperar(self, query: str, n_results: int = 3) -> "Recuperacion":
+        """
+        Igual que `query_knowledge_base` pero devuelve el embedding de la query y
+        los fragmentos encontrados (con sus ids) en lugar del texto formateado.
+        """
+        recursos = self.recursos
+        if not self.api_key or not recursos.index:
+            return Recuperacion()
+
+        try:
+            lexicos = self._buscar_lexico(recursos, query, n_results)
+            if self._solo_lexico(query, lexicos):
+                return self._recuperacion_lexica(recursos, lexicos, n_results)
+            # 1. Generar embedding de la query (caché o cliente compartido)
+            return self._buscar(recursos, self._embedding(query), n_results, lexicos)
+        except Exception as e:
+            logger.error(f"Error consultando FAISS: {e}")
+            return Recuperacion()
+
+    async def arecuperar(self, query: str, n_results: int = 3) -> "Recuperacion":
+        """Versión asíncrona de `recuperar`."""
+        recursos = self.recursos
+        if not self.api_key or not recursos.index:
+            return Recuperacion()
+
         try:
-            # 1. Generar embedding de la query
-            client = OpenAI(api_key=self.api_key)
-            resp = client.embeddings.create(input=[query], model="text-embedding-3-small")
-            query_embedding = resp.data[0].embedding
-            
-            # 2. Buscar en FAISS
-            query_vector = np.array([query_embedding]).astype('float32')
-            distances, indices = self.index.search(query_vector, k=n_results)
-            
-            # 3. Recuperar textos
-            found_docs = []
-            for idx in indices[0]:
-                if idx != -1 and idx < len(self.metadatas):
-                    doc_data = self.metadatas[idx]
-                    found_docs.append(doc_data["text"])
-            
-            if not found_docs:
-                return ""
-            
-            # Formatear el contexto
-            context_str = "\n---\n".join(found_docs)
-            return context_str
-            
+            lexicos = self._buscar_lexico(recursos, query, n_results)
+            if self._solo_lexico(query, lexicos):
+                return self._recuperacion_lexica(recursos, lexicos, n_results)
+            query_embedding = await self._aembedding(query)
+            if self.lotes_busqueda is None:
+                return self._buscar(recursos, query_embedding, n_results, lexicos)
+            query_vector = preparar_vectores(query_embedding, recursos.params_indice)
+            distances, indices = await self.lotes_busqueda.enviar(
+                (recursos, query_vector, self._k_busqueda(n_results, lexicos))
+            )
+            return self._combinar(recursos, query_embedding, distances, indices, n_results, lexicos)
         except Exception as e:
             logger.error(f"Error consultando FAISS: {e}")
-            import traceback
-            # logger.error(traceback.format_exc())
-            return ""
+            return Recuperacion()
+
+    def _buscar_lexico(self, recursos: RecursosRAG, query: str, n_results: int) -> Optional[list]:
+        """Candidatos BM25 (id, score, términos cubiertos), o None si no aplica."""
+        if RAG_MODO == "denso" or recursos.lexico is None:
+            return None
+        with metricas.medir("busqueda_lexica"):
+            return recursos.lexico.buscar(terminos_consulta(query), k=2 * n_results)
+
+    def _solo_lexico(self, query: str, lexicos: Optional[list]) -> bool:
+        """
+        Decide si alcanza con la búsqueda léxica: siempre en modo "lexico", o en el
+        atajo para búsquedas de un término con coincidencia léxica fuerte.
+        """
+        if lexicos is None:
+            return False
+        if RAG_MODO == "lexico":
+            return True
+        if not RAG_LEXICO_RAPIDO or not lexicos:
+            return False
+        terminos = set(terminos_consulta(query))
+        _, score, cubiertos = lexicos[0]
+        return (0 < len(terminos) <= RAG_LEXICO_MAX_TERMINOS
+                and cubiertos == len(terminos)
+                and score >= RAG_LEXICO_SCORE_MIN)
+
+    def _recuperacion_lexica(self, recursos: RecursosRAG, lexicos: list, n_results: int) -> "Recuperacion":
+        hits = [self._hit(recursos, idx, score_lexico=score) for idx, score, _ in lexicos[:n_results]]
+        return Recuperacion(hits=[h for h in hits if h is not None], version=recursos.version, modo="lexico")
+
+    def _embedding(self, query: str) -> np.ndarray:
+        """
+        Embedding de la query, consultando primero la caché. Las consultas idénticas
+        simultáneas comparten una sola llamada a la API.
+        """
+        with metricas.medir("embedding"):
+            vector = self.cache_embeddings.obtener(query, EMBEDDING_MODEL)
+            if vector is None:
+                if AGRUPAR_LLAMADAS:
+                    clave = CacheEmbeddings.clave(query, EMBEDDING_MODEL)
+                    vector = self.vuelos_embedding.ejecutar_sync(clave, lambda: self._pedir_embedding(query))
+                else:
+                    vector = self._pedir_embedding(query)
+        return vector
+
+    async def _aembedding(self, query: str) -> np.ndarray:
+        """Versión asíncrona de `_embedding`."""
+        with metricas.medir("embedding"):
+            vector = self.cache_embeddings.obtener(query, EMBEDDING_MODEL)
+            if vector is None:
+                if AGRUPAR_LLAMADAS:
+                    clave = CacheEmbeddings.clave(query, EMBEDDING_MODEL)
+                    vector = await self.vuelos_embedding.ejecutar(clave, lambda: self._apedir_embedding(query))
+                else:
+                    vector = await self._apedir_embedding(query)
+        return vector
+
+    def _pedir_embedding(self, query: str) -> np.ndarray:
+        # Camino síncrono (en hilos): mismo límite que las llamadas asíncronas, sin respaldo
+        with admision.embeddings.ocupar_hilo():
+            inicio = time.perf_counter()
+            resp = llamar_sync(
+                lambda plazo: obtener_cliente().embeddings.create(input=[query], model=EMBEDDING_MODEL, timeout=plazo),
+                "embedding", PLAZO_EMBEDDING_SEG, PLAZO_RAG_SEG,
+            )
+        vector = np.array(resp.data[0].embedding, dtype=np.float32)
+        self.cache_embeddings.guardar(query, EMBEDDING_MODEL, vector, time.perf_counter() - inicio,
+                                      resp.usage.total_tokens if resp.usage else 0)
+        metricas.sumar_tokens(resp.usage, prefijo="embedding_")
+        return vector
+
+    async def _apedir_embedding(self, query: str) -> np.ndarray:
+        if self.lotes_embedding is not None:
+            return await self.lotes_embedding.enviar(query)
+        # Llamadas de embedding simultáneas acotadas (ver admision.py)
+        async with admision.embeddings.ocupar():
+            inicio = time.perf_counter()
+            resp = await llamar(
+                lambda plazo: obtener_cliente_async().embeddings.create(input=[query], model=EMBEDDING_MODEL, timeout=plazo),
+                "embedding", PLAZO_EMBEDDING_SEG, PLAZO_RAG_SEG, respaldo=self.respaldo_embedding,
+            )
+        vector = np.array(resp.data[0].embedding, dtype=np.float32)
+        self.cache_embeddings.guardar(query, EMBEDDING_MODEL, vector, time.perf_counter() - inicio,
+                                      resp.usage.total_tokens if resp.usage else 0)
+        metricas.sumar_tokens(resp.usage, prefijo="embedding_")
+        return vector
+
+    async def _apedir_embeddings_lote(self, queries: list[str]) -> list[np.ndarray]:
+        """Un solo embeddings.create para todas las consultas del micro-lote."""
+        unicas = list(dict.fromkeys(queries))
+        async with admision.embeddings.ocupar():
+            inicio = time.perf_counter()
+            resp = await llamar(
+                lambda plazo: obtener_cliente_async().embeddings.create(input=unicas, model=EMBEDDING_MODEL, timeout=plazo),
+                "embedding", PLAZO_EMBEDDING_SEG, PLAZO_RAG_SEG, respaldo=self.respaldo_embedding_lote,
+            )
+        metricas.sumar_tokens(resp.usage, prefijo="embedding_")
+        segundos = (time.perf_counter() - inicio) / len(unicas)
+        tokens = (resp.usage.total_tokens if resp.usage else 0) // len(unicas)
+        vectores = {}
+        for dato in resp.data:
+            query = unicas[dato.index]
+            vectores[query] = np.array(dato.embedding, dtype=np.float32)
+            self.cache_embeddings.guardar(query, EMBEDDING_MODEL, vectores[query], segundos, tokens)
+        return [vectores[q] for q in queries]
+
+    async def _abuscar_lote(self, consultas: list[tuple[RecursosRAG, np.ndarray, int]]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Un solo index.search sobre los vectores apilados del micro-lote (en un hilo:
+        FAISS libera el GIL). Durante un cambio de versión el lote puede traer
+        consultas de las dos: se hace una búsqueda por versión.
+        """
+        grupos: dict[int, tuple[RecursosRAG, list[int]]] = {}
+        for i, (recursos, _, _) in enumerate(consultas):
+            grupos.setdefault(id(recursos), (recursos, []))[1].append(i)
+
+        resultados = [None] * len(consultas)
+        for recursos, posiciones in grupos.values():
+            matriz = np.vstack([consultas[i][1] for i in posiciones])
+            k = max(consultas[i][2] for i in posiciones)
+            with metricas.medir("busqueda_faiss"):
+                distances, indices = await asyncio.to_thread(recursos.index.search, matriz, k)
+            for fila, i in enumerate(posiciones):
+                kq = consultas[i][2]
+                resultados[i] = (distances[fila:fila + 1, :kq], indices[fila:fila + 1, :kq])
+        return resultados
+
+    @staticmethod
+    def _metadato(recursos: RecursosRAG, idx: int) -> Optional[dict]:
+        """
+        Metadatos de un vector: ChunkStore o dict {id: metadato} (se acceden por id),
+        o la lista posicional del `index.pkl` original.
+        """
+        if idx == -1:
+            return None
+        if isinstance(recursos.metadatas, list):
+            return recursos.metadatas[idx] if idx < len(recursos.metadatas) else None
+        return recursos.metadatas.get(idx)
+
+    def _hit(self, recursos: RecursosRAG, idx: int, distancia=None, similitud=None, score_lexico=None) -> Optional[dict]:
+        doc_data = self._metadato(recursos, int(idx))
+        if doc_data is None:
+            return None
+        return {
+            "id": int(idx),
+            "distancia": distancia,
+            "similitud": similitud,
+            "score_lexico": score_lexico,
+            "text": doc_data["text"],
+            "source": doc_data.get("source"),
+            "chunk_index": doc_data.get("chunk_index"),
+            "pagina_inicio": doc_data.get("pagina_inicio", -1),
+            "pagina_fin": doc_data.get("pagina_fin", -1),
+        }
+
+    def _buscar(self, recursos: RecursosRAG, query_embedding: np.ndarray, n_results: int,
+                lexicos: Optional[list] = None) -> "Recuperacion":
+        """
+        Busca en FAISS y devuelve los fragmentos encontrados. Si hay candidatos
+        léxicos, ambos rankings se fusionan con Reciprocal Rank Fusion.
+        """
+        # 2. Buscar en FAISS (búsqueda en memoria, del orden de milisegundos)
+        query_vector = preparar_vectores(query_embedding, recursos.params_indice)
+        with metricas.medir("busqueda_faiss"):
+            distances, indices = recursos.index.search(query_vector, k=self._k_busqueda(n_results, lexicos))
+        return self._combinar(recursos, query_embedding, distances, indices, n_results, lexicos)
+
+    @staticmethod
+    def _k_busqueda(n_results: int, lexicos: Optional[list]) -> int:
+        # Con fusión híbrida se piden más candidatos densos para el ranking conjunto
+        return n_results if lexicos is None else 2 * n_results
+
+    def _combinar(self, recursos: RecursosRAG, query_embedding: np.ndarray, distances: np.ndarray,
+                  indices: np.ndarray, n_results: int, lexicos: Optional[list]) -> "Recuperacion":
+        """Arma la Recuperacion a partir del resultado de FAISS (y de la fusión con BM25)."""
+        similitudes = a_similitud(distances[0], recursos.params_indice)
+        densos = {
+            int(idx): (float(dist), float(sim))
+            for dist, sim, idx in zip(distances[0], similitudes, indices[0]) if idx != -1
+        }
+
+        if lexicos is None:
+            orden = list(densos)[:n_results]
+            scores_lexicos = {}
+            modo = "denso"
+        else:
+            scores_lexicos = {idx: score for idx, score, _ in lexicos}
+            rrf = {}
+            for ranking in (list(densos), list(scores_lexicos)):
+                for posicion, idx in enumerate(ranking):
+                    rrf[idx] = rrf.get(idx, 0.0) + 1.0 / (RAG_RRF_K + posicion + 1)
+            orden = sorted(rrf, key=rrf.get, reverse=True)[:n_results]
+            modo = "hibrido"
+
+        # 3. Recuperar textos
+        hits = []
+        for idx in orden:
+            dist, sim = densos.get(idx, (None, None))
+            hit = self._hit(recursos, idx, distancia=dist, similitud=sim, score_lexico=scores_lexicos.get(idx))
+            if hit is not None:
+                hits.append(hit)
+
+        return Recuperacion(embedding=np.asarray(query_embedding, dtype=np.float32), hits=hits,
+                            version=recursos.version, modo=modo)
 
 # Instancia global
 rag_client = RAGClient()
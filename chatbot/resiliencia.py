@@ -0,0 +1,232 @@
+"""
+Control de la latencia de cola en las llamadas a OpenAI (compartido por RAGClient y LLMClient).
+
+- Plazos: cada intento tiene un tiempo máximo y la etapa completa un plazo total.
+  Al vencer se corta la llamada (asyncio.wait_for) en lugar de esperar lo que
+  tarde la API.
+- Reintentos con backoff exponencial y jitter completo, solo para errores
+  transitorios (429, 5xx, timeouts y errores de conexión) y mientras quede plazo.
+  Los clientes compartidos (clientes.py) se crean con max_retries=0: los
+  reintentos se hacen acá, dentro del plazo de la etapa.
+- Pedidos de respaldo ("hedging"): si una llamada tarda más que el percentil
+  RESPALDO_PERCENTIL de las latencias recientes, se envía un duplicado y se usa
+  la primera respuesta. Solo para el embedding de la consulta, que es barato e
+  idempotente; las completions nunca se duplican.
+
+Uso:
+    respuesta = await llamar(
+        lambda plazo: cliente.embeddings.create(..., timeout=plazo),
+        "embedding", PLAZO_EMBEDDING_SEG, PLAZO_RAG_SEG, respaldo=respaldo,
+    )
+"""
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+from . import metricas
+from .config import (
+    REINTENTOS_MAX,
+    REINTENTO_BASE_SEG,
+    REINTENTO_MAX_SEG,
+    RESPALDO_PERCENTIL,
+    RESPALDO_MIN_MS,
+    logger,
+)
+
+T = TypeVar("T")
+
+# Contadores por evento y etapa (reintentos_embedding, plazo_vencido_rag, ...)
+_lock = threading.Lock()
+_eventos: dict[str, int] = {}
+
+
+def contar(evento: str, etapa: str):
+    clave = f"{evento}_{etapa}"
+    with _lock:
+        _eventos[clave] = _eventos.get(clave, 0) + 1
+
+
+def estadisticas() -> dict:
+    with _lock:
+        return dict(_eventos)
+
+
+metricas.registrar_estadisticas("chatbot_resiliencia", estadisticas)
+
+
+# Plazo vencido: TimeoutError de llamar_sync o asyncio.TimeoutError de wait_for (la misma clase desde 3.11)
+_PLAZO_VENCIDO = (TimeoutError, asyncio.TimeoutError)
+
+
+def es_plazo_vencido(error: BaseException) -> bool:
+    if isinstance(error, _PLAZO_VENCIDO):
+        return True
+    import openai
+    return isinstance(error, openai.APITimeoutError)
+
+
+def es_reintentable(error: BaseException) -> bool:
+    """Errores transitorios: vale la pena volver a intentar la misma petición."""
+    if isinstance(error, _PLAZO_VENCIDO):
+        return True
+    import openai
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APIConnectionError,  # incluye APITimeoutError
+        openai.InternalServerError,
+    ))
+
+
+def espera_reintento(intento: int) -> float:
+    """Backoff exponencial con jitter completo: uniforme en [0, min(máximo, base·2^intento)]."""
+    return random.uniform(0, min(REINTENTO_MAX_SEG, REINTENTO_BASE_SEG * 2 ** intento))
+
+
+def _siguiente_plazo(plazo_intento: float, limite: Optional[float]) -> float:
+    if limite is None:
+        return plazo_intento
+    return min(plazo_intento, limite - time.monotonic())
+
+
+def _reintentar_o_lanzar(error: Exception, etapa: str, intento: int, reintentos: int,
+                         limite: Optional[float]) -> float:
+    """Segundos a esperar antes del próximo intento; relanza `error` si no corresponde reintentar."""
+    if es_plazo_vencido(error):
+        contar("plazo_vencido", etapa)
+    espera = espera_reintento(intento)
+    if (intento >= reintentos or not es_reintentable(error)
+            or (limite is not None and time.monotonic() + espera >= limite)):
+        raise error
+    contar("reintentos", etapa)
+    logger.warning(f"{etapa}: {type(error).__name__}, reintento {intento + 1}/{reintentos} en {espera:.2f}s")
+    return espera
+
+
+async def llamar(funcion: Callable[[float], Awaitable[T]], etapa: str, plazo_intento: float,
+                 plazo_total: Optional[float] = None, reintentos: int = REINTENTOS_MAX,
+                 respaldo: Optional["Respaldo"] = None) -> T:
+    """
+    Ejecuta `funcion(plazo)` con plazo por intento y reintentos. `plazo` son los
+    segundos disponibles para el intento (para pasarlo como `timeout` al SDK); además
+    el intento se corta con asyncio.wait_for. Con `respaldo`, cada intento puede
+    lanzar un pedido duplicado (ver Respaldo).
+    """
+    limite = time.monotonic() + plazo_total if plazo_total else None
+    intento = 0
+    while True:
+        plazo = _siguiente_plazo(plazo_intento, limite)
+        try:
+            if plazo <= 0:
+                raise asyncio.TimeoutError()
+            if respaldo is not None:
+                return await asyncio.wait_for(respaldo.ejecutar(lambda: funcion(plazo)), plazo)
+            return await asyncio.wait_for(funcion(plazo), plazo)
+        except Exception as e:
+            espera = _reintentar_o_lanzar(e, etapa, intento, reintentos, limite)
+        await asyncio.sleep(espera)
+        intento += 1
+
+
+def llamar_sync(funcion: Callable[[float], T], etapa: str, plazo_intento: float,
+                plazo_total: Optional[float] = None, reintentos: int = REINTENTOS_MAX) -> T:
+    """
+    Versión para hilos (cliente síncrono): el plazo del intento solo se aplica a
+    través del `timeout` del SDK y no hay pedidos de respaldo.
+    """
+    limite = time.monotonic() + plazo_total if plazo_total else None
+    intento = 0
+    while True:
+        plazo = _siguiente_plazo(plazo_intento, limite)
+        try:
+            if plazo <= 0:
+                raise TimeoutError()
+            return funcion(plazo)
+        except Exception as e:
+            espera = _reintentar_o_lanzar(e, etapa, intento, reintentos, limite)
+        time.sleep(espera)
+        intento += 1
+
+
+def _descartar(tarea: asyncio.Task):
+    # Marca como leída la excepción de un pedido perdedor (sin "exception was never retrieved")
+    if not tarea.cancelled():
+        tarea.exception()
+
+
+class Respaldo:
+    """
+    Pedidos de respaldo para una llamada idempotente: si la primera petición no
+    respondió al llegar al percentil `percentil` de las latencias recientes, se
+    lanza una segunda y gana la primera que responda bien (la otra se cancela).
+    Hasta juntar `muestras_min` latencias no se duplica nada.
+    """
+
+    def __init__(self, nombre: str, percentil: float = RESPALDO_PERCENTIL,
+                 minimo_ms: float = RESPALDO_MIN_MS, muestras: int = 200, muestras_min: int = 20):
+        self.nombre = nombre
+        self.percentil = percentil
+        self.minimo_seg = minimo_ms / 1000
+        self.muestras_min = muestras_min
+        self._latencias: deque[float] = deque(maxlen=muestras)
+        self._lock = threading.Lock()
+
+        # Contadores (ver estadisticas())
+        self.llamadas = 0
+        self.respaldos = 0
+        self.ganados = 0
+
+    def umbral(self) -> Optional[float]:
+        """Segundos de espera antes del respaldo, o None si aún no hay muestras suficientes."""
+        with self._lock:
+            latencias = sorted(self._latencias)
+        if len(latencias) < self.muestras_min:
+            return None
+        i = min(len(latencias) - 1, int(len(latencias) * self.percentil / 100))
+        return max(self.minimo_seg, latencias[i])
+
+    async def ejecutar(self, funcion: Callable[[], Awaitable[T]]) -> T:
+        umbral = self.umbral()
+        inicio = time.perf_counter()
+        primera = asyncio.ensure_future(funcion())
+        tareas = [primera]
+        with self._lock:
+            self.llamadas += 1
+        try:
+            if umbral is not None:
+                hechas, _ = await asyncio.wait(tareas, timeout=umbral)
+                if not hechas:
+                    tareas.append(asyncio.ensure_future(funcion()))
+                    with self._lock:
+                        self.respaldos += 1
+
+            pendientes = set(tareas)
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.exception() is None:
+                        # Latencia de la primera petición (acotada si ganó el respaldo)
+                        with self._lock:
+                            self._latencias.append(time.perf_counter() - inicio)
+                            if tarea is not primera:
+                                self.ganados += 1
+                        return tarea.result()
+            # Fallaron todas: se propaga el error de la primera
+            return primera.result()
+        finally:
+            for tarea in tareas:
+                if not tarea.done():
+                    tarea.cancel()
+                tarea.add_done_callback(_descartar)
+
+    def estadisticas(self) -> dict:
+        umbral = self.umbral()
+        with self._lock:
+            return {
+                "llamadas": self.llamadas,
+                "respaldos": self.respaldos,
+                "ganados": self.ganados,
+                "tasa_respaldos": self.respaldos / self.llamadas if self.llamadas else 0.0,
+                "umbral_ms": umbral * 1000 if umbral is not None else 0.0,
+            }
@@ -1,13 +1,25 @@
 import reflex as rx
 import asyncio
+import time
+import uuid
 from typing import List, Dict
 from .llm import LLMClient
+from .persistencia import obtener_almacen
 from .prompts import SYSTEM_PROMPT
-from .config import logger
+from .historial import punto_de_corte
+from . import admision
+from . import metricas
+from .config import (
+    logger, STREAM_RESPUESTAS, STREAM_INTERVALO_MS, HISTORIAL_RESUMEN, HISTORIAL_TOKENS,
+    CHAT_MENSAJES_VISIBLES, CHAT_MENSAJES_MEMORIA,
+)
+
+MENSAJE_OCUPADO = "El asistente está atendiendo muchas consultas en este momento. Por favor intentá nuevamente en unos segundos."
 
 # Instancia global del cliente LLM (Singleton simple)
 llm_client = LLMClient()
 
+
 class EstadoChat(rx.State):
     """
     Gestiona el estado de la aplicación: historial de mensajes, input del usuario y estado de carga.
@@ -15,9 +27,32 @@ class EstadoChat(rx.State):
     # El prompt del sistema (podría ser editable desde la UI en el futuro)
     system_prompt: str = SYSTEM_PROMPT
     
-    # Historial de conversación. 
+    # Mensajes recientes de la conversación (variable de backend, no se envía al navegador).
     # Formato: [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
+    # _mensajes[0] es el mensaje número _base de la conversación: con el almacén activo
+    # solo se conservan los últimos CHAT_MENSAJES_MEMORIA (y los que aún no se resumieron);
+    # el historial completo está en persistencia.py.
+    _mensajes: List[Dict[str, str]] = []
+    _base: int = 0
+
+    # Clave de la conversación en el almacén (el client_token de la pestaña del navegador)
+    _conversacion: str = ""
+    _cargada: bool = False
+
+    # Ventana visible: los últimos _visibles mensajes de la conversación. Reflex reenvía
+    # una variable completa cada vez que cambia, así que lo que viaja por el WebSocket
+    # al agregar un mensaje está acotado por la ventana y no por el largo de la sesión.
+    # "Ver mensajes anteriores" la agranda hasta el próximo mensaje, que la devuelve a
+    # CHAT_MENSAJES_VISIBLES.
     mensajes: List[Dict[str, str]] = []
+    _visibles: int = CHAT_MENSAJES_VISIBLES
+
+    # Cantidad de mensajes anteriores a la ventana (para "Ver mensajes anteriores")
+    mensajes_ocultos: int = 0
+
+    # Respuesta en curso durante el streaming: cada envío a la UI solo lleva este
+    # texto, sin tocar la lista de mensajes hasta que la respuesta termina.
+    respuesta_parcial: str = ""
     
     # Input actual del usuario
     entrada_usuario: str = ""
@@ -25,51 +60,256 @@ class EstadoChat(rx.State):
     # Indicador de "Pensando..." / Cargando
     procesando: bool = False
 
+    # True mientras se reciben tokens de la respuesta (oculta el "Pensando...")
+    transmitiendo: bool = False
+
+    # Posición en la cola de admisión mientras el turno espera lugar (0 = no está en cola)
+    posicion_cola: int = 0
+    # Aviso para el usuario cuando el turno no se pudo atender (servidor ocupado)
+    aviso: str = ""
+
+    # Resumen de los mensajes [0, _resumen_hasta) de la conversación, que ya no se envían
+    # completos al modelo (ver historial.py). Son variables de backend: no se envían al navegador.
+    _resumen: str = ""
+    _resumen_hasta: int = 0
+    # Se incrementa al limpiar el chat, para descartar resúmenes de la conversación anterior
+    _id_conversacion: int = 0
+
+    def _agregar_mensaje(self, role: str, content: str):
+        """Agrega un mensaje al historial, a la ventana visible y (en segundo plano) al almacén."""
+        mensaje = {"role": role, "content": content}
+        indice = self._base + len(self._mensajes)
+        self._mensajes.append(mensaje)
+        # Los mensajes anteriores que se hayan cargado dejan de mostrarse: si la ventana
+        # siguiera agrandada, cada mensaje nuevo reenviaría la lista completa
+        self._visibles = CHAT_MENSAJES_VISIBLES
+        self.mensajes = (self.mensajes + [mensaje])[-self._visibles:]
+        self.mensajes_ocultos = indice + 1 - len(self.mensajes)
+        almacen = obtener_almacen()
+        if almacen is not None:
+            almacen.guardar_mensaje(self._clave_conversacion(), indice, role, content)
+            self._recortar_memoria()
+
+    def _recortar_memoria(self):
+        """Descarta de memoria los mensajes viejos que ya están en el almacén y en el resumen."""
+        sobrantes = len(self._mensajes) - CHAT_MENSAJES_MEMORIA
+        if HISTORIAL_RESUMEN:
+            # Los mensajes sin resumir se siguen enviando al modelo
+            sobrantes = min(sobrantes, self._resumen_hasta - self._base)
+        if sobrantes > 0:
+            self._mensajes = self._mensajes[sobrantes:]
+            self._base += sobrantes
+
+    def _pendientes_de_resumir(self) -> List[Dict[str, str]]:
+        """Mensajes que se envían completos al modelo (los posteriores al resumen)."""
+        return self._mensajes[max(0, self._resumen_hasta - self._base):]
+
+    def _clave_conversacion(self) -> str:
+        if not self._conversacion:
+            self._conversacion = self.router.session.client_token or uuid.uuid4().hex
+        return self._conversacion
+
+    async def _cargar_conversacion(self):
+        """Recupera del almacén la conversación de esta pestaña (p. ej. después de un reinicio)."""
+        if self._cargada:
+            return
+        self._cargada = True
+        # Primer uso del almacén en la sesión: abrirlo (una vez por worker) fuera del event loop
+        almacen = await asyncio.to_thread(obtener_almacen)
+        if almacen is None:
+            return
+        conversacion = self._clave_conversacion()
+
+        def leer():
+            total = almacen.total(conversacion)
+            resumen, resumen_hasta = almacen.resumen(conversacion)
+            desde = max(0, total - CHAT_MENSAJES_MEMORIA)
+            if HISTORIAL_RESUMEN:
+                desde = min(desde, resumen_hasta)
+            return almacen.cargar(conversacion, desde, total), desde, resumen, resumen_hasta
+
+        mensajes, desde, resumen, resumen_hasta = await asyncio.to_thread(leer)
+        if not mensajes:
+            return
+        self._mensajes, self._base = mensajes, desde
+        self._resumen, self._resumen_hasta = resumen, resumen_hasta
+        self.mensajes = mensajes[-self._visibles:]
+        self.mensajes_ocultos = desde + len(mensajes) - len(self.mensajes)
+        logger.info(f"Conversación recuperada del almacén ({desde + len(mensajes)} mensajes).")
+
+    async def cargar_conversacion(self):
+        """Evento on_load de la página."""
+        await self._cargar_conversacion()
+
+    async def cargar_anteriores(self):
+        """Agrega a la ventana visible otros CHAT_MENSAJES_VISIBLES mensajes anteriores."""
+        hasta = self.mensajes_ocultos
+        desde = max(0, hasta - CHAT_MENSAJES_VISIBLES)
+        almacen = obtener_almacen()
+        if desde >= self._base:
+            anteriores = self._mensajes[desde - self._base:hasta - self._base]
+        elif almacen is not None:
+            # Ya no están en memoria: se leen del almacén
+            anteriores = await asyncio.to_thread(almacen.cargar, self._clave_conversacion(), desde, hasta)
+        else:
+            anteriores = []
+        self._visibles += len(anteriores)
+        self.mensajes = anteriores + self.mensajes
+        self.mensajes_ocultos = hasta - len(anteriores)
+
     async def enviar_mensaje(self):
         """Maneja el evento de enviar mensaje."""
         if not self.entrada_usuario.strip():
             return
 
+        inicio_turno = time.perf_counter()
+        self.aviso = ""
+        await self._cargar_conversacion()
+
+        # 0. Control de admisión (ver admision.py). Sin lugar libre el turno espera en la
+        # cola mostrando su posición; con la cola llena (o si la espera vence) se avisa
+        # enseguida y el mensaje queda en el input, sin entrar al historial.
+        try:
+            turno = admision.turnos.solicitar()
+        except admision.Ocupado:
+            self.aviso = MENSAJE_OCUPADO
+            return
+        try:
+            if not turno.admitido:
+                self.procesando = True
+                try:
+                    async for posicion in turno.esperar():
+                        self.posicion_cola = posicion
+                        yield
+                except admision.Ocupado:
+                    self.aviso = MENSAJE_OCUPADO
+                    return
+                finally:
+                    self.procesando = False
+                    self.posicion_cola = 0
+
+            async for _ in self._procesar_turno(inicio_turno):
+                yield
+        finally:
+            turno.liberar()
+
+        # 3. Con la respuesta ya entregada, actualizar el resumen en segundo plano
+        if HISTORIAL_RESUMEN:
+            yield EstadoChat.actualizar_resumen
+
+    async def _procesar_turno(self, inicio_turno: float):
+        """Pasos 1 y 2 de enviar_mensaje, con el turno ya admitido."""
+        inicio = time.perf_counter()
+
         # 1. Guardar mensaje del usuario y limpiar input
-        nuevo_mensaje = {"role": "user", "content": self.entrada_usuario}
-        self.mensajes.append(nuevo_mensaje)
+        self._agregar_mensaje("user", self.entrada_usuario)
         self.entrada_usuario = ""
         self.procesando = True
-        
+        metricas.observar("estado", time.perf_counter() - inicio)
+
         # Yield para actualizar la UI inmediatamente (mostrar mensaje usuario y loader)
+        # El tiempo suspendido en cada yield es el envío del delta de estado al navegador.
+        inicio_ui = time.perf_counter()
         yield
+        metricas.observar("ui", time.perf_counter() - inicio_ui)
         # FORCE UI UPDATE: Give the event loop time to send the 'yield' message to the frontend.
         await asyncio.sleep(0.1)
 
-        # 2. Llamada asíncrona (simulada en estructura) al LLM
+        # 2. Llamada asíncrona al LLM (cliente AsyncOpenAI compartido, ver clientes.py)
         # Reflex maneja handlers asíncronos para no bloquear.
         try:
-            # --- ZONA DE EXTENSIÓN FUTURA: MEMORIA LARGA ---
-            # Aquí guardaríamos el mensaje en Postgres antes de procesar.
-            
-            # Ejecutar la llamada bloqueante en un hilo separado para no bloquear el loop de eventos
-            respuesta_texto = await asyncio.to_thread(
-                llm_client.obtener_respuesta, 
-                self.mensajes, 
-                self.system_prompt
-            )
-            
+            if STREAM_RESPUESTAS:
+                # Los deltas se acumulan y se envían a la UI como máximo cada STREAM_INTERVALO_MS
+                intervalo = STREAM_INTERVALO_MS / 1000
+                ultimo_envio = 0.0
+                partes = []
+                async for delta in llm_client.obtener_respuesta_stream(
+                    self._pendientes_de_resumir(), self.system_prompt, self._resumen
+                ):
+                    self.transmitiendo = True
+                    partes.append(delta)
+                    ahora = time.monotonic()
+                    if ahora - ultimo_envio >= intervalo:
+                        ultimo_envio = ahora
+                        # Reflex envía la variable completa: cada envío lleva todo el texto
+                        # recibido hasta ahora (acotado por el largo de una respuesta y a lo
+                        # sumo uno cada STREAM_INTERVALO_MS), no solo los deltas nuevos
+                        self.respuesta_parcial = "".join(partes)
+                        inicio_ui = time.perf_counter()
+                        yield
+                        metricas.observar("ui", time.perf_counter() - inicio_ui)
+                # Al terminar, la respuesta pasa a la lista en un solo cambio
+                self._agregar_mensaje("assistant", "".join(partes) if partes else "Ocurrió un error inesperado.")
+            else:
+                # Llamada asíncrona nativa: no ocupa hilos del executor mientras espera a OpenAI
+                respuesta_texto = await llm_client.aobtener_respuesta(
+                    self._pendientes_de_resumir(), self.system_prompt, self._resumen
+                )
+                self._agregar_mensaje("assistant", respuesta_texto)
+
             # --- ZONA DE EXTENSIÓN FUTURA: AUTH ---
             # Verificar si el usuario tiene permisos para ejecutar ciertas acciones (si hubiera tools).
 
-            self.mensajes.append({"role": "assistant", "content": respuesta_texto})
-            
         except Exception as e:
             logger.error(f"Error procesando mensaje: {e}", exc_info=True)
-            self.mensajes.append({"role": "assistant", "content": "Ocurrió un error inesperado."})
+            self._agregar_mensaje("assistant", "Ocurrió un error inesperado.")
         finally:
             self.procesando = False
+            self.transmitiendo = False
+            self.respuesta_parcial = ""
+            metricas.observar("turno", time.perf_counter() - inicio_turno)
             logger.info("Proceso finalizado. UI desbloqueada.")
 
+    @rx.event(background=True)
+    async def actualizar_resumen(self):
+        """
+        Incorpora al resumen los turnos viejos cuando los mensajes sin resumir superan
+        HISTORIAL_TOKENS. Corre en segundo plano: no bloquea la UI ni el próximo mensaje.
+        """
+        async with self:
+            # Los índices son de la conversación completa; _mensajes empieza en _base
+            mensajes = list(self._mensajes)
+            base = self._base
+            resumen = self._resumen
+            desde = self._resumen_hasta
+            id_conversacion = self._id_conversacion
+
+        hasta = base + punto_de_corte(mensajes, desde - base, HISTORIAL_TOKENS)
+        if hasta <= desde:
+            return
+        nuevo_resumen = await llm_client.aresumir(resumen, mensajes[desde - base:hasta - base])
+        if nuevo_resumen is None:
+            return
+
+        async with self:
+            # Se descarta si mientras tanto se limpió el chat o corrió otro resumen
+            if self._id_conversacion == id_conversacion and self._resumen_hasta == desde:
+                self._resumen = nuevo_resumen
+                self._resumen_hasta = hasta
+                almacen = obtener_almacen()
+                if almacen is not None:
+                    almacen.guardar_resumen(self._conversacion, nuevo_resumen, hasta)
+                    self._recortar_memoria()
+                logger.info(f"Resumen del historial actualizado ({hasta} mensajes resumidos).")
+
     def limpiar_conversacion(self):
         """Reinicia el chat."""
+        self._cargada = True
+        almacen = obtener_almacen()
+        if almacen is not None:
+            almacen.borrar(self._clave_conversacion())
+        self._mensajes = []
+        self._base = 0
         self.mensajes = []
+        self.mensajes_ocultos = 0
+        self._visibles = CHAT_MENSAJES_VISIBLES
         self.procesando = False
+        self.transmitiendo = False
+        self.respuesta_parcial = ""
+        self.aviso = ""
+        self._resumen = ""
+        self._resumen_hasta = 0
+        self._id_conversacion += 1
 
     def set_entrada_usuario(self, valor: str):
         """Setter explícito para el input (a veces necesario en Reflex para control fino)."""
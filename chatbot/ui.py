@@ -29,10 +29,38 @@ def area_chat() -> rx.Component:
     Contenedor principal de los mensajes.
     """
     return rx.vstack(
+        # Solo se renderiza la ventana de mensajes recientes; los anteriores se piden al backend
+        rx.cond(
+            EstadoChat.mensajes_ocultos > 0,
+            rx.button(
+                f"Ver mensajes anteriores ({EstadoChat.mensajes_ocultos})",
+                on_click=EstadoChat.cargar_anteriores,
+                variant="ghost",
+                size="1",
+                align_self="center",
+            ),
+        ),
         rx.foreach(EstadoChat.mensajes, mensaje_burbuja),
+        # Respuesta en curso (streaming): se actualiza sin reenviar la lista de mensajes
+        rx.cond(
+            EstadoChat.transmitiendo,
+            mensaje_burbuja({"role": "assistant", "content": EstadoChat.respuesta_parcial}),
+        ),
+        rx.cond(
+            EstadoChat.procesando & ~EstadoChat.transmitiendo,
+            rx.cond(
+                EstadoChat.posicion_cola > 0,
+                rx.text(
+                    f"En espera: tu consulta es la número {EstadoChat.posicion_cola} en la cola...",
+                    color="gray", font_style="italic", font_size="sm",
+                ),
+                rx.text("Pensando...", color="gray", font_style="italic", font_size="sm"),
+            ),
+        ),
+        # Servidor ocupado: el mensaje no se envió y quedó en el input para reintentar
         rx.cond(
-            EstadoChat.procesando,
-            rx.text("Pensando...", color="gray", font_style="italic", font_size="sm"),
+            EstadoChat.aviso != "",
+            rx.callout(EstadoChat.aviso, icon="triangle_alert", color_scheme="orange", size="1", width="100%"),
         ),
         width="100%",
         height="70vh",
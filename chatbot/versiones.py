@@ -0,0 +1,81 @@
+"""
+Versiones del vector store (compartido con scripts/ingest.py).
+
+Cada ingestión escribe un directorio nuevo y lo publica reemplazando de forma
+atómica el archivo puntero `ACTUAL`:
+
+    vector_store/
+        ACTUAL              id de la versión publicada
+        versiones/<id>/     index.faiss, chunks.bin, index_params.json, lexico/, ...
+
+Los lectores (RAGClient) nunca ven una versión a medio escribir: el puntero se
+cambia con os.replace recién cuando todos los archivos están en disco. Sin
+puntero (vector stores anteriores), los archivos están directamente en
+vector_store/.
+"""
+import os
+import time
+import shutil
+
+PUNTERO = "ACTUAL"
+DIR_VERSIONES = "versiones"
+
+
+def version_actual(base: str) -> str:
+    """Id de la versión publicada, o "" si el vector store no está versionado."""
+    try:
+        with open(os.path.join(base, PUNTERO), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def directorio_version(base: str, version: str) -> str:
+    return os.path.join(base, DIR_VERSIONES, version) if version else base
+
+
+def directorio_actual(base: str) -> tuple[str, str]:
+    """(versión, directorio) de la versión publicada."""
+    version = version_actual(base)
+    return version, directorio_version(base, version)
+
+
+def crear_version(base: str) -> tuple[str, str]:
+    """Crea el directorio de una versión nueva (todavía sin publicar)."""
+    while True:
+        # Ordenable por fecha (con microsegundos: limpiar_versiones ordena por nombre)
+        ahora = time.time()
+        version = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(ahora))}-{int(ahora * 1e6) % 1_000_000:06d}"
+        ruta = directorio_version(base, version)
+        try:
+            os.makedirs(ruta)
+            return version, ruta
+        except FileExistsError:
+            continue
+
+
+def publicar_version(base: str, version: str):
+    """Apunta `ACTUAL` a `version` (reemplazo atómico del archivo puntero)."""
+    tmp = os.path.join(base, PUNTERO + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(base, PUNTERO))
+
+
+def limpiar_versiones(base: str, conservar: int = 3) -> list[str]:
+    """
+    Borra las versiones más viejas: conserva las `conservar` más recientes y
+    siempre la publicada (los workers que aún no recargaron siguen usando la anterior).
+    """
+    directorio = os.path.join(base, DIR_VERSIONES)
+    if not os.path.isdir(directorio):
+        return []
+    actual = version_actual(base)
+    versiones = sorted(os.listdir(directorio))
+    borrar = [v for v in versiones[:max(0, len(versiones) - conservar)] if v != actual]
+    for version in borrar:
+        # En Windows un archivo mapeado en memoria no se puede borrar: se reintenta la próxima vez
+        shutil.rmtree(os.path.join(directorio, version), ignore_errors=True)
+    return borrar
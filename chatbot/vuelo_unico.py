@@ -0,0 +1,209 @@
+"""
+Agrupación de llamadas idénticas en curso ("single-flight").
+
+Cuando varias sesiones piden lo mismo a la vez (p. ej. una clase entera hace
+la misma pregunta), solo la primera llamada va a OpenAI; las demás esperan y
+reciben el mismo resultado. No es un caché: en cuanto la llamada termina, la
+clave se libera y la próxima petición vuelve a salir (los cachés de
+embeddings y semántico cubren la reutilización posterior).
+
+- VueloUnico: para llamadas que devuelven un valor (embeddings, completions).
+- DifusionStream: para completions en streaming; una tarea consume el stream
+  de OpenAI y cada suscriptor recibe todos los fragmentos desde el principio.
+"""
+import asyncio
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class VueloUnico:
+    """Comparte el resultado de llamadas concurrentes con la misma clave."""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._lock = threading.Lock()
+        self._en_vuelo_async: dict[Hashable, asyncio.Future] = {}
+        self._en_vuelo_sync: dict[Hashable, "_LlamadaSync"] = {}
+
+        # Contadores (ver estadisticas())
+        self.llamadas = 0
+        self.agrupadas = 0
+
+    async def ejecutar(self, clave: Hashable, funcion: Callable[[], Awaitable[T]]) -> T:
+        """Ejecuta `funcion()` o, si ya hay una en curso con la misma clave, espera su resultado."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            futuro = self._en_vuelo_async.get(clave)
+            # Un futuro de otro event loop no se puede esperar desde este
+            if futuro is not None and futuro.get_loop() is loop:
+                self.agrupadas += 1
+            else:
+                futuro = None
+                propio = loop.create_future()
+                self._en_vuelo_async[clave] = propio
+                self.llamadas += 1
+
+        if futuro is not None:
+            # shield: si este solicitante se cancela, la llamada compartida sigue
+            try:
+                return await asyncio.shield(futuro)
+            except asyncio.CancelledError:
+                if not futuro.cancelled():
+                    raise
+                # Se canceló la llamada compartida (no este solicitante): se reintenta
+                return await self.ejecutar(clave, funcion)
+
+        try:
+            resultado = await funcion()
+        except asyncio.CancelledError:
+            propio.cancel()
+            raise
+        except BaseException as e:
+            propio.set_exception(e)
+            propio.exception()  # marcado como leído aunque no haya nadie esperando
+            raise
+        else:
+            propio.set_result(resultado)
+            return resultado
+        finally:
+            with self._lock:
+                if self._en_vuelo_async.get(clave) is propio:
+                    del self._en_vuelo_async[clave]
+
+    def ejecutar_sync(self, clave: Hashable, funcion: Callable[[], T]) -> T:
+        """Versión para hilos (cliente síncrono)."""
+        with self._lock:
+            llamada = self._en_vuelo_sync.get(clave)
+            if llamada is not None:
+                self.agrupadas += 1
+            else:
+                propia = _LlamadaSync()
+                self._en_vuelo_sync[clave] = propia
+                self.llamadas += 1
+
+        if llamada is not None:
+            return llamada.esperar()
+
+        try:
+            resultado = funcion()
+        except BaseException as e:
+            propia.terminar(error=e)
+            raise
+        else:
+            propia.terminar(resultado=resultado)
+            return resultado
+        finally:
+            with self._lock:
+                if self._en_vuelo_sync.get(clave) is propia:
+                    del self._en_vuelo_sync[clave]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.llamadas + self.agrupadas
+            return {
+                "llamadas": self.llamadas,
+                "agrupadas": self.agrupadas,
+                "tasa_agrupadas": self.agrupadas / total if total else 0.0,
+                "en_vuelo": len(self._en_vuelo_async) + len(self._en_vuelo_sync),
+            }
+
+
+class _LlamadaSync:
+    def __init__(self):
+        self._evento = threading.Event()
+        self._resultado = None
+        self._error: Optional[BaseException] = None
+
+    def terminar(self, resultado=None, error: Optional[BaseException] = None):
+        self._resultado, self._error = resultado, error
+        self._evento.set()
+
+    def esperar(self):
+        self._evento.wait()
+        if self._error is not None:
+            raise self._error
+        return self._resultado
+
+
+class _Transmision:
+    """Fragmentos de un stream en curso, reproducibles para cada suscriptor."""
+
+    def __init__(self):
+        self.partes: list[str] = []
+        self.terminada = False
+        self.error: Optional[BaseException] = None
+        self._condicion = asyncio.Condition()
+
+    async def publicar(self, parte: str):
+        async with self._condicion:
+            self.partes.append(parte)
+            self._condicion.notify_all()
+
+    async def cerrar(self, error: Optional[BaseException] = None):
+        async with self._condicion:
+            self.terminada = True
+            self.error = error
+            self._condicion.notify_all()
+
+    async def suscribir(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            while i < len(self.partes):
+                yield self.partes[i]
+                i += 1
+            if self.terminada:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self._condicion:
+                await self._condicion.wait_for(lambda: len(self.partes) > i or self.terminada)
+
+
+class DifusionStream(VueloUnico):
+    """
+    Single-flight para streams: el primer solicitante lanza una tarea que consume
+    el stream de origen; todos (incluido él) se suscriben y reciben cada fragmento.
+    La tarea sigue hasta el final aunque los suscriptores se desconecten.
+    """
+
+    def __init__(self, nombre: str):
+        super().__init__(nombre)
+        self._transmisiones: dict[Hashable, _Transmision] = {}
+        self._tareas: set[asyncio.Task] = set()
+
+    def suscribir(self, clave: Hashable, origen: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        with self._lock:
+            transmision = self._transmisiones.get(clave)
+            if transmision is not None:
+                self.agrupadas += 1
+            else:
+                transmision = _Transmision()
+                self._transmisiones[clave] = transmision
+                self.llamadas += 1
+                tarea = asyncio.get_running_loop().create_task(self._consumir(clave, transmision, origen))
+                # Referencia fuerte hasta que termine (el event loop solo guarda referencias débiles)
+                self._tareas.add(tarea)
+                tarea.add_done_callback(self._tareas.discard)
+        return transmision.suscribir()
+
+    async def _consumir(self, clave: Hashable, transmision: _Transmision, origen: Callable[[], AsyncIterator[str]]):
+        error = None
+        try:
+            async for parte in origen():
+                await transmision.publicar(parte)
+        except Exception as e:
+            error = e
+        finally:
+            # Desde acá los nuevos solicitantes inician otra llamada
+            with self._lock:
+                if self._transmisiones.get(clave) is transmision:
+                    del self._transmisiones[clave]
+            await transmision.cerrar(error)
+
+    def estadisticas(self) -> dict:
+        estadisticas = super().estadisticas()
+        with self._lock:
+            estadisticas["en_vuelo"] = len(self._transmisiones)
+        return estadisticas
@@ -1,63 +1,651 @@
 import os
+import sys
+import json
+import time
+import random
 import pickle
-import numpy as np
-import faiss
-import tiktoken
-from pypdf import PdfReader
+import asyncio
+import shutil
+import bisect
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
+
+# numpy, faiss, tiktoken, pypdf y openai se importan dentro de las funciones que
+# los usan: `ingest.py --help` (y los procesos del pool) no cargan lo que no necesitan.
+
+# El formato del almacén de chunks se comparte con el backend (chatbot/chunk_store.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot.indice import (
+    TIPOS_INDICE,
+    nuevos_parametros,
+    cargar_parametros,
+    guardar_parametros,
+    construir_indice,
+    preparar_vectores,
+    admite_eliminacion,
+    aplicar_parametros_busqueda,
+)
+from chatbot.versiones import directorio_actual, crear_version, publicar_version, limpiar_versiones
 
 # Cargar variables de entorno (API KEY)
 load_dotenv()
 
 # Configuración
 DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "docs")
-VECTOR_STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_store")
-INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "index.faiss")
-METADATA_PATH = os.path.join(VECTOR_STORE_DIR, "index.pkl")
+VECTOR_STORE_DIR = os.getenv(
+    "VECTOR_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_store")
+)
+# Cada ingestión escribe una versión nueva en vector_store/versiones/<id>/ y la publica
+# con el puntero vector_store/ACTUAL (ver chatbot/versiones.py). Archivos de cada versión:
+INDEX_ARCHIVO = "index.faiss"
+# index.pkl solo se lee para migrar vector stores anteriores; ahora se escribe chunks.bin
+METADATA_ARCHIVO = "index.pkl"
+CHUNKS_ARCHIVO = "chunks.bin"
+# Tipo de índice y parámetros de construcción/búsqueda (ver chatbot/indice.py)
+PARAMS_ARCHIVO = "index_params.json"
+# Vectores originales (float32, fila == id): permiten reconstruir cualquier tipo de índice sin re-embeber
+VECTORES_ARCHIVO = "vectores.npy"
+# Índice léxico BM25 para la búsqueda híbrida (ver chatbot/lexico.py)
+LEXICO_ARCHIVO = "lexico"
+# Manifiesto de la ingestión incremental: hash de cada PDF y de cada uno de sus chunks
+MANIFEST_ARCHIVO = "manifest.json"
+# Embeddings recién generados (float32 crudo, en el orden de los chunks nuevos) y metadatos de
+# los chunks de los PDFs procesados, escritos a medida que se trocean (se borran al terminar)
+EMBEDDINGS_TMP_ARCHIVO = "embeddings_nuevos.f32.tmp"
+CHUNKS_TMP_ARCHIVO = "chunks_nuevos.jsonl.tmp"
+# Versiones anteriores que se conservan (los workers que aún no recargaron siguen usándolas)
+VERSIONES_CONSERVAR = 3
+EMBEDDING_MODEL = "text-embedding-3-small"
+BATCH_SIZE = 50
+# Versión del troceo guardada en el manifiesto. Si cambia, todos los PDFs se vuelven a
+# trocear (los chunks con el mismo texto reutilizan su vector). 2: rangos de páginas.
+VERSION_TROCEO = 2
+# Filas de vectores que se copian a la vez a vectores.npy y al índice
+BLOQUE_VECTORES = 8192
+# Chunks nuevos por grupo enviado a embeber mientras se siguen troceando PDFs, y grupos en vuelo
+LOTE_INGESTA = 1000
+GRUPOS_EN_VUELO = 2
+# Límites por defecto de text-embedding-3-small (tier 1); ajustables por línea de comandos
+RPM_DEFAULT = 3000
+TPM_DEFAULT = 1_000_000
+MAX_REINTENTOS = 6
+
+def errores_reintentables():
+    """Errores transitorios que justifican reintentar un batch."""
+    import openai
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
 
 def get_chunks(text, chunk_size=500, overlap=50):
     """Divide el texto en chunks basados en tokens usando tiktoken."""
-    try:
-        enc = tiktoken.get_encoding("cl100k_base")
-    except Exception:
-        enc = tiktoken.get_encoding("cl100k_base")
+    import tiktoken
+    enc = tiktoken.get_encoding("cl100k_base")
 
     tokens = enc.encode(text)
     chunks = []
-    
+
     start = 0
     tokens_len = len(tokens)
-    
+
     while start < tokens_len:
         end = start + chunk_size
         chunk_tokens = tokens[start:end]
         chunk_text = enc.decode(chunk_tokens)
         chunks.append(chunk_text)
         start += (chunk_size - overlap)
-        
+
     return chunks
 
-def get_embedding(client, text, model="text-embedding-3-small"):
+def get_embedding(client, text, model=EMBEDDING_MODEL):
     """Genera embedding para un texto usando OpenAI."""
     text = text.replace("\n", " ")
     return client.embeddings.create(input=[text], model=model).data[0].embedding
 
-def ingest_docs():
+def hash_archivo(path):
+    """SHA-256 del contenido de un archivo (leído por bloques)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+def extraer_paginas(file_path):
+    """Genera (número de página desde 1, texto) de cada página con texto del PDF."""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    for numero, page in enumerate(reader.pages, start=1):
+        txt = page.extract_text()
+        if txt:
+            yield numero, txt + "\n"
+
+def _corte_estable(texto):
+    """
+    Última posición de `texto` donde la tokenización de cl100k no depende de lo que
+    venga después: un espacio en blanco precedido por una letra o un número (el
+    pre-tokenizador siempre separa ahí, y a la izquierda no hay espacios finales,
+    que se tokenizan distinto al final del texto). 0 si no hay ninguna.
+    """
+    for i in range(len(texto) - 1, 0, -1):
+        if texto[i].isspace() and texto[i - 1].isalnum():
+            return i
+    return 0
+
+def trocear_paginas(paginas, chunk_size=500, overlap=50):
+    """
+    Divide en chunks de tokens el texto de `paginas` ((número, texto) en orden) sin
+    armar el documento completo: solo se guarda en memoria la ventana de tokens del
+    chunk en curso. Cada página se tokeniza hasta su último corte estable (ver
+    _corte_estable); el resto (en general el salto de línea final) se tokeniza junto
+    con la página siguiente, así los tokens, y por lo tanto los cortes, son los
+    mismos que los de get_chunks() sobre el texto concatenado.
+
+    Genera dicts {"text", "pagina_inicio", "pagina_fin"}.
+    """
+    import tiktoken
+    enc = tiktoken.get_encoding("cl100k_base")
+    paso = chunk_size - overlap
+    tokens, paginas_token = [], []
+    # Texto todavía sin tokenizar y (posición en `pendiente`, número) de cada página que contiene
+    pendiente, limites = "", []
+
+    def chunk(n):
+        return {
+            "text": enc.decode(tokens[:n]),
+            "pagina_inicio": paginas_token[0],
+            "pagina_fin": paginas_token[n - 1],
+        }
+
+    def tokenizar(texto):
+        nuevos = enc.encode(texto)
+        if len(limites) == 1:
+            paginas_token.extend([limites[0][1]] * len(nuevos))
+        else:
+            # Un token que cruza el límite entre páginas cuenta para la primera
+            _, inicios = enc.decode_with_offsets(nuevos)
+            posiciones = [p for p, _ in limites]
+            paginas_token.extend(limites[bisect.bisect_right(posiciones, i) - 1][1] for i in inicios)
+        tokens.extend(nuevos)
+
+    for numero, texto in paginas:
+        limites.append((len(pendiente), numero))
+        pendiente += texto
+        corte = _corte_estable(pendiente)
+        if not corte:
+            continue
+        tokenizar(pendiente[:corte])
+        actual = [n for p, n in limites if p <= corte][-1]
+        limites = [(0, actual)] + [(p - corte, n) for p, n in limites if p > corte]
+        pendiente = pendiente[corte:]
+        while len(tokens) >= chunk_size:
+            yield chunk(chunk_size)
+            del tokens[:paso], paginas_token[:paso]
+
+    if pendiente:
+        tokenizar(pendiente)
+
+    # Cola del documento (como get_chunks: también los últimos fragmentos cortos)
+    while tokens:
+        yield chunk(min(chunk_size, len(tokens)))
+        del tokens[:paso], paginas_token[:paso]
+
+def extraer_chunks(file_path):
+    """Extrae el texto de un PDF página por página y lo divide en chunks con su rango de páginas."""
+    return trocear_paginas(extraer_paginas(file_path))
+
+def _extraer_chunks_a_archivo(file_path, salida):
+    # Los procesos del pool escriben los chunks a disco (JSON por línea) a medida que los
+    # generan: ni el proceso ni el resultado que vuelve tienen el PDF completo en memoria
+    with open(salida, "w", encoding="utf-8") as f:
+        for chunk in extraer_chunks(file_path):
+            f.write(json.dumps(chunk) + "\n")
+    return salida
+
+def _resultado(futuro):
+    # Como generador: el error de extracción aparece al recorrerlo, igual que sin procesos
+    salida = futuro.result()
+    try:
+        with open(salida, "r", encoding="utf-8") as f:
+            for linea in f:
+                yield json.loads(linea)
+    finally:
+        # Si se abandonó la ingestión, chunks_por_archivo ya pudo borrar el directorio
+        if os.path.exists(salida):
+            os.remove(salida)
+
+def chunks_por_archivo(rutas, procesos=1):
+    """
+    Genera, en el orden de `rutas`, un iterable con los chunks de cada PDF.
+
+    Con procesos > 1 los PDFs se extraen en paralelo, a lo sumo dos por proceso por
+    delante del que se está consumiendo; cada proceso escribe sus chunks en un
+    archivo temporal que después se lee línea por línea, así que en memoria no
+    queda ningún PDF completo.
+    """
+    if procesos <= 1 or len(rutas) <= 1:
+        for ruta in rutas:
+            yield extraer_chunks(ruta)
+        return
+
+    print(f"⚙️ Extrayendo {len(rutas)} PDFs con {procesos} procesos...")
+    executor = ProcessPoolExecutor(max_workers=procesos)
+    temporal = tempfile.TemporaryDirectory(prefix="ingest_chunks_")
+    pendientes = iter(enumerate(rutas))
+    futuros = deque()
+
+    def enviar(numero, ruta):
+        salida = os.path.join(temporal.name, f"{numero}.jsonl")
+        futuros.append(executor.submit(_extraer_chunks_a_archivo, ruta, salida))
+
+    try:
+        for numero, ruta in pendientes:
+            enviar(numero, ruta)
+            if len(futuros) >= 2 * procesos:
+                break
+        while futuros:
+            futuro = futuros.popleft()
+            siguiente = next(pendientes, None)
+            if siguiente is not None:
+                enviar(*siguiente)
+            yield _resultado(futuro)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        temporal.cleanup()
+
+class LimitadorTasa:
+    """
+    Token bucket asíncrono para respetar los límites de la API de embeddings:
+    peticiones por minuto (RPM) y tokens por minuto (TPM).
+    """
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.peticiones = float(rpm)
+        self.tokens = float(tpm)
+        self.ultimo = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        transcurrido = ahora - self.ultimo
+        self.ultimo = ahora
+        self.peticiones = min(self.rpm, self.peticiones + transcurrido * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + transcurrido * self.tpm / 60)
+
+    async def adquirir(self, tokens):
+        tokens = min(tokens, self.tpm)
+        async with self.lock:
+            while True:
+                self._recargar()
+                if self.peticiones >= 1 and self.tokens >= tokens:
+                    self.peticiones -= 1
+                    self.tokens -= tokens
+                    return
+                espera = max(
+                    (1 - self.peticiones) * 60 / self.rpm,
+                    (tokens - self.tokens) * 60 / self.tpm,
+                )
+                await asyncio.sleep(max(espera, 0.01))
+
+class Embebedor:
+    """
+    Cliente, límites RPM/TPM y concurrencia compartidos por todas las llamadas a
+    embeber() de una ingestión (los límites valen para el total, no por llamada).
+    """
+    def __init__(self, api_key, batch_size=BATCH_SIZE, concurrencia=1, rpm=RPM_DEFAULT,
+                 tpm=TPM_DEFAULT, max_reintentos=MAX_REINTENTOS):
+        import tiktoken
+        from openai import AsyncOpenAI
+        self.enc = tiktoken.get_encoding("cl100k_base")
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.reintentables = errores_reintentables()
+        self.limitador = LimitadorTasa(rpm, tpm)
+        self.semaforo = asyncio.Semaphore(concurrencia)
+        self.batch_size = batch_size
+        self.max_reintentos = max_reintentos
+        self.lotes = 0
+        self.completados = 0
+        self.enviados = 0
+
+    async def embeber(self, textos):
+        """
+        Genera los embeddings de `textos` enviando varios batches en paralelo.
+
+        Respeta los límites RPM/TPM, reintenta los errores transitorios con backoff
+        exponencial y jitter, y devuelve una matriz float32 con los vectores en el
+        mismo orden que `textos`. Cada batch se escribe en su lugar de la matriz al
+        llegar.
+        Si un batch falla definitivamente se lanza la excepción: nunca se devuelve
+        un resultado incompleto (eso desalinearía chunks y vectores).
+        """
+        import numpy as np
+        lotes = [(i, textos[i:i + self.batch_size]) for i in range(0, len(textos), self.batch_size)]
+        resultado = None  # se crea con el primer batch, cuando se conoce la dimensión
+        self.enviados += len(textos)
+
+        async def procesar(inicio, lote):
+            nonlocal resultado
+            self.lotes += 1
+            n = self.lotes
+            tokens = sum(len(self.enc.encode(t)) for t in lote)
+            async with self.semaforo:
+                for intento in range(self.max_reintentos + 1):
+                    await self.limitador.adquirir(tokens)
+                    try:
+                        resp = await self.client.embeddings.create(input=lote, model=EMBEDDING_MODEL)
+                        break
+                    except self.reintentables as e:
+                        if intento == self.max_reintentos:
+                            raise
+                        espera = min(60, 2 ** intento) * (0.5 + random.random())
+                        print(f"   ⚠️ Batch {n}: {type(e).__name__}, reintento en {espera:.1f}s")
+                        await asyncio.sleep(espera)
+            # La API devuelve un índice por elemento: ordenamos por las dudas
+            vectores = np.asarray([d.embedding for d in sorted(resp.data, key=lambda d: d.index)], dtype=np.float32)
+            if resultado is None:
+                resultado = np.empty((len(textos), vectores.shape[1]), dtype=np.float32)
+            resultado[inicio:inicio + len(lote)] = vectores
+            self.completados += len(lote)
+            print(f"   Procesados {self.completados}/{self.enviados}")
+
+        await asyncio.gather(*(procesar(inicio, lote) for inicio, lote in lotes))
+        return resultado if resultado is not None else np.empty((0, 0), dtype=np.float32)
+
+    async def cerrar(self):
+        await self.client.close()
+
+class ColaEmbeddings:
+    """
+    Embeddings generados en segundo plano mientras se siguen troceando PDFs.
+
+    Los textos se agregan con agregar(); cada LOTE_INGESTA se envía un grupo a un
+    event loop propio que corre en otro hilo (con un Embebedor compartido) y los
+    vectores de cada grupo se escriben, en orden, al final de `salida` (float32
+    crudo: fila i == i-ésimo texto agregado). Con más de GRUPOS_EN_VUELO grupos
+    pendientes, agregar() espera al más viejo: en memoria solo quedan esos grupos.
+    """
+    def __init__(self, salida, api_key, **opciones):
+        self.salida = salida
+        self.filas = 0
+        self.dimension = None
+        self._embebedor = Embebedor(api_key, **opciones)
+        self._archivo = open(salida, "wb")
+        # True si falló un grupo: la ingestión no puede seguir (filas y ids desalineados)
+        self.fallida = False
+        self._textos = []
+        self._grupos = deque()
+        self._loop = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self._loop.run_forever, name="embeddings", daemon=True)
+        self._hilo.start()
+
+    def agregar(self, textos):
+        self._textos.extend(textos)
+        while len(self._textos) >= LOTE_INGESTA:
+            self._enviar(self._textos[:LOTE_INGESTA])
+            del self._textos[:LOTE_INGESTA]
+
+    def _enviar(self, textos):
+        self._grupos.append(asyncio.run_coroutine_threadsafe(self._embebedor.embeber(textos), self._loop))
+        while len(self._grupos) > GRUPOS_EN_VUELO:
+            self._escribir(self._grupos.popleft())
+
+    def _escribir(self, grupo):
+        try:
+            vectores = grupo.result()
+        except BaseException:
+            self.fallida = True
+            raise
+        self.dimension = vectores.shape[1]
+        self._archivo.write(vectores.tobytes())
+        self.filas += len(vectores)
+
+    def terminar(self):
+        """Espera los grupos pendientes y devuelve la matriz (memmap de solo lectura)."""
+        import numpy as np
+        if self._textos:
+            self._enviar(self._textos)
+            self._textos = []
+        while self._grupos:
+            self._escribir(self._grupos.popleft())
+        self.cerrar()
+        if not self.filas:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.memmap(self.salida, dtype=np.float32, mode="r", shape=(self.filas, self.dimension))
+
+    def cerrar(self):
+        """Cancela lo pendiente (si lo hay) y detiene el hilo. Se puede llamar más de una vez."""
+        if self._hilo is None:
+            return
+        self._grupos.clear()
+        asyncio.run_coroutine_threadsafe(self._cancelar_y_cerrar(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join()
+        self._loop.close()
+        self._hilo = None
+        self._archivo.close()
+
+    async def _cancelar_y_cerrar(self):
+        # Los grupos en vuelo terminan de cancelarse antes de detener el loop
+        tareas = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        await self._embebedor.cerrar()
+
+class MetadatosIngesta(Mapping):
+    """
+    Metadatos {id: metadato} de la versión en construcción sin tenerlos en memoria:
+    los chunks de los PDFs sin cambios se leen del almacén anterior (`previos`, un
+    ChunkStore mapeado en memoria o el dict de un index.pkl migrado) y los de los
+    PDFs procesados se escriben a `derrame` (JSON por línea) a medida que se trocean.
+    En memoria queda solo la ubicación de cada id.
+    """
+    _PREVIO = -1
+
+    def __init__(self, previos, derrame):
+        self.previos = previos
+        self._ubicacion = dict.fromkeys(previos, self._PREVIO)
+        self._archivo = open(derrame, "w+b")
+
+    def agregar(self, chunk_id, meta):
+        self._archivo.seek(0, os.SEEK_END)
+        self._ubicacion[chunk_id] = self._archivo.tell()
+        self._archivo.write(json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def pop(self, chunk_id, default=None):
+        return self._ubicacion.pop(chunk_id, default)
+
+    def restaurar(self, chunk_id):
+        """Deshace agregar() de un id del almacén anterior: vuelve a su metadato previo."""
+        self._ubicacion[chunk_id] = self._PREVIO
+
+    def __getitem__(self, chunk_id):
+        posicion = self._ubicacion[chunk_id]
+        if posicion == self._PREVIO:
+            return self.previos.get(chunk_id)
+        self._archivo.seek(posicion)
+        return json.loads(self._archivo.readline())
+
+    def __iter__(self):
+        return iter(sorted(self._ubicacion))
+
+    def __len__(self):
+        return len(self._ubicacion)
+
+    def cerrar(self):
+        self._archivo.close()
+        if hasattr(self.previos, "close"):
+            self.previos.close()
+
+def _guardar_atomico(path, escribir):
+    """Escribe en un archivo temporal y lo renombra, para no dejar archivos a medio escribir."""
+    tmp = path + ".tmp"
+    escribir(tmp)
+    os.replace(tmp, path)
+
+def cargar_estado(directorio):
+    """
+    Carga índice, metadatos y manifiesto existentes de la versión en `directorio`.
+
+    Devuelve (index, metadatas, manifest) o (None, {}, manifest vacío) si no hay un
+    vector store utilizable. `metadatas` es el ChunkStore abierto (los textos se
+    leen a pedido; hay que cerrarlo) o, en formatos anteriores, un dict. Un vector
+    store antiguo (IndexFlatL2 + lista de metadatos, sin manifiesto) se migra sin
+    volver a generar embeddings: los vectores se reutilizan para los chunks cuyo
+    texto no cambió.
+    """
+    import numpy as np
+    import faiss
+    from chatbot.chunk_store import ChunkStore
+    manifest_vacio = {"siguiente_id": 0, "archivos": {}}
+    index_path = os.path.join(directorio, INDEX_ARCHIVO)
+    chunks_path = os.path.join(directorio, CHUNKS_ARCHIVO)
+    metadata_path = os.path.join(directorio, METADATA_ARCHIVO)
+    manifest_path = os.path.join(directorio, MANIFEST_ARCHIVO)
+    if not os.path.exists(index_path):
+        return None, {}, manifest_vacio
+
+    index = faiss.read_index(index_path)
+    if os.path.exists(chunks_path):
+        metadatas = ChunkStore(chunks_path)
+    elif os.path.exists(metadata_path):
+        with open(metadata_path, "rb") as f:
+            metadatas = pickle.load(f)
+    else:
+        return None, {}, manifest_vacio
+
+    if os.path.exists(manifest_path) and isinstance(metadatas, (dict, ChunkStore)):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return index, metadatas, manifest
+
+    # --- Migración del formato anterior ---
+    if not isinstance(metadatas, list) or index.ntotal != len(metadatas):
+        if isinstance(metadatas, ChunkStore):
+            metadatas.close()
+        print("⚠️ Vector store existente en formato desconocido: se reconstruye desde cero.")
+        return None, {}, manifest_vacio
+
+    print("🔁 Migrando vector store anterior al formato incremental (sin re-embeber)...")
+    vectores = index.reconstruct_n(0, index.ntotal)
+    nuevo = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+    ids = np.arange(index.ntotal, dtype=np.int64)
+    nuevo.add_with_ids(vectores, ids)
+
+    manifest = {"siguiente_id": int(index.ntotal), "archivos": {}}
+    for i, meta in enumerate(metadatas):
+        # Hash de archivo desconocido: el PDF se volverá a trocear, pero sus chunks
+        # sin cambios reutilizan el vector ya calculado.
+        entrada = manifest["archivos"].setdefault(meta["source"], {"sha256": None, "chunks": []})
+        entrada["chunks"].append({"sha256": hash_texto(meta["text"]), "id": i})
+
+    return nuevo, dict(enumerate(metadatas)), manifest
+
+def _vectores_previos(directorio):
+    """Matriz de vectores de la ingestión anterior (mmap, solo lectura) o None."""
+    import numpy as np
+    path = os.path.join(directorio, VECTORES_ARCHIVO)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    return None
+
+def _bloques_nuevos(ids_nuevos, embeddings):
+    """
+    (ids, vectores) de los chunks embebidos, de a BLOQUE_VECTORES. Se saltean las
+    filas con id -1: chunks de un PDF que falló después de enviarlos a embeber.
+    """
+    import numpy as np
+    for i in range(0, len(ids_nuevos), BLOQUE_VECTORES):
+        ids = np.array(ids_nuevos[i:i + BLOQUE_VECTORES], dtype=np.int64)
+        vectores = embeddings[i:i + BLOQUE_VECTORES]
+        validos = ids >= 0
+        if not validos.all():
+            ids, vectores = ids[validos], vectores[validos]
+        yield ids, vectores
+
+def escribir_vectores(origen, destino, index, dimension, siguiente_id, ids_vigentes, ids_eliminados,
+                      ids_nuevos, embeddings):
+    """
+    Escribe `destino/vectores.npy` (fila == id de chunk) con los vectores vigentes.
+    Los vectores previos se copian de `origen/vectores.npy` o, en vector stores que
+    aún no lo tienen, se reconstruyen desde el índice plano.
+    """
+    import numpy as np
+    previos = _vectores_previos(origen)
+    vectores_path = os.path.join(destino, VECTORES_ARCHIVO)
+    tmp = vectores_path + ".tmp"
+    salida = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(siguiente_id, dimension))
+    nuevos = set(ids_nuevos)
+    if previos is not None:
+        m = min(len(previos), siguiente_id)
+        salida[:m] = previos[:m]
+    elif index is not None:
+        for chunk_id in ids_vigentes:
+            if chunk_id not in nuevos:
+                salida[chunk_id] = index.reconstruct(chunk_id)
+    if ids_eliminados:
+        salida[np.array(ids_eliminados, dtype=np.int64)] = 0
+    for ids, vectores in _bloques_nuevos(ids_nuevos, embeddings):
+        salida[ids] = vectores
+    salida.flush()
+    del salida, previos
+    os.replace(tmp, vectores_path)
+    return np.load(vectores_path, mmap_mode="r")
+
+def ingest_docs(completo=False, procesos=1, concurrencia=1, rpm=RPM_DEFAULT, tpm=TPM_DEFAULT,
+                tipo_indice=None, parametros_indice=None, conservar=VERSIONES_CONSERVAR):
+    """
+    Lee la versión publicada del vector store, escribe una versión nueva con los
+    cambios y la publica de forma atómica: los workers del backend la cargan en
+    segundo plano sin reiniciarse.
+
+    Los PDFs se procesan en flujo: páginas → chunks → grupos de LOTE_INGESTA
+    chunks que se envían a embeber en segundo plano (ColaEmbeddings) mientras se
+    sigue troceando el mismo PDF → vectores y metadatos escritos a disco. En
+    memoria quedan la ventana del troceo, el grupo en armado y los grupos en vuelo,
+    sin importar el tamaño de cada PDF. Sí crecen con el corpus el índice FAISS (se
+    actualiza en memoria), el índice léxico en construcción y el manifiesto (ids y
+    hashes de los chunks).
+
+    Args:
+        completo: reconstruye todo ignorando el manifiesto.
+        procesos: procesos para extraer y trocear PDFs en paralelo (1 = en este proceso).
+        concurrencia: batches de embeddings en vuelo simultáneamente.
+        rpm, tpm: límites de peticiones y tokens por minuto de la API de embeddings.
+        tipo_indice: tipo de índice FAISS (ver chatbot/indice.py); None conserva el actual
+            o usa 'flat-ip' en un vector store nuevo.
+        parametros_indice: parámetros de construcción/búsqueda (hnsw_m, nprobe, ...).
+        conservar: versiones anteriores que se conservan en disco.
+    """
+    import numpy as np
+    import faiss
+    from chatbot.chunk_store import escribir_chunk_store
+    from chatbot.lexico import IndiceLexico
+
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("❌ Error: OPENAI_API_KEY no encontrada en .env")
         return
 
-    client = OpenAI(api_key=api_key)
-
     print(f"📂 Buscando PDFs en: {DOCS_DIR}")
     if not os.path.exists(DOCS_DIR):
         os.makedirs(DOCS_DIR)
         print(f"⚠️ Directorio {DOCS_DIR} creado. Agregue PDFs y reintente.")
         return
 
-    files = [f for f in os.listdir(DOCS_DIR) if f.endswith('.pdf')]
+    files = sorted(f for f in os.listdir(DOCS_DIR) if f.endswith('.pdf'))
     if not files:
         print("⚠️ No se encontraron archivos PDF.")
         return
@@ -66,72 +654,320 @@ def ingest_docs():
     if not os.path.exists(VECTOR_STORE_DIR):
         os.makedirs(VECTOR_STORE_DIR)
 
-    all_chunks = []
-    all_metadatas = []
-    
+    version_origen, origen = directorio_actual(VECTOR_STORE_DIR)
+    if completo:
+        index, metadatas, manifest = None, {}, {"siguiente_id": 0, "archivos": {}}
+    else:
+        index, metadatas, manifest = cargar_estado(origen)
+
+    archivos_previos = manifest["archivos"]
+    siguiente_id = manifest["siguiente_id"]
+    # Un manifiesto de otra versión del troceo obliga a volver a trocear todos los PDFs
+    troceo_vigente = manifest.get("version_troceo") == VERSION_TROCEO
+    nuevos_archivos = {}
+    ids_a_eliminar = []
+    ids_nuevos = []  # ids de los chunks enviados a embeber, en el orden de sus vectores (-1 = descartado)
+    descartados = 0
+
+    # Todo se escribe en una versión nueva; la publicada no se toca hasta el final
+    version, destino = crear_version(VECTOR_STORE_DIR)
+    embeddings_tmp = os.path.join(destino, EMBEDDINGS_TMP_ARCHIVO)
+    metadatas = MetadatosIngesta(metadatas, os.path.join(destino, CHUNKS_TMP_ARCHIVO))
+    cola = ColaEmbeddings(embeddings_tmp, api_key, concurrencia=concurrencia, rpm=rpm, tpm=tpm)
+
+    def descartar_version():
+        cola.cerrar()
+        metadatas.cerrar()
+        shutil.rmtree(destino, ignore_errors=True)
+
+    # Archivos eliminados de docs/: se borran todos sus vectores
+    for filename, entrada in archivos_previos.items():
+        if filename not in files:
+            print(f"🗑️ Eliminado: {filename}")
+            ids_a_eliminar.extend(c["id"] for c in entrada["chunks"])
+
+    # 1. Detectar qué archivos cambiaron
+    a_procesar = []
     for filename in files:
-        file_path = os.path.join(DOCS_DIR, filename)
+        sha = hash_archivo(os.path.join(DOCS_DIR, filename))
+        previo = archivos_previos.get(filename)
+        if previo is not None and previo["sha256"] == sha and index is not None and troceo_vigente:
+            nuevos_archivos[filename] = previo
+        else:
+            a_procesar.append((filename, sha))
+
+    # 2. Extraer y trocear los PDFs modificados (en paralelo si procesos > 1) y
+    # 3. conciliar sus chunks con el manifiesto (en orden de archivo: ids deterministas).
+    #    Los chunks nuevos se envían a embeber de a LOTE_INGESTA mientras se trocea el PDF.
+    rutas = [os.path.join(DOCS_DIR, filename) for filename, _ in a_procesar]
+    for (filename, sha), chunks in zip(a_procesar, chunks_por_archivo(rutas, procesos)):
+        previo = archivos_previos.get(filename)
         print(f"📄 Procesando: {filename}")
-        
-        try:
-            reader = PdfReader(file_path)
-            full_text = ""
-            for page in reader.pages:
-                txt = page.extract_text()
-                if txt:
-                    full_text += txt + "\n"
-            
-            chunks = get_chunks(full_text)
-            print(f"   Cortando en {len(chunks)} chunks...")
 
+        # Ids anteriores de este archivo, agrupados por hash de chunk
+        reutilizables = {}
+        if previo is not None and index is not None:
+            for c in previo["chunks"]:
+                reutilizables.setdefault(c["sha256"], []).append(c["id"])
+
+        entrada = {"sha256": sha, "chunks": []}
+        lote = []  # (id, texto) de chunks nuevos aún no enviados a embeber
+        enviados_desde = len(ids_nuevos)
+        proximo_id = siguiente_id
+        reutilizados = 0
+
+        def enviar_lote():
+            cola.agregar([texto for _, texto in lote])
+            ids_nuevos.extend(chunk_id for chunk_id, _ in lote)
+            lote.clear()
+
+        try:
             for i, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                all_metadatas.append({"source": filename, "chunk_index": i, "text": chunk})
-                
+                h = hash_texto(chunk["text"])
+                meta = {"source": filename, "chunk_index": i, **chunk}
+                if reutilizables.get(h):
+                    chunk_id = reutilizables[h].pop()
+                    reutilizados += 1
+                else:
+                    chunk_id = proximo_id
+                    proximo_id += 1
+                    lote.append((chunk_id, chunk["text"]))
+                metadatas.agregar(chunk_id, meta)
+                entrada["chunks"].append({"sha256": h, "id": chunk_id})
+                if len(lote) >= LOTE_INGESTA:
+                    enviar_lote()
+            if lote:
+                enviar_lote()
         except Exception as e:
+            if cola.fallida:
+                # Abortamos sin publicar: un batch perdido desalinearía ids y vectores
+                print(f"   ❌ Error generando embeddings: {e}")
+                print("❌ Ingestión abortada. No se modificó el vector store.")
+                descartar_version()
+                return
             print(f"   ❌ Error procesando {filename}: {e}")
+            # Se conserva lo que hubiera del archivo para no perder datos
+            for c in entrada["chunks"]:
+                if c["id"] >= siguiente_id:
+                    metadatas.pop(c["id"])
+                else:
+                    metadatas.restaurar(c["id"])
+            enviados = len(ids_nuevos) - enviados_desde
+            if enviados:
+                # Lo enviado a embeber no se puede retirar de la cola: esas filas quedan
+                # con id -1 (se descartan al armar el índice) y sus ids no se reutilizan
+                ids_nuevos[enviados_desde:] = [-1] * enviados
+                descartados += enviados
+                siguiente_id = proximo_id
+            if previo is not None:
+                nuevos_archivos[filename] = previo
+            continue
 
-    if not all_chunks:
-        print("⚠️ No se generaron chunks.")
+        siguiente_id = proximo_id
+        for ids in reutilizables.values():
+            ids_a_eliminar.extend(ids)
+        nuevos_archivos[filename] = entrada
+        total = len(entrada["chunks"])
+        print(f"   {total} chunks ({reutilizados} sin cambios, {total - reutilizados} nuevos).")
+
+    # Parámetros del índice: se conservan los actuales salvo que se pidan otros
+    params_previos = cargar_parametros(os.path.join(origen, PARAMS_ARCHIVO)) if index is not None else None
+    base = params_previos or nuevos_parametros("flat-ip")
+    valores = {k: v for k, v in base.items() if k not in ("tipo", "metrica")}
+    if tipo_indice is not None and tipo_indice != base["tipo"]:
+        # Cambio de tipo: los parámetros de construcción vuelven a sus valores por defecto
+        valores = {}
+    valores.update({k: v for k, v in (parametros_indice or {}).items() if v is not None})
+    params = nuevos_parametros(tipo_indice or base["tipo"], **valores)
+
+    if (len(ids_nuevos) == descartados and not ids_a_eliminar and nuevos_archivos == archivos_previos
+            and troceo_vigente and params == params_previos
+            and os.path.exists(os.path.join(origen, LEXICO_ARCHIVO, "vocabulario.json"))):
+        print("✅ El vector store ya está actualizado. Nada que hacer.")
+        descartar_version()
         return
 
-    print(f"🧠 Generando embeddings para {len(all_chunks)} chunks... (esto puede tardar)")
-    
-    # Generar embeddings en lote (o uno por uno si es muy grande, aquí simple)
-    # Para producción, hacer batches de 10-100.
-    embeddings = []
-    batch_size = 50
-    total = len(all_chunks)
-    
-    for i in range(0, total, batch_size):
-        batch = all_chunks[i:i+batch_size]
-        try:
-            resp = client.embeddings.create(input=batch, model="text-embedding-3-small")
-            embeddings.extend([d.embedding for d in resp.data])
-            print(f"   Procesados {min(i+batch_size, total)}/{total}")
-        except Exception as e:
-            print(f"   ❌ Error en batch {i}: {e}")
+    if ids_nuevos:
+        print(f"🧠 Esperando los embeddings de {len(ids_nuevos) - descartados} chunks nuevos... (esto puede tardar)")
+    try:
+        # Cada grupo se escribe a disco al llegar: `embeddings` es un memmap
+        embeddings = cola.terminar()
+    except Exception as e:
+        # Abortamos sin publicar: un batch perdido desalinearía ids y vectores
+        print(f"   ❌ Error generando embeddings: {e}")
+        print("❌ Ingestión abortada. No se modificó el vector store.")
+        descartar_version()
+        return
 
-    if not embeddings:
+    for chunk_id in ids_a_eliminar:
+        metadatas.pop(chunk_id, None)
+    if not metadatas:
+        print("⚠️ No se generaron chunks.")
+        del embeddings
+        descartar_version()
         return
 
-    # Convertir a numpy array para FAISS
-    dimension = len(embeddings[0]) # 1536 para text-embedding-3-small
-    np_embeddings = np.array(embeddings).astype('float32')
+    ids_vigentes = sorted(metadatas)
+    # 1536 dimensiones para text-embedding-3-small
+    dimension = embeddings.shape[1] if len(embeddings) else index.d
+    vectores = escribir_vectores(origen, destino, index, dimension, siguiente_id, ids_vigentes,
+                                 ids_a_eliminar, ids_nuevos, embeddings)
+
+    en_lugar = (
+        index is not None
+        and params_previos is not None
+        and {k: v for k, v in params.items() if k != "nprobe" and k != "ef_busqueda"}
+            == {k: v for k, v in params_previos.items() if k != "nprobe" and k != "ef_busqueda"}
+        and (admite_eliminacion(params) or not ids_a_eliminar)
+    )
+    if en_lugar:
+        # Actualizar el índice en el lugar
+        if ids_a_eliminar:
+            index.remove_ids(np.array(ids_a_eliminar, dtype=np.int64))
+        for ids, bloque in _bloques_nuevos(ids_nuevos, embeddings):
+            index.add_with_ids(preparar_vectores(bloque, params), ids)
+        aplicar_parametros_busqueda(index, params)
+    else:
+        # Tipo nuevo, parámetros de construcción distintos o HNSW con eliminaciones:
+        # se reconstruye desde vectores.npy (sin volver a generar embeddings)
+        print(f"🏗️ Construyendo índice '{params['tipo']}' con {len(ids_vigentes)} vectores...")
+        ids = np.array(ids_vigentes, dtype=np.int64)
+        index = construir_indice(vectores[ids], ids, params)
+    del vectores, embeddings
+    if os.path.exists(embeddings_tmp):
+        os.remove(embeddings_tmp)
+
+    manifest = {"siguiente_id": siguiente_id, "version_troceo": VERSION_TROCEO, "archivos": nuevos_archivos}
+
+    # Guardar índice, almacén de chunks y manifiesto en la versión nueva
+    _guardar_atomico(os.path.join(destino, INDEX_ARCHIVO), lambda p: faiss.write_index(index, p))
+    guardar_parametros(os.path.join(destino, PARAMS_ARCHIVO), params)
+    escribir_chunk_store(os.path.join(destino, CHUNKS_ARCHIVO), metadatas)
+    # El índice léxico se reconstruye completo: solo tokeniza, no llama a la API
+    IndiceLexico.construir(
+        (chunk_id, meta["text"]) for chunk_id, meta in metadatas.items()
+    ).guardar(os.path.join(destino, LEXICO_ARCHIVO))
+    metadatas.cerrar()
+    os.remove(os.path.join(destino, CHUNKS_TMP_ARCHIVO))
+    def _escribir_manifest(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    _guardar_atomico(os.path.join(destino, MANIFEST_ARCHIVO), _escribir_manifest)
 
-    # Crear índice FAISS
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np_embeddings)
-    
-    # Guardar índice y metadatos
-    faiss.write_index(index, INDEX_PATH)
-    with open(METADATA_PATH, "wb") as f:
-        pickle.dump(all_metadatas, f)
+    # Publicación: un único reemplazo atómico del puntero ACTUAL
+    publicar_version(VECTOR_STORE_DIR, version)
+    borradas = limpiar_versiones(VECTOR_STORE_DIR, conservar)
 
     print(f"\n✨ Ingestión completada.")
-    print(f"   Índice guardado en: {INDEX_PATH}")
-    print(f"   Metadatos guardados en: {METADATA_PATH}")
+    print(f"   Versión publicada: {version} (anterior: {version_origen or 'sin versionar'})")
+    print(f"   Guardada en: {destino}")
+    if borradas:
+        print(f"   Versiones anteriores borradas: {len(borradas)}")
+    print(f"   Vectores agregados: {len(ids_nuevos) - descartados} | eliminados: {len(ids_a_eliminar)}")
+    print(f"   Tipo de índice: {params['tipo']} ({TIPOS_INDICE[params['tipo']]})")
     print(f"   Total vectores: {index.ntotal}")
 
+def reporte_recall(k=8, n_consultas=200, semilla=0):
+    """
+    Compara recall@k y latencia de cada tipo de índice contra la búsqueda exacta
+    (flat-ip) sobre los vectores del vector store actual. Las consultas son
+    vectores del corpus con un poco de ruido (simulan paráfrasis del texto).
+    """
+    import numpy as np
+    import faiss
+    from chatbot.chunk_store import ChunkStore
+    _, directorio = directorio_actual(VECTOR_STORE_DIR)
+    vectores_path = os.path.join(directorio, VECTORES_ARCHIVO)
+    chunks_path = os.path.join(directorio, CHUNKS_ARCHIVO)
+    if os.path.exists(vectores_path) and os.path.exists(chunks_path):
+        store = ChunkStore(chunks_path)
+        ids = np.array([chunk_id for chunk_id, _ in store.items()], dtype=np.int64)
+        store.close()
+        vectores = np.asarray(np.load(vectores_path, mmap_mode="r")[ids])
+    else:
+        index, metadatas, _ = cargar_estado(directorio)
+        if index is None:
+            print("❌ No hay vector store. Ejecute primero la ingestión.")
+            return
+        ids = np.array(sorted(metadatas), dtype=np.int64)
+        if hasattr(metadatas, "close"):
+            metadatas.close()
+        vectores = np.stack([index.reconstruct(int(i)) for i in ids])
+
+    rng = np.random.default_rng(semilla)
+    muestra = rng.choice(len(ids), size=min(n_consultas, len(ids)), replace=False)
+    consultas = vectores[muestra] + rng.normal(0, 0.02, size=(len(muestra), vectores.shape[1])).astype(np.float32)
+
+    exacto_params = nuevos_parametros("flat-ip")
+    exacto = construir_indice(vectores, ids, exacto_params)
+    _, verdad = exacto.search(preparar_vectores(consultas, exacto_params), k)
+
+    configuraciones = [("flat-ip", {}), ("sq-fp16", {}), ("sq8", {})]
+    configuraciones += [("hnsw", {"ef_busqueda": ef}) for ef in (16, 32, 64, 128)]
+    configuraciones += [("ivf-pq", {"nprobe": nprobe}) for nprobe in (1, 4, 16, 64)]
+
+    print(f"\n📊 Recall@{k} vs. latencia ({len(ids)} vectores, {len(muestra)} consultas)")
+    print(f"{'tipo':<10}{'parámetro':<16}{'recall':>8}{'ms/consulta':>13}{'MB':>9}{'build s':>9}")
+    construidos = {}
+    for tipo, busqueda in configuraciones:
+        try:
+            if tipo not in construidos:
+                params = nuevos_parametros(tipo)
+                inicio = time.perf_counter()
+                construidos[tipo] = (construir_indice(vectores, ids, params), params, time.perf_counter() - inicio)
+            index, params, t_build = construidos[tipo]
+        except ValueError as e:
+            print(f"{tipo:<10}{'-':<16}  omitido: {e}")
+            continue
+        params = {**params, **busqueda}
+        aplicar_parametros_busqueda(index, params)
+        q = preparar_vectores(consultas, params)
+        inicio = time.perf_counter()
+        for fila in q:
+            _, encontrados = index.search(fila.reshape(1, -1), k)
+        ms = (time.perf_counter() - inicio) * 1000 / len(q)
+        _, encontrados = index.search(q, k)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(encontrados, verdad)])
+        mb = len(faiss.serialize_index(index)) / 1e6
+        parametro = ", ".join(f"{c}={v}" for c, v in busqueda.items()) or "-"
+        print(f"{tipo:<10}{parametro:<16}{recall:>8.3f}{ms:>13.3f}{mb:>9.1f}{t_build:>9.2f}")
+
 if __name__ == "__main__":
-    ingest_docs()
+    parser = argparse.ArgumentParser(description="Ingesta los PDFs de docs/ en el vector store FAISS.")
+    parser.add_argument("--completo", action="store_true",
+                        help="Reconstruye todo desde cero ignorando el manifiesto (re-embebe todos los chunks).")
+    parser.add_argument("--procesos", type=int, default=1,
+                        help="Procesos para extraer y trocear PDFs en paralelo (por defecto 1).")
+    parser.add_argument("--concurrencia", type=int, default=1,
+                        help="Batches de embeddings enviados en paralelo (por defecto 1).")
+    parser.add_argument("--rpm", type=int, default=RPM_DEFAULT,
+                        help=f"Límite de peticiones por minuto a la API de embeddings (por defecto {RPM_DEFAULT}).")
+    parser.add_argument("--tpm", type=int, default=TPM_DEFAULT,
+                        help=f"Límite de tokens por minuto a la API de embeddings (por defecto {TPM_DEFAULT}).")
+    parser.add_argument("--tipo-indice", choices=list(TIPOS_INDICE),
+                        help="Tipo de índice FAISS (por defecto conserva el actual; 'flat-ip' si es nuevo).")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW: vecinos por nodo (M).")
+    parser.add_argument("--ef-construccion", type=int, help="HNSW: efConstruction.")
+    parser.add_argument("--ef-busqueda", type=int, help="HNSW: efSearch usado por el backend.")
+    parser.add_argument("--nlist", type=int, help="IVF-PQ: número de listas (por defecto automático).")
+    parser.add_argument("--pq-m", type=int, help="IVF-PQ: subcuantizadores (debe dividir 1536).")
+    parser.add_argument("--nprobe", type=int, help="IVF-PQ: listas visitadas por búsqueda en el backend.")
+    parser.add_argument("--reporte", action="store_true",
+                        help="No ingesta: imprime recall@k vs. latencia de cada tipo de índice sobre el corpus actual.")
+    parser.add_argument("--k", type=int, default=8, help="k para el reporte de recall (por defecto 8).")
+    parser.add_argument("--conservar", type=int, default=VERSIONES_CONSERVAR,
+                        help=f"Versiones anteriores del vector store que se conservan (por defecto {VERSIONES_CONSERVAR}).")
+    args = parser.parse_args()
+    if args.reporte:
+        reporte_recall(k=args.k)
+    else:
+        ingest_docs(completo=args.completo, procesos=args.procesos, concurrencia=args.concurrencia,
+                    rpm=args.rpm, tpm=args.tpm, tipo_indice=args.tipo_indice, conservar=args.conservar,
+                    parametros_indice={
+                        "hnsw_m": args.hnsw_m,
+                        "ef_construccion": args.ef_construccion,
+                        "ef_busqueda": args.ef_busqueda,
+                        "nlist": args.nlist,
+                        "pq_m": args.pq_m,
+                        "nprobe": args.nprobe,
+                    })